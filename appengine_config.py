@@ -0,0 +1,12 @@
+"""
+appengine_config.py -- puts the libraries vendored under lib/ on sys.path
+
+Refresh them with `pip install -t lib -r requirements.txt`.
+
+"""
+
+import os
+
+from google.appengine.ext import vendor
+
+vendor.add(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""
+archive.py -- moves conferences whose endDate has passed, with their
+    sessions, out of the hot Conference/Session kinds into
+    ArchivedConference/ArchivedSession, and resolves live keys that point
+    at archived entities
+
+An archived entity keeps its key path with the kinds swapped, so it stays
+in the organizer's entity group and websafe keys stored in Profiles keep
+resolving through getWithArchive()/getMultiWithArchive().
+
+"""
+
+import logging
+from datetime import date
+
+from google.appengine.ext import ndb
+
+from catalog import recordChanges
+from facets import facetDeltas
+from facets import facetValues
+from facets import queueFacetDeltas
+from models import ArchivedConference
+from models import ArchivedSession
+from models import Conference
+from models import Session
+from querylog import runQuery
+from storage import deleteEntities
+from storage import fetchPage
+from storage import getEntities
+from storage import getEntity
+from storage import putEntities
+from storage import putEntity
+from storage import transactional
+
+ARCHIVE_BATCH = 50              # conferences moved per task
+SESSION_BATCH = 200             # sessions copied per putEntities
+
+_TO_ARCHIVE = {'Conference': 'ArchivedConference',
+               'Session': 'ArchivedSession'}
+_TO_LIVE = dict((v, k) for k, v in _TO_ARCHIVE.iteritems())
+
+
+def _swapKinds(key, mapping):
+    flat = list(key.flat())
+    for i in range(0, len(flat), 2):
+        flat[i] = mapping.get(flat[i], flat[i])
+    return ndb.Key(flat=flat)
+
+
+def archivedKey(key):
+    """Return the archive key of a live Conference/Session key."""
+    return _swapKinds(key, _TO_ARCHIVE)
+
+
+def liveKey(key):
+    """Return the live key of an (possibly) archived key."""
+    return _swapKinds(key, _TO_LIVE)
+
+
+def isArchived(key):
+    return key.kind() in _TO_LIVE
+
+
+def getWithArchive(key):
+    """Get a live entity, falling back to its archived copy."""
+    entity = getEntity(key)
+    if entity is None and key.kind() in _TO_ARCHIVE:
+        entity = getEntity(archivedKey(key))
+    return entity
+
+
+def getMultiWithArchive(keys):
+    """get_multi() that falls back to archived copies for missing keys."""
+    entities = getEntities(keys)
+    missing = [i for i, e in enumerate(entities)
+               if e is None and keys[i].kind() in _TO_ARCHIVE]
+    if missing:
+        archived = getEntities([archivedKey(keys[i]) for i in missing])
+        for i, entity in zip(missing, archived):
+            entities[i] = entity
+    return entities
+
+
+# - - - archival job - - - - - - - - - - - - - - - - - - - -
+
+def _archiveSessions(conf_key):
+    """Copy a conference's sessions to the archive, then delete them."""
+    archived = 0
+    while True:
+        keys = runQuery(Session.query(ancestor=conf_key),
+                        limit=SESSION_BATCH, keys_only=True)
+        if not keys:
+            return archived
+        sessions = [s for s in getEntities(keys) if s is not None]
+        putEntities([ArchivedSession(key=archivedKey(s.key), **s.to_dict())
+                     for s in sessions])
+        deleteEntities(keys)
+        archived += len(sessions)
+
+
+@transactional()
+def _archiveConference(conf_key):
+    conf = getEntity(conf_key)
+    if conf is None:
+        return False
+    putEntity(ArchivedConference(key=archivedKey(conf_key), **conf.to_dict()))
+    deleteEntities([conf_key])
+    # facets count live conferences; deleting ones were already taken off
+    if not conf.deleting:
+        queueFacetDeltas(facetDeltas(facetValues(conf), set()),
+                         transactional=True)
+    return True
+
+
+def archiveConference(conf_key):
+    """Move one conference & its sessions to the archive; idempotent.
+
+    Sessions go first so a retry after a failure finds the conference
+    still live and finishes the move.
+    """
+    sessions = _archiveSessions(conf_key)
+    moved = _archiveConference(conf_key)
+    return moved, sessions
+
+
+def archiveBatch(cursor=None, today=None):
+    """Archive up to ARCHIVE_BATCH past conferences after `cursor`.
+
+    Returns the websafe cursor to continue from, or None when done.
+    """
+    today = today or date.today()
+    keys, next_cursor, more = fetchPage(
+        Conference.query(Conference.endDate < today), ARCHIVE_BATCH, cursor,
+        keys_only=True)
+    confs = sessions = 0
+    for key in keys:
+        moved, n = archiveConference(key)
+        confs += moved
+        sessions += n
+    recordChanges(keys)
+    if keys:
+        logging.info('archived %d conferences & %d sessions', confs,
+                     sessions)
+    return next_cursor if more and next_cursor else None
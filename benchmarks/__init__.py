@@ -0,0 +1,31 @@
+"""
+benchmarks -- performance benchmarks for the Conference API, run against
+    the App Engine testbed stubs with seeded datasets
+
+Run from the repository root, e.g.:
+
+    APPENGINE_SDK=/path/to/google_appengine python -m benchmarks.api --scale small
+
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setupSdk():
+    """Put the App Engine SDK, the app & its vendored libraries on
+    sys.path."""
+    sdk = os.environ.get('APPENGINE_SDK')
+    if sdk and sdk not in sys.path:
+        sys.path.insert(0, sdk)
+    try:
+        import dev_appserver
+    except ImportError:
+        sys.exit('App Engine SDK not found; set APPENGINE_SDK to the '
+                 'google_appengine directory.')
+    dev_appserver.fix_sys_path()
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import appengine_config     # adds lib/, as the runtime does
@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+
+"""
+api.py -- times every ConferenceApi method against the testbed stubs with a
+    seeded dataset, and writes a machine-readable JSON report
+
+    python -m benchmarks.api --scale small --repeat 20 --output bench.json
+
+With --backend sqlite the API reads & writes a local SQLite database
+instead of the datastore stub, which separates the cost of the API logic
+from the stub's.
+
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+from benchmarks import harness
+
+import webapp2
+import yaml
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
+from protorpc import message_types
+
+from main import app as handlers
+from conference import ConferenceApi
+from conference import CONF_GET_REQUEST
+from conference import CONF_POST_REQUEST
+from conference import CONF_SESS_POST_REQUEST
+from conference import FIELDS
+from conference import SESS_BY_SPEAKER_GET_REQUEST
+from conference import SESS_BY_TYPE_GET_REQUEST
+from conference import SESS_GET_REQUEST
+from conference import SESS_POST_REQUEST
+from conference import SESS_QUERY_GET_REQUEST
+from instrumentation import getStats
+from instrumentation import resetStats
+from models import ConferenceForm
+from models import ConferenceQueryForm
+from models import ConferenceQueryForms
+from models import ProfileMiniForm
+from models import TeeShirtSize
+from storage import SqliteRepository
+from storage import getEntity
+from storage import putEntity
+from storage import setRepository
+
+# sample filter value per queryable Conference property
+FILTER_VALUES = {
+    'city': 'London',
+    'topics': 'Medical Innovations',
+    'month': '6',
+    'maxAttendees': '100',
+}
+
+# datastore RPCs per call, by call type, that write paths must stay
+# within; a run exceeding one fails after writing its report
+RPC_BUDGETS = {
+    'saveProfile': {'Put': 1},
+    'registerForConference': {'Put': 1},
+    'unregisterFromConference': {'Put': 1},
+    # conference, organizer & the speaker linked to (seeded, so no put)
+    'createSession': {'Put': 1, 'Get': 3},
+    'addSessionToWishlist': {'Put': 1},
+    'deleteSessionInWishlist': {'Put': 1},
+    'updateSession': {'Put': 1},
+}
+
+
+def indexFilterShapes(path=None):
+    """Return the queryConferences filter shapes backed by index.yaml.
+
+    Every Conference composite index ending in `name` is an equality
+    shape over its leading properties; one inequality shape per field
+    is added on top.
+    """
+    path = path or os.path.join(harness.ROOT, 'index.yaml')
+    with open(path) as f:
+        indexes = yaml.safe_load(f).get('indexes') or []
+    by_prop = dict((prop, field) for field, prop in FIELDS.iteritems())
+
+    shapes = []
+    for index in indexes:
+        if index.get('kind') != 'Conference':
+            continue
+        props = [p['name'] for p in index.get('properties', [])]
+        if props[-1:] != ['name'] or not all(p in by_prop
+                                             for p in props[:-1]):
+            continue
+        shapes.append([(by_prop[p], 'EQ', FILTER_VALUES[p])
+                       for p in props[:-1]])
+    shapes.append([('MAX_ATTENDEES', 'GT', '50')])
+    shapes.append([('MONTH', 'GTEQ', '6'), ('CITY', 'EQ', 'London')])
+    shapes.append([('CITY', 'NE', 'London')])
+    return shapes
+
+
+def _queryForms(shape):
+    return ConferenceQueryForms(filters=[
+        ConferenceQueryForm(field=f, operator=op, value=v)
+        for f, op, v in shape])
+
+
+def _shapeName(shape):
+    return ','.join('%s %s' % (f, op) for f, op, v in shape) or 'none'
+
+
+class ApiBenchmark(object):
+    """ApiBenchmark -- seeded dataset plus one timing case per method"""
+
+    def __init__(self, data, repeat, rnd):
+        self.api = ConferenceApi()
+        self.data = data
+        self.repeat = repeat
+        self.rnd = rnd
+        self.results = []
+        self.violations = []
+
+    def _conf(self):
+        return self.rnd.choice(self.data['conferenceKeys'])
+
+    def _sess(self):
+        return self.rnd.choice(self.data['sessionKeys'])
+
+    def _organizerOf(self, key):
+        harness.setUser(key.parent().id())
+
+    def _attendee(self):
+        harness.setUser(harness.userEmail(
+            self.rnd.randrange(self.data['profiles'])))
+
+    def case(self, name, func, setup=None, **extra):
+        """Time func() and record its result plus instrumentation stats."""
+        resetStats()
+        samples = harness.timeCall(func, self.repeat, setup)
+        stats = getStats()
+        method = extra.pop('method', name)
+        if method in stats:
+            extra['datastoreRpcsPerCall'] = \
+                stats[method]['datastoreRpcsPerCall']
+            extra['datastoreRpcs'] = stats[method]['datastoreRpcs']
+            extra['itemsPerCall'] = stats[method]['itemsPerCall']
+            self._checkBudget(name, method, stats[method])
+        self.results.append(harness.summarize(name, samples, **extra))
+
+    def _checkBudget(self, name, method, stats):
+        for call, budget in sorted(RPC_BUDGETS.get(method, {}).items()):
+            per_call = stats['datastoreRpcs'].get(call, 0) / float(
+                stats['count'] or 1)
+            if per_call > budget:
+                self.violations.append('%s: %.2f %s RPCs per call, budget %d'
+                                       % (name, per_call, call, budget))
+
+    # - - - read paths - - - - - - - - - - - - - - - - - - - - -
+
+    def reads(self):
+        api = self.api
+        void = message_types.VoidMessage()
+        state = {}
+
+        def pickConf(i):
+            state['conf'] = self._conf()
+            self._attendee()
+
+        def pickSess(i):
+            state['sess'] = self._sess()
+            self._attendee()
+
+        self.case('getConference', lambda: api.getConference(
+            CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=state['conf'].urlsafe())),
+            setup=pickConf)
+        self.case('getConferencesCreated',
+                  lambda: api.getConferencesCreated(void),
+                  setup=lambda i: self._organizerOf(self._conf()))
+        for shape in [[]] + indexFilterShapes():
+            forms = _queryForms(shape)
+            self.case('queryConferences[%s]' % _shapeName(shape),
+                      lambda: api.queryConferences(forms),
+                      method='queryConferences', shape=_shapeName(shape))
+        self.case('getProfile', lambda: api.getProfile(void),
+                  setup=lambda i: self._attendee())
+        self.case('getAnnouncement', lambda: api.getAnnouncement(void))
+        self.case('getConferencesToAttend',
+                  lambda: api.getConferencesToAttend(void),
+                  setup=lambda i: self._attendee())
+        self.case('filterPlayground', lambda: api.filterPlayground(void))
+        self.case('getConferenceSessions', lambda: api.getConferenceSessions(
+            CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=state['conf'].urlsafe())),
+            setup=pickConf)
+        self.case('getConferenceSessionsByType',
+                  lambda: api.getConferenceSessionsByType(
+                      SESS_BY_TYPE_GET_REQUEST.combined_message_class(
+                          websafeConferenceKey=state['conf'].urlsafe(),
+                          typeOfSession='Workshop')),
+                  setup=pickConf)
+        self.case('getSessionsBySpeaker', lambda: api.getSessionsBySpeaker(
+            SESS_BY_SPEAKER_GET_REQUEST.combined_message_class(
+                speaker=self.rnd.choice(harness.SPEAKERS))))
+        self.case('getSessionsInWishlist', lambda: api.getSessionsInWishlist(
+            CONF_GET_REQUEST.combined_message_class()),
+            setup=lambda i: self._attendee())
+        self.case('getSession', lambda: api.getSession(
+            SESS_GET_REQUEST.combined_message_class(
+                websafeSessionKey=state['sess'].urlsafe())),
+            setup=pickSess)
+        self.case('getSessionsInDateRange',
+                  lambda: api.getSessionsInDateRange(
+                      SESS_QUERY_GET_REQUEST.combined_message_class(
+                          websafeConferenceKey=state['conf'].urlsafe(),
+                          startDate='2000-01-01', endDate='2100-01-01')),
+                  setup=pickConf)
+        self.case('queryPlayground', lambda: api.queryPlayground(void))
+        self.case('getFeaturedSpeaker', lambda: api.getFeaturedSpeaker(void))
+
+    # - - - write paths - - - - - - - - - - - - - - - - - - - -
+
+    def writes(self):
+        api = self.api
+        state = {}
+
+        def pickConf(i):
+            state['conf'] = self._conf()
+            self._organizerOf(state['conf'])
+
+        def pickSess(i):
+            state['sess'] = self._sess()
+            self._organizerOf(state['sess'].parent())
+
+        def pickAttendee(i):
+            state['conf'] = self._conf()
+            self._attendee()
+
+        self.case('createConference', lambda: api.createConference(
+            ConferenceForm(name='Bench %f' % time.time(), city='London',
+                           topics=['Medical Innovations'],
+                           startDate='2030-06-01', endDate='2030-06-03',
+                           maxAttendees=100)),
+            setup=lambda i: self._attendee())
+        self.case('updateConference', lambda: api.updateConference(
+            CONF_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=state['conf'].urlsafe(),
+                description='updated %f' % time.time())),
+            setup=pickConf)
+        self.case('saveProfile', lambda: api.saveProfile(
+            ProfileMiniForm(displayName='Bench %d' % self.rnd.randrange(1000),
+                            teeShirtSize=TeeShirtSize.M_M)),
+            setup=lambda i: self._attendee())
+        self.case('registerForConference', lambda: self._swallow(
+            api.registerForConference,
+            CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=state['conf'].urlsafe())),
+            setup=pickAttendee)
+        self.case('unregisterFromConference',
+                  lambda: api.unregisterFromConference(
+                      CONF_GET_REQUEST.combined_message_class(
+                          websafeConferenceKey=state['conf'].urlsafe())),
+                  setup=pickAttendee)
+        self.case('createSession', lambda: api.createSession(
+            CONF_SESS_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=state['conf'].urlsafe(),
+                name='Bench session', speaker=self.rnd.choice(
+                    harness.SPEAKERS),
+                date='2030-06-01', startTime='10:00')),
+            setup=pickConf)
+        self.case('addSessionToWishlist', lambda: self._swallow(
+            api.addSessionToWishlist,
+            SESS_GET_REQUEST.combined_message_class(
+                websafeSessionKey=state['sess'].urlsafe())),
+            setup=pickSess)
+        self.case('deleteSessionInWishlist',
+                  lambda: api.deleteSessionInWishlist(
+                      SESS_GET_REQUEST.combined_message_class(
+                          websafeSessionKey=state['sess'].urlsafe())),
+                  setup=pickSess)
+        self.case('updateSession', lambda: api.updateSession(
+            SESS_POST_REQUEST.combined_message_class(
+                websafeSessionKey=state['sess'].urlsafe(),
+                highlists='updated')),
+            setup=pickSess)
+
+        victims = list(self.data['sessionKeys'][-self.repeat:])
+        self.case('deleteSession', lambda: api.deleteSession(
+            SESS_POST_REQUEST.combined_message_class(
+                websafeSessionKey=state['sess'].urlsafe())),
+            setup=lambda i: (state.update(sess=victims[i]),
+                             self._organizerOf(victims[i].parent())))
+
+    @staticmethod
+    def _swallow(method, request):
+        """Call a registration method, ignoring already-registered errors."""
+        try:
+            return method(request)
+        except Exception as e:
+            if getattr(e, 'http_status', None) != 409:
+                raise
+
+    # - - - tasks & concurrency - - - - - - - - - - - - - - - -
+
+    def tasks(self):
+        def featuredSpeaker():
+            req = webapp2.Request.blank('/tasks/featured_speaker', POST={
+                'speaker': self.rnd.choice(harness.SPEAKERS)})
+            resp = req.get_response(handlers)
+            assert resp.status_int == 204, resp.status
+
+        self.case('task:featured_speaker', featuredSpeaker,
+                  method='FeaturedSpeakerHandler')
+        self.case('cron:set_announcement', lambda: webapp2.Request.blank(
+            '/crons/set_announcement').get_response(handlers),
+            method='SetAnnouncementHandler')
+        # drains the notifications queued by the createConference case
+        self.case('cron:send_notifications', lambda: webapp2.Request.blank(
+            '/crons/send_notifications').get_response(handlers),
+            method='SendNotificationsHandler')
+
+    def concurrentRegistration(self, threads):
+        """Register `threads` distinct users for one conference at once."""
+        conf_key = self._conf()
+        conf = getEntity(conf_key)
+        conf.seatsAvailable = conf.maxAttendees = threads * 2
+        putEntity(conf)
+        wsck = conf_key.urlsafe()
+        samples = []
+        outcome = {'ok': 0, 'conflict': 0, 'failed': 0}
+        lock = threading.Lock()
+        start_gate = threading.Event()
+
+        def worker(i):
+            harness.setUser(harness.userEmail(
+                self.data['profiles'] + i))
+            start_gate.wait()
+            start = time.time()
+            try:
+                self.api.registerForConference(
+                    CONF_GET_REQUEST.combined_message_class(
+                        websafeConferenceKey=wsck))
+                result = 'ok'
+            except datastore_errors.TransactionFailedError:
+                result = 'failed'
+            except Exception as e:
+                if getattr(e, 'http_status', None) != 409:
+                    raise
+                result = 'conflict'
+            elapsed = (time.time() - start) * 1000.0
+            with lock:
+                samples.append(elapsed)
+                outcome[result] += 1
+
+        workers = [threading.Thread(target=worker, args=(i,))
+                   for i in range(threads)]
+        for w in workers:
+            w.start()
+        wall = time.time()
+        start_gate.set()
+        for w in workers:
+            w.join()
+        wall = (time.time() - wall) * 1000.0
+
+        ndb.get_context().clear_cache()
+        seats = getEntity(conf_key).seatsAvailable
+        self.results.append(harness.summarize(
+            'registerForConference[concurrent=%d]' % threads, samples,
+            wallMs=round(wall, 3), outcome=outcome,
+            seatsTaken=threads * 2 - seats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', choices=sorted(harness.SCALES),
+                        default='small')
+    for name in ('conferences', 'sessions', 'profiles', 'attend'):
+        parser.add_argument('--' + name, type=int,
+                            help='override the scale preset')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--backend', choices=('ndb', 'sqlite'),
+                        default='ndb')
+    parser.add_argument('--sqlite-path', default=':memory:')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    params = dict(harness.SCALES[args.scale])
+    for name in params:
+        if getattr(args, name) is not None:
+            params[name] = getattr(args, name)
+
+    tb = harness.activateTestbed()
+    if args.backend == 'sqlite':
+        setRepository(SqliteRepository(args.sqlite_path))
+    try:
+        rnd = random.Random(args.seed)
+        start = time.time()
+        data = harness.seed(rnd=rnd, **params)
+        seed_ms = (time.time() - start) * 1000.0
+
+        bench = ApiBenchmark(data, args.repeat, rnd)
+        bench.reads()
+        bench.writes()
+        bench.tasks()
+        bench.concurrentRegistration(args.threads)
+
+        params.update(scale=args.scale, repeat=args.repeat,
+                      threads=args.threads, seed=args.seed,
+                      backend=args.backend,
+                      seedMs=round(seed_ms, 1))
+        harness.writeReport('api', params, bench.results, args.output)
+    finally:
+        tb.deactivate()
+    if bench.violations:
+        sys.exit('RPC budgets exceeded:\n' + '\n'.join(bench.violations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+"""
+columnar.py -- queryConferences filtering over the in-memory catalog
+    snapshot against the datastore query path, plus snapshot load, fetch
+    (of the published snapshot) and incremental refresh times, written as
+    a JSON report
+
+    python -m benchmarks.columnar --conferences 50000 --repeat 20
+
+Filter shapes with inequalities on two fields cannot run as one datastore
+query; their datastore baseline queries on the first inequality field and
+applies the rest in memory.
+
+"""
+
+import argparse
+import operator
+import random
+
+from benchmarks import harness
+
+import catalog
+from conference import ConferenceApi
+from conference import FIELDS
+from conference import OPERATORS
+from models import ConferenceQueryForm
+from models import ConferenceQueryForms
+from querylog import runQuery
+
+SHAPES = [
+    [('CITY', 'EQ', 'London')],
+    [('TOPIC', 'EQ', 'Medical Innovations'), ('MONTH', 'EQ', '6')],
+    [('MAX_ATTENDEES', 'GT', '50')],
+    [('MONTH', 'GTEQ', '3'), ('MONTH', 'LTEQ', '8')],
+    [('CITY', 'NE', 'London')],
+    [('MONTH', 'GTEQ', '6'), ('MAX_ATTENDEES', 'GT', '50')],
+    [('CITY', 'EQ', 'Paris'), ('MONTH', 'LT', '4'),
+     ('MAX_ATTENDEES', 'GTEQ', '100')],
+]
+LOAD_REPEAT = 3                 # full loads are slow at 50k conferences
+COMPARE = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+def _forms(shape):
+    return ConferenceQueryForms(filters=[
+        ConferenceQueryForm(field=f, operator=o, value=v)
+        for f, o, v in shape])
+
+
+def _shapeName(shape):
+    return ' AND '.join('%s %s %s' % f for f in shape)
+
+
+def _split(shape):
+    """Split a shape into what one datastore query can take and the
+    inequalities on further fields, as (field, symbol, value) residuals.
+    """
+    first = None
+    query, residual = [], []
+    for field, op, value in shape:
+        if op != 'EQ':
+            first = first or field
+            if field != first:
+                if FIELDS[field] in ('month', 'maxAttendees'):
+                    value = int(value)
+                residual.append((FIELDS[field], OPERATORS[op], value))
+                continue
+        query.append((field, op, value))
+    return query, residual
+
+
+def _matches(conf, residual):
+    return all(COMPARE[op](getattr(conf, field), value)
+               for field, op, value in residual)
+
+
+class ColumnarBenchmark(object):
+    """ColumnarBenchmark -- one seeded catalog, timed both ways"""
+
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.api = ConferenceApi()
+        self.results = []
+
+    def case(self, name, func, setup=None, repeat=None, **extra):
+        samples = harness.timeCall(func, repeat or self.repeat, setup)
+        self.results.append(harness.summarize(name, samples, **extra))
+
+    def load(self):
+        version = catalog._currentVersion()
+        self.case('load', lambda: catalog._load(version), repeat=LOAD_REPEAT)
+        rows = len(catalog.buildCatalog())
+        self.results[-1]['rows'] = rows
+        # what an instance without a snapshot does in a request
+        self.case('fetchPublished', catalog._fetchPublished,
+                  repeat=LOAD_REPEAT, rows=rows)
+        self.snapshot = catalog.currentSnapshot()
+
+    def queries(self):
+        for shape in SHAPES:
+            name = _shapeName(shape)
+            query, residual = _split(shape)
+            forms = _forms(query)
+
+            def datastore():
+                return [c for c in runQuery(self.api._getQuery(forms)[0])
+                        if not c.deleting and _matches(c, residual)]
+            expected = len(datastore())
+            self.case('datastore[%s]' % name, datastore, shape=name,
+                      results=expected, residualFields=len(residual))
+
+            forms_all = _forms(shape)
+            found = len(self.api._querySnapshot(self.snapshot, forms_all))
+            if found != expected:
+                raise AssertionError('%s: snapshot found %d, datastore %d'
+                                     % (name, found, expected))
+            self.case('snapshot[%s]' % name,
+                      lambda: self.api._querySnapshot(self.snapshot,
+                                                      forms_all),
+                      shape=name, results=found)
+            filters = [(f['field'], f['operator'], f['value']) for f in
+                       self.api._formatFilters(
+                           forms_all.filters, multiple_inequalities=True)[1]]
+            self.case('snapshotMatch[%s]' % name,
+                      lambda: self.snapshot.match(filters),
+                      shape=name, results=found)
+
+    def refresh(self, keys):
+        rnd = random.Random(7)
+
+        def change(i):
+            conf = rnd.choice(keys).get()
+            conf.seatsAvailable = rnd.randint(0, conf.maxAttendees or 0)
+            conf.put()
+            catalog.recordChanges([conf.key])
+        self.case('refresh[1 change]', catalog.currentSnapshot, setup=change)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--conferences', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    tb = harness.activateTestbed()
+    try:
+        data = harness.seed(conferences=args.conferences, sessions=0,
+                            profiles=1000, attend=0)
+        harness.setUser(harness.userEmail(0))
+        bench = ColumnarBenchmark(args.repeat)
+        bench.load()
+        bench.queries()
+        bench.refresh(data['conferenceKeys'])
+    finally:
+        tb.deactivate()
+    harness.writeReport('columnar', vars(args), bench.results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+
+"""
+harness.py -- shared benchmark plumbing: testbed activation, per-thread
+    fake users, dataset seeding, timing & JSON output
+
+"""
+
+import json
+import platform
+import random
+import threading
+import time
+from datetime import date
+from datetime import time as dtime
+from datetime import timedelta
+
+from benchmarks import ROOT
+from benchmarks import setupSdk
+
+setupSdk()
+
+import endpoints
+from google.appengine.api import users
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference
+from models import Profile
+from models import Session
+from models import Speaker
+from speakers import speakerKey
+from storage import putEntities
+
+# dataset sizes; 'full' is the production-like scale we track releases at
+SCALES = {
+    'tiny':   dict(conferences=50, sessions=500, profiles=100, attend=10),
+    'small':  dict(conferences=500, sessions=10000, profiles=2000, attend=25),
+    'medium': dict(conferences=2000, sessions=100000, profiles=20000,
+                   attend=50),
+    'full':   dict(conferences=10000, sessions=1000000, profiles=100000,
+                   attend=100),
+}
+
+CITIES = ['London', 'Paris', 'Tokyo', 'San Francisco', 'Chicago', 'Berlin',
+          'Singapore', 'Sydney', 'Toronto', 'Default City']
+TOPICS = ['Medical Innovations', 'Programming Languages', 'Web Technologies',
+          'Movie Making', 'Health and Nutrition', 'Default', 'Topic']
+SESSION_TYPES = ['Default', 'Session', 'Workshop', 'Tutorial', 'Lecture',
+                 'Keynote']
+SPEAKERS = ['Speaker %d' % i for i in range(200)]
+BATCH_SIZE = 500
+EMAIL_DOMAIN = 'bench.example.com'
+
+
+# - - - testbed & users - - - - - - - - - - - - - - - - - - -
+
+def activateTestbed():
+    """Activate a testbed with datastore_v3, memcache & taskqueue stubs."""
+    tb = testbed.Testbed()
+    tb.activate()
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+        probability=1)
+    tb.init_datastore_v3_stub(consistency_policy=policy,
+                              require_indexes=False)
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=ROOT)
+    tb.init_app_identity_stub()
+    tb.init_urlfetch_stub()
+    tb.init_mail_stub()
+    tb.init_user_stub()
+    tb.init_search_stub()
+    return tb
+
+
+_user = threading.local()
+
+
+def _currentUser():
+    email = getattr(_user, 'email', None)
+    return users.User(email, EMAIL_DOMAIN) if email else None
+
+# endpoints reads the user from os.environ, which is process-wide; route it
+# through a thread-local so concurrent benchmark threads act as distinct users
+endpoints.get_current_user = _currentUser
+
+
+def setUser(email):
+    """Make subsequent API calls on this thread act as `email`."""
+    _user.email = email
+
+
+def userEmail(i):
+    return 'user%d@%s' % (i, EMAIL_DOMAIN)
+
+
+def newRequest():
+    """Reset per-request state, like a fresh instance request would."""
+    ndb.get_context().clear_cache()
+
+
+# - - - seeding - - - - - - - - - - - - - - - - - - - - - - -
+
+def _putBatched(entities):
+    for i in range(0, len(entities), BATCH_SIZE):
+        putEntities(entities[i:i + BATCH_SIZE])
+
+
+def seed(conferences, sessions, profiles, attend, rnd=None):
+    """Seed the configured repository; return a dict describing what was
+    written.
+
+    Profiles get `attend`-long conferenceKeysToAttend lists; the first
+    tenth of the profiles act as conference organizers.
+    """
+    rnd = rnd or random.Random(42)
+    organizers = max(1, profiles // 10)
+    today = date.today()
+
+    conf_keys = []
+    batch = []
+    for i in range(conferences):
+        organizer = userEmail(i % organizers)
+        p_key = ndb.Key(Profile, organizer)
+        start = today + timedelta(days=rnd.randint(-365, 365))
+        max_attendees = rnd.choice([0, 10, 50, 100, 500, 1000])
+        key = ndb.Key(Conference, i + 1, parent=p_key)
+        batch.append(Conference(
+            key=key,
+            name='Conference %06d' % i,
+            description='Benchmark conference %d' % i,
+            organizerUserId=organizer,
+            topics=rnd.sample(TOPICS, rnd.randint(1, 3)),
+            city=rnd.choice(CITIES),
+            startDate=start,
+            month=start.month,
+            endDate=start + timedelta(days=rnd.randint(0, 4)),
+            maxAttendees=max_attendees,
+            seatsAvailable=rnd.randint(0, max_attendees),
+        ))
+        conf_keys.append(key)
+        if len(batch) >= BATCH_SIZE:
+            _putBatched(batch)
+            batch = []
+    _putBatched(batch)
+
+    speaker_keys = dict((name, speakerKey(name)) for name in SPEAKERS)
+    _putBatched([Speaker(key=key, name=name)
+                 for name, key in sorted(speaker_keys.items())])
+
+    websafe = [k.urlsafe() for k in conf_keys]
+    batch = []
+    sess_keys = []
+    for i in range(sessions):
+        c_key = conf_keys[i % len(conf_keys)]
+        key = ndb.Key(Session, i + 1, parent=c_key)
+        speaker = rnd.choice(SPEAKERS)
+        batch.append(Session(
+            key=key,
+            name='Session %07d' % i,
+            highlists='Benchmark session %d' % i,
+            speaker=speaker,
+            speakerKey=speaker_keys[speaker],
+            duration=rnd.choice([30, 45, 60, 90, 120]),
+            typeOfSession=[rnd.choice(SESSION_TYPES)],
+            date=today + timedelta(days=rnd.randint(-365, 365)),
+            startTime=dtime(rnd.randint(8, 20), rnd.choice([0, 30])),
+            organizerUserId=c_key.parent().id(),
+        ))
+        if len(sess_keys) < 1000:
+            sess_keys.append(key)
+        if len(batch) >= BATCH_SIZE:
+            _putBatched(batch)
+            batch = []
+    _putBatched(batch)
+
+    batch = []
+    attend = min(attend, len(websafe))
+    for i in range(profiles):
+        email = userEmail(i)
+        batch.append(Profile(
+            key=ndb.Key(Profile, email),
+            displayName='User %d' % i,
+            mainEmail=email,
+            teeShirtSize='NOT_SPECIFIED',
+            conferenceKeysToAttend=rnd.sample(websafe, attend),
+            sessionKeysToAttend=[k.urlsafe() for k in
+                                 rnd.sample(sess_keys, min(10, len(sess_keys)))],
+        ))
+        if len(batch) >= BATCH_SIZE:
+            _putBatched(batch)
+            batch = []
+    _putBatched(batch)
+
+    return {
+        'conferenceKeys': conf_keys,
+        'sessionKeys': sess_keys,
+        'profiles': profiles,
+        'organizers': organizers,
+    }
+
+
+# - - - timing & output - - - - - - - - - - - - - - - - - - -
+
+def _pct(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100.0))]
+
+
+def summarize(name, samples_ms, **extra):
+    """Return a result record for a list of latencies (ms)."""
+    record = {
+        'name': name,
+        'runs': len(samples_ms),
+        'meanMs': round(sum(samples_ms) / max(1, len(samples_ms)), 3),
+        'minMs': round(min(samples_ms), 3) if samples_ms else 0.0,
+        'p50Ms': round(_pct(samples_ms, 50), 3),
+        'p95Ms': round(_pct(samples_ms, 95), 3),
+        'maxMs': round(max(samples_ms), 3) if samples_ms else 0.0,
+    }
+    record.update(extra)
+    return record
+
+
+def timeCall(func, repeat, setup=None):
+    """Call func() `repeat` times (each as a fresh request); return ms list."""
+    samples = []
+    for i in range(repeat):
+        if setup:
+            setup(i)
+        newRequest()
+        start = time.time()
+        func()
+        samples.append((time.time() - start) * 1000.0)
+    return samples
+
+
+def writeReport(suite, params, results, output=None):
+    """Write a machine-readable JSON report to `output` (or stdout)."""
+    report = {
+        'suite': suite,
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'params': params,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print text
+    return report
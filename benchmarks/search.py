@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""
+search.py -- indexing & query latency of the text search backends over a
+    synthetic corpus of conference & session documents, written as a
+    machine-readable JSON report
+
+    python -m benchmarks.search --docs 100000 --repeat 50 --output search.json
+
+"""
+
+import argparse
+import bisect
+import random
+import time
+
+from benchmarks import harness
+
+from textsearch import Document
+from textsearch import LocalSearchIndex
+from textsearch import SearchApiIndex
+
+BACKENDS = {
+    'local': LocalSearchIndex,
+    'searchapi': SearchApiIndex,
+}
+VOCABULARY = 5000
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'ta', 'vo', 'zi', 'pe', 'sa',
+             'do', 'gu', 'ha', 'ri', 'to', 'ben']
+CONFERENCE_SHARE = 0.2
+
+
+class Corpus(object):
+    """Corpus -- synthetic documents with Zipf-distributed words"""
+
+    def __init__(self, rnd, vocabulary=VOCABULARY):
+        self.rnd = rnd
+        words = set()
+        while len(words) < vocabulary:
+            words.add(''.join(rnd.choice(SYLLABLES)
+                              for _ in range(rnd.randint(2, 4))))
+        # most frequent first
+        self.words = sorted(words, key=lambda w: (len(w), w))
+        self.cumulative = []
+        total = 0.0
+        for rank in range(len(self.words)):
+            total += 1.0 / (rank + 1)
+            self.cumulative.append(total)
+
+    def word(self):
+        x = self.rnd.random() * self.cumulative[-1]
+        return self.words[bisect.bisect_left(self.cumulative, x)]
+
+    def text(self, low, high):
+        return ' '.join(self.word()
+                        for _ in range(self.rnd.randint(low, high)))
+
+    def document(self, i):
+        name = self.text(3, 6)
+        if self.rnd.random() < CONFERENCE_SHARE:
+            return Document('doc%07d' % i, 'Conference', name, {
+                'name': name, 'description': self.text(10, 20)})
+        return Document('doc%07d' % i, 'Session', name, {
+            'name': name, 'highlists': self.text(5, 15),
+            'speaker': self.rnd.choice(harness.SPEAKERS)})
+
+
+class SearchBenchmark(object):
+
+    def __init__(self, index, corpus, repeat):
+        self.index = index
+        self.corpus = corpus
+        self.repeat = repeat
+        self.results = []
+
+    def build(self, docs):
+        """Index `docs` documents in batches; record throughput."""
+        samples = []
+        for start in range(0, docs, harness.BATCH_SIZE):
+            batch = [self.corpus.document(i) for i in
+                     range(start, min(docs, start + harness.BATCH_SIZE))]
+            begin = time.time()
+            self.index.put(batch)
+            samples.append((time.time() - begin) * 1000.0)
+        self.results.append(harness.summarize(
+            'put[batch=%d]' % harness.BATCH_SIZE, samples,
+            docsPerSecond=round(docs / max(sum(samples) / 1000.0, 1e-9), 1)))
+
+    def queries(self):
+        words = self.corpus.words
+        cases = [
+            ('common term', words[0], None),
+            ('mid term', words[50], None),
+            ('rare term', words[2000], None),
+            ('two terms', '%s %s' % (words[0], words[10]), None),
+            ('three terms', '%s %s %s' % (words[1], words[5], words[30]),
+             None),
+            ('prefix', words[5][:3], None),
+            ('term + prefix', '%s %s' % (words[0], words[20][:4]), None),
+            ('speaker', 'speaker 42', 'Session'),
+            ('term, conferences only', words[3], 'Conference'),
+            ('no match', 'qqqzzz', None),
+        ]
+        for name, text, kind in cases:
+            hits = self.index.search(text, kind=kind)
+            samples = harness.timeCall(
+                lambda: self.index.search(text, kind=kind), self.repeat)
+            self.results.append(harness.summarize(
+                'search[%s]' % name, samples, query=text, kind=kind,
+                hits=len(hits)))
+
+    def updates(self, docs):
+        """Time re-indexing & removing single documents, as the
+        /tasks/search_index handler does after each write.
+        """
+        rnd = self.corpus.rnd
+        changed = iter([self.corpus.document(rnd.randrange(docs))
+                        for _ in range(self.repeat)])
+        self.results.append(harness.summarize(
+            'put[single]', harness.timeCall(
+                lambda: self.index.put([next(changed)]), self.repeat)))
+        removed = iter(['doc%07d' % rnd.randrange(docs)
+                        for _ in range(self.repeat)])
+        self.results.append(harness.summarize(
+            'delete[single]', harness.timeCall(
+                lambda: self.index.delete([next(removed)]), self.repeat)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--docs', type=int, default=100000)
+    parser.add_argument('--backend', choices=sorted(BACKENDS),
+                        default='local')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    tb = harness.activateTestbed()
+    try:
+        corpus = Corpus(random.Random(args.seed))
+        bench = SearchBenchmark(BACKENDS[args.backend](), corpus,
+                                args.repeat)
+        bench.build(args.docs)
+        bench.queries()
+        bench.updates(args.docs)
+        harness.writeReport('search', {
+            'docs': args.docs, 'backend': args.backend,
+            'repeat': args.repeat, 'seed': args.seed,
+        }, bench.results, args.output)
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+startup.py -- cold-start cost of a fresh instance: module import time and
+    the latency of the first API requests, with and without /_ah/warmup,
+    each run in a new interpreter and written as a JSON report
+
+    python -m benchmarks.startup --runs 10 --output startup.json
+
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+# harness is imported lazily: the child must not load the app before
+# timing its import
+from benchmarks import ROOT
+from benchmarks import setupSdk
+
+MODES = ('cold', 'warmup')
+FIRST_REQUESTS = (
+    ('getAnnouncement', {}),
+    ('queryConferences', {'filters': []}),
+    ('getConferenceFacets', {}),
+)
+
+
+def _spiCall(api, method, body):
+    import webapp2
+    request = webapp2.Request.blank(
+        '/_ah/spi/ConferenceApi.%s' % method, POST=json.dumps(body),
+        headers={'Content-Type': 'application/json',
+                 'X-AppEngine-Peer': 'apiserving'})
+    start = time.time()
+    response = request.get_response(api)
+    elapsed = (time.time() - start) * 1000.0
+    if response.status_int != 200:
+        raise RuntimeError('%s returned %s' % (method, response.status))
+    return elapsed
+
+
+def child(mode):
+    """Time one instance start in this (fresh) interpreter; print JSON."""
+    setupSdk()
+    timings = {}
+    start = time.time()
+    import main
+    timings['importMain'] = (time.time() - start) * 1000.0
+    import conference
+
+    from benchmarks import harness as h
+    tb = h.activateTestbed()
+    try:
+        h.seed(**h.SCALES['tiny'])
+        h.setUser(h.userEmail(0))
+        if mode == 'warmup':
+            import webapp2
+            start = time.time()
+            webapp2.Request.blank('/_ah/warmup').get_response(main.app)
+            timings['warmup'] = (time.time() - start) * 1000.0
+        for method, body in FIRST_REQUESTS:
+            h.newRequest()
+            timings['first:' + method] = _spiCall(conference.api, method,
+                                                  body)
+            h.newRequest()
+            timings['second:' + method] = _spiCall(conference.api, method,
+                                                   body)
+    finally:
+        tb.deactivate()
+    print json.dumps(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child)
+
+    from benchmarks import harness
+    results = []
+    for mode in MODES:
+        samples = {}
+        for _ in range(args.runs):
+            start = time.time()
+            out = subprocess.check_output(
+                [sys.executable, '-m', 'benchmarks.startup',
+                 '--child', mode], cwd=ROOT)
+            wall = (time.time() - start) * 1000.0
+            timings = json.loads(out.strip().splitlines()[-1])
+            timings['process'] = wall
+            for name, ms in timings.iteritems():
+                samples.setdefault(name, []).append(ms)
+        for name in sorted(samples):
+            results.append(harness.summarize('%s[%s]' % (name, mode),
+                                             samples[name], mode=mode))
+    harness.writeReport('startup', {'runs': args.runs}, results,
+                        args.output)
+
+
+if __name__ == '__main__':
+    main()
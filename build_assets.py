@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+"""
+build_assets.py -- bundles the web client for deployment: the local
+    stylesheets and scripts of templates/index.html are concatenated and
+    minified, the Angular partials are inlined into $templateCache, and
+    the bundles get content-hashed names, so app.yaml serves them with
+    far-future expiration
+
+    python build_assets.py
+
+Reads templates/index.html and writes static/dist/index.html plus
+static/dist/assets/app.<hash>.css & app.<hash>.js, removing bundles of
+earlier builds. Run it after changing anything under static/js,
+static/bootstrap/css, static/partials or templates/index.html, and
+deploy the result.
+
+The index marks what to bundle between <!-- build:css --> or
+<!-- build:js --> and <!-- endbuild -->; only local files (href/src
+starting with a single '/') are bundled, CDN tags are kept as they are.
+
+The minifiers keep strings, regular expressions, /*! license comments
+and line breaks (so JavaScript's automatic semicolon insertion still
+sees them); they drop other comments and indentation.
+
+"""
+
+import glob
+import hashlib
+import json
+import os
+import re
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+INDEX = os.path.join(ROOT, 'templates', 'index.html')
+DIST = os.path.join(ROOT, 'static', 'dist')
+ASSETS = os.path.join(DIST, 'assets')
+ASSET_URL = '/assets'
+PARTIALS = os.path.join(ROOT, 'static', 'partials')
+PARTIAL_URL = '/partials'
+MODULE = 'conferenceApp'
+HASH_LENGTH = 12
+
+# URL prefix -> directory, as mapped in app.yaml
+STATIC_DIRS = {
+    '/js/': os.path.join(ROOT, 'static', 'js'),
+    '/css/': os.path.join(ROOT, 'static', 'bootstrap', 'css'),
+}
+
+_BLOCK_RE = re.compile(r'[ \t]*<!-- build:(css|js) -->(.*?)<!-- endbuild -->',
+                       re.S)
+_LOCAL_RE = {
+    'css': re.compile(r'<link rel="stylesheet" href="(/[^/"][^"]*)">'),
+    'js': re.compile(r'<script src="(/[^/"][^"]*)"></script>'),
+}
+_TAG = {
+    'css': '<link rel="stylesheet" href="%s">',
+    'js': '<script src="%s"></script>',
+}
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read().decode('utf-8')
+
+
+def _localPath(url):
+    for prefix, directory in STATIC_DIRS.items():
+        if url.startswith(prefix):
+            return os.path.join(directory, url[len(prefix):])
+    raise ValueError('no static directory serves %s' % url)
+
+
+# - - - minifiers - - - - - - - - - - - - - - - - - - - - - - -
+
+_CSS_COMMENT_RE = re.compile(r'/\*(?!!).*?\*/', re.S)
+_CSS_SPACE_RE = re.compile(r'\s+')
+_CSS_PUNCT_RE = re.compile(r'\s*([{};,>])\s*')
+_CSS_BLOCK_RE = re.compile(r'\{[^{}]*\}')
+_CSS_COLON_RE = re.compile(r'\s*:\s*')
+
+
+def minifyCss(text):
+    """Drop comments (but /*! ones) & whitespace that CSS ignores."""
+    text = _CSS_COMMENT_RE.sub('', text)
+    text = _CSS_SPACE_RE.sub(' ', text)
+    text = _CSS_PUNCT_RE.sub(r'\1', text)
+    # a colon may only lose its spaces inside declarations, not selectors
+    text = _CSS_BLOCK_RE.sub(lambda m: _CSS_COLON_RE.sub(':', m.group(0)),
+                             text)
+    return text.replace(';}', '}').strip()
+
+
+# a '/' after one of these (or a keyword) starts a regular expression
+_REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+_REGEX_KEYWORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'new',
+                   'throw', 'void', 'delete', 'instanceof')
+
+
+def _isWord(ch):
+    return ch.isalnum() or ch in '_$'
+
+
+def minifyJs(text):
+    """Drop comments (but /*! ones), indentation, blank lines & spaces
+    that do not separate two words; keep line breaks.
+    """
+    out = []
+    i, n = 0, len(text)
+    pending = [False, False]       # space, line break seen since last token
+
+    def last():
+        for chunk in reversed(out):
+            if chunk:
+                return chunk[-1]
+        return ''
+
+    def emit(chunk):
+        if pending[1] and out:
+            out.append('\n')
+        elif pending[0] and (_isWord(last()) and _isWord(chunk[0]) or
+                             last() in '+-' and chunk[0] == last()):
+            out.append(' ')
+        out.append(chunk)
+        pending[:] = [False, False]
+
+    while i < n:
+        ch = text[i]
+        if ch in ' \t\r':
+            pending[0] = True
+            i += 1
+        elif ch == '\n':
+            pending[1] = True
+            i += 1
+        elif text.startswith('//', i):
+            end = text.find('\n', i)
+            i = n if end < 0 else end
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            end = n if end < 0 else end + 2
+            if text.startswith('/*!', i):
+                emit(text[i:end])
+            else:
+                pending[0] = True
+            i = end
+        elif ch in '"\'`' or (ch == '/' and _regexAllowed(''.join(out))):
+            j = i + 1
+            in_class = False
+            while j < n and (text[j] != ch or in_class):
+                if text[j] == '\\':
+                    j += 1
+                elif ch == '/' and text[j] == '[':
+                    in_class = True
+                elif ch == '/' and text[j] == ']':
+                    in_class = False
+                elif text[j] == '\n' and ch != '`':
+                    raise ValueError('unterminated literal at %d' % i)
+                j += 1
+            j += 1
+            if ch == '/':
+                while j < n and _isWord(text[j]):     # regex flags
+                    j += 1
+            emit(text[i:j])
+            i = j
+        else:
+            j = i + 1
+            if _isWord(ch):
+                while j < n and _isWord(text[j]):
+                    j += 1
+            emit(text[i:j])
+            i = j
+    return ''.join(out) + '\n'
+
+
+def _regexAllowed(code):
+    code = code.rstrip()
+    if not code:
+        return True
+    if code[-1] in _REGEX_PRECEDERS:
+        return True
+    word = re.search(r'[\w$]+$', code)
+    return bool(word) and word.group(0) in _REGEX_KEYWORDS
+
+
+# - - - bundles - - - - - - - - - - - - - - - - - - - - - - - -
+
+def templateCacheJs(partials_dir=PARTIALS):
+    """Return a script putting every partial into $templateCache under
+    the URL it is otherwise fetched from.
+    """
+    lines = ["angular.module('%s').run(['$templateCache', "
+             "function ($templateCache) {" % MODULE]
+    for path in sorted(glob.glob(os.path.join(partials_dir, '*.html'))):
+        url = '%s/%s' % (PARTIAL_URL, os.path.basename(path))
+        # '</' must not end the script when the bundle is inlined
+        html = json.dumps(_read(path)).replace('</', '<\\/')
+        lines.append('$templateCache.put(%s, %s);' % (json.dumps(url), html))
+    lines.append('}]);')
+    return '\n'.join(lines) + '\n'
+
+
+def _bundle(kind, urls):
+    parts = [_read(_localPath(url)) for url in urls]
+    if kind == 'css':
+        return '\n'.join(minifyCss(p) for p in parts) + '\n'
+    parts.append(templateCacheJs())
+    # a trailing ';' ends a file missing its final semicolon; a leading one
+    # would cancel the first file's 'use strict'
+    return ''.join(minifyJs(p) + ';\n' for p in parts)
+
+
+def _writeAsset(kind, content):
+    data = content.encode('utf-8')
+    name = 'app.%s.%s' % (hashlib.md5(data).hexdigest()[:HASH_LENGTH], kind)
+    with open(os.path.join(ASSETS, name), 'wb') as f:
+        f.write(data)
+    return name
+
+
+def build():
+    """Write the bundles & the index using them; return the bundle names."""
+    if not os.path.isdir(ASSETS):
+        os.makedirs(ASSETS)
+    index = _read(INDEX)
+    names = []
+
+    def replace(match):
+        kind, block = match.group(1), match.group(2)
+        urls = _LOCAL_RE[kind].findall(block)
+        name = _writeAsset(kind, _bundle(kind, urls))
+        names.append(name)
+        indent = match.group(0)[:len(match.group(0)) -
+                                len(match.group(0).lstrip(' \t'))]
+        kept = _LOCAL_RE[kind].sub('', block).strip()
+        tag = indent + _TAG[kind] % ('%s/%s' % (ASSET_URL, name))
+        return (indent + kept + '\n' + tag) if kept else tag
+
+    index = _BLOCK_RE.sub(replace, index)
+    with open(os.path.join(DIST, 'index.html'), 'wb') as f:
+        f.write(index.encode('utf-8'))
+    for path in glob.glob(os.path.join(ASSETS, 'app.*')):
+        if os.path.basename(path) not in names:
+            os.remove(path)
+    return names
+
+
+if __name__ == '__main__':
+    for name in build():
+        print('%s/%s' % (ASSET_URL, name))
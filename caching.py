@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+"""
+caching.py -- caching policy in one place: ndb context cache, ndb
+    memcache cache & memcache timeouts per model, plus a decorator caching
+    derived results in memcache with namespace- and group-versioned
+    invalidation, and per-namespace hit/miss stats
+
+A derived result is stored under its namespace, its arguments and the
+current generation of its namespace and of each group it belongs to
+(e.g. everything derived from conference X). Invalidating a group or a
+whole namespace is one memcache incr of its generation: entries built
+under the old generation are never read again and age out. Generations
+start from the clock, so an evicted generation is never re-used.
+
+A result memcache refuses (over its value size limit, or not picklable)
+is returned uncached and counted; cache keys or other small derivations
+of large results instead.
+
+"""
+
+import collections
+import functools
+import hashlib
+import logging
+import pickle
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import models
+from archive import liveKey
+
+Policy = collections.namedtuple('Policy', 'context memcache timeout')
+
+# ndb caching per model; timeout is the memcache timeout in seconds, 0 for
+# no expiry
+MODEL_POLICIES = {
+    'Profile': Policy(context=True, memcache=True, timeout=3600),
+    # seatsAvailable changes with every registration; ndb keeps memcache
+    # consistent, the timeout only bounds memory spent on cold entities
+    'Conference': Policy(context=True, memcache=True, timeout=600),
+    'Session': Policy(context=True, memcache=True, timeout=600),
+    'ArchivedConference': Policy(context=True, memcache=True,
+                                 timeout=24 * 3600),
+    'ArchivedSession': Policy(context=True, memcache=True,
+                              timeout=24 * 3600),
+}
+
+MEMCACHE_NAMESPACE = 'derived'
+DERIVED_TIMEOUT = 3600
+MAX_KEY_LENGTH = 200            # longer derived keys are hashed
+
+
+def applyModelPolicies(policies=MODEL_POLICIES):
+    """Set ndb's per-model cache switches from `policies`."""
+    for kind, policy in policies.iteritems():
+        model = getattr(models, kind)
+        model._use_cache = policy.context
+        model._use_memcache = policy.memcache
+        model._memcache_timeout = policy.timeout
+
+applyModelPolicies()
+
+
+# - - - stats - - - - - - - - - - - - - - - - - - - - - - - -
+
+class CacheStats(object):
+    """CacheStats -- derived-result counters of one namespace"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.uncacheable = 0
+
+    def toDict(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': round(self.hits / float(lookups), 3) if lookups
+                       else 0.0,
+            'invalidations': self.invalidations,
+            'uncacheable': self.uncacheable,
+        }
+
+
+_lock = threading.Lock()
+_stats = {}
+
+
+def _count(namespace, counter):
+    with _lock:
+        stats = _stats.get(namespace)
+        if stats is None:
+            stats = _stats[namespace] = CacheStats()
+        setattr(stats, counter, getattr(stats, counter) + 1)
+
+
+def getCacheStats():
+    """Return this instance's derived-cache counters per namespace, the
+    model policies and the app-wide memcache stats.
+    """
+    with _lock:
+        derived = dict((ns, s.toDict()) for ns, s in _stats.iteritems())
+    return {
+        'derived': derived,
+        'models': dict((kind, p._asdict())
+                       for kind, p in MODEL_POLICIES.iteritems()),
+        'memcache': memcache.get_stats(),
+    }
+
+
+def resetCacheStats():
+    with _lock:
+        _stats.clear()
+
+
+# - - - generations - - - - - - - - - - - - - - - - - - - - -
+
+def _clock():
+    return int(time.time() * 1000)
+
+
+def _generationKey(name):
+    return 'GEN|%s' % name
+
+
+def _generations(names):
+    """Return the current generation of each name, creating missing ones."""
+    keys = [_generationKey(n) for n in names]
+    found = memcache.get_multi(keys, namespace=MEMCACHE_NAMESPACE)
+    missing = [k for k in keys if k not in found]
+    if missing:
+        now = _clock()
+        memcache.add_multi(dict((k, now) for k in missing),
+                           namespace=MEMCACHE_NAMESPACE)
+        found.update(memcache.get_multi(missing,
+                                        namespace=MEMCACHE_NAMESPACE))
+    return [found.get(k, 0) for k in keys]
+
+
+def _bump(name):
+    memcache.incr(_generationKey(name), namespace=MEMCACHE_NAMESPACE,
+                  initial_value=_clock())
+
+
+def conferenceGroup(conf_key):
+    """Return the group of everything derived from a conference, live or
+    archived.
+    """
+    return 'conference:%s' % liveKey(conf_key).urlsafe()
+
+
+def invalidateGroup(group):
+    """Drop every derived result of `group`, in any namespace."""
+    _bump('group|%s' % group)
+    _count('group:%s' % group.split(':', 1)[0], 'invalidations')
+
+
+def invalidateNamespace(namespace):
+    """Drop every derived result cached under `namespace`."""
+    _bump('ns|%s' % namespace)
+    _count(namespace, 'invalidations')
+
+
+# - - - derived results - - - - - - - - - - - - - - - - - - -
+
+def _keyPart(value):
+    if isinstance(value, ndb.Key):
+        return value.urlsafe()
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def cached(namespace, groups=None, timeout=DERIVED_TIMEOUT):
+    """Cache a function's result in memcache, keyed by its positional
+    arguments.
+
+    `groups(*args)` returns the groups, strings like 'conference:<key>',
+    whose invalidation must drop the result. None results are cached too.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            names = ['ns|%s' % namespace]
+            if groups:
+                names += ['group|%s' % g for g in groups(*args)]
+            key = '|'.join([namespace] + [_keyPart(a) for a in args])
+            if len(key) > MAX_KEY_LENGTH:
+                key = '%s|%s' % (namespace, hashlib.sha1(key).hexdigest())
+            key = '%s|%s' % (key, '.'.join(
+                str(g) for g in _generations(names)))
+
+            hit = memcache.get(key, namespace=MEMCACHE_NAMESPACE)
+            if hit is not None:
+                _count(namespace, 'hits')
+                return hit[0]
+            _count(namespace, 'misses')
+            result = func(*args)
+            try:
+                memcache.set(key, (result,), time=timeout,
+                             namespace=MEMCACHE_NAMESPACE)
+            except (ValueError, TypeError, pickle.PicklingError) as e:
+                # too large for one memcache value, or not picklable
+                logging.warning('not caching %s: %s', key, e)
+                _count(namespace, 'uncacheable')
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,531 @@
+#!/usr/bin/env python
+
+"""
+catalog.py -- per-instance, read-only columnar snapshot of the live
+    conferences, so queryConferences filters in memory instead of running
+    a datastore query bound by index rules
+
+Each filterable field is one compact column. city and topics are
+dictionary-encoded, with a bitmap of rows (a long, bit i = row i) per
+distinct value; month, maxAttendees, seatsAvailable and the startDate
+ordinal are array('l') columns with a bit-sliced index, so comparing a
+column against a constant is a few dozen AND/OR operations over all rows
+at once. A query ANDs one mask per filter -- any number of inequalities,
+on any fields -- and only the matching keys are fetched.
+
+The whole catalog is only ever loaded by /tasks/catalog (queued on
+demand and by cron every half hour), which publishes the snapshot in
+memcache as pickled, compressed chunks. An instance without a current
+snapshot fetches the published one; until there is one, queryConferences
+runs its datastore query.
+
+Writers call recordChanges() after committing: it bumps a change version
+in memcache and logs the changed keys under the new version numbers. A
+snapshot that is behind re-reads just the logged conferences; when the
+log is gone, the snapshot is too far behind or older than MAX_AGE, a
+rebuild is queued. A refresh builds a new snapshot, so requests still
+reading the old one are never affected. Since a snapshot may lag behind
+a write, callers re-check the filters on the entities they fetch.
+
+"""
+
+import array
+import binascii
+import cPickle as pickle
+import logging
+import operator
+import threading
+import time
+import zlib
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from storage import fetchPage
+from storage import getEntities
+
+CATALOG_TASK_URL = '/tasks/catalog'
+VERSION_KEY = 'CATALOG_VERSION'
+CHANGE_KEY = 'CATALOG_CHANGE|%d'
+PUBLISHED_KEY = 'CATALOG_PUBLISHED'     # (build id or None, chunk count)
+CHUNK_KEY = 'CATALOG_CHUNK|%s|%d'
+BUILDING_KEY = 'CATALOG_BUILDING'
+CHUNK_BYTES = 900 * 1024        # under memcache's 1MB value limit
+PUBLISHED_SECONDS = 7200        # lifetime of a published snapshot
+BUILD_SECONDS = 600             # at most one build queued per this
+CHANGE_SECONDS = 3600           # lifetime of a logged change
+MAX_CHANGES = 500               # behind by more than this: full reload
+MAX_AGE = 3600                  # seconds between full reloads at the latest
+GAP_SECONDS = 10                # wait for a change being logged, then reload
+MAX_ROWS = 100000               # larger catalogs stay in the datastore
+PAGE_SIZE = 1000
+
+INT_FIELDS = ('month', 'maxAttendees', 'seatsAvailable', 'startDate')
+
+_COMPARE = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+# a property set to None is indexed as null, which sorts before any value
+_NULL_MATCHES = frozenset(['<', '<=', '!='])
+
+
+def _bitmap(rows, size):
+    """Return the bitmap with the bits of `rows` set, in O(size)."""
+    buf = bytearray((size + 7) // 8)
+    for i in rows:
+        buf[i >> 3] |= 1 << (i & 7)
+    buf.reverse()
+    return int(binascii.hexlify(buf), 16) if buf else 0
+
+
+def _rows(mask):
+    """Return the indexes of the set bits of a bitmap, lowest first."""
+    bits = bin(mask)[:1:-1]
+    rows = []
+    i = bits.find('1')
+    while i >= 0:
+        rows.append(i)
+        i = bits.find('1', i + 1)
+    return rows
+
+
+def _intValue(field, conf):
+    value = getattr(conf, field)
+    if field == 'startDate' and value is not None:
+        value = value.toordinal()
+    return value
+
+
+class _StringColumn(object):
+    """_StringColumn -- a (repeated) string property, dictionary-encoded:
+    one bitmap of rows per distinct value
+    """
+
+    def __init__(self, values, repeated):
+        self.repeated = repeated
+        self.words = []         # code -> value
+        self.codes = {}         # value -> code
+        # row -> codes; single values as an array with -1 for None
+        self.rowCodes = [] if repeated else array.array('l')
+        members = []
+        for i, value in enumerate(values):
+            codes = [self._code(v, members) for v in self._list(value)]
+            for code in codes:
+                members[code].append(i)
+            if repeated:
+                self.rowCodes.append(tuple(codes))
+            else:
+                self.rowCodes.append(codes[0] if codes else -1)
+        self.bitmaps = [_bitmap(rows, len(values)) for rows in members]
+        self.missing = 0 if repeated else _bitmap(
+            (i for i, c in enumerate(self.rowCodes) if c < 0), len(values))
+
+    def _list(self, value):
+        if self.repeated:
+            return sorted(set(value or ()))
+        return [] if value is None else [value]
+
+    def _code(self, value, members):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.words)
+            self.words.append(value)
+            members.append([])
+        return code
+
+    def copy(self):
+        column = _StringColumn((), self.repeated)
+        column.words = list(self.words)
+        column.codes = dict(self.codes)
+        column.rowCodes = self.rowCodes[:]
+        column.bitmaps = list(self.bitmaps)
+        column.missing = self.missing
+        return column
+
+    def set(self, row, value):
+        """Set the value of `row`; row == number of rows appends one."""
+        bit = 1 << row
+        old = self.rowCodes[row] if row < len(self.rowCodes) else None
+        for code in (old if self.repeated else [old]) or ():
+            if code is not None and code >= 0:
+                self.bitmaps[code] &= ~bit
+        codes = [self._code(v, []) for v in self._list(value)]
+        while len(self.bitmaps) < len(self.words):
+            self.bitmaps.append(0)
+        for code in codes:
+            self.bitmaps[code] |= bit
+        new = tuple(codes) if self.repeated else (codes[0] if codes else -1)
+        if old is None:
+            self.rowCodes.append(new)
+        else:
+            self.rowCodes[row] = new
+        if not self.repeated:
+            self.missing = (self.missing | bit if new < 0
+                            else self.missing & ~bit)
+
+    def mask(self, op, value, rows):
+        """Rows matching `property op value`, datastore semantics: a
+        repeated property matches when any of its values does.
+        """
+        compare = _COMPARE[op]
+        mask = 0
+        for code, word in enumerate(self.words):
+            if compare(word, value):
+                mask |= self.bitmaps[code]
+        if op in _NULL_MATCHES:
+            mask |= self.missing
+        return mask & rows
+
+
+class _IntColumn(object):
+    """_IntColumn -- an integer property with a bit-sliced index: slice b
+    is the bitmap of rows whose value - base has bit b set
+    """
+
+    def __init__(self, values):
+        self._build(list(values))
+
+    def _build(self, values):
+        present = [v for v in values if v is not None]
+        self.base = min(present) if present else 0
+        width = (max(present) - self.base).bit_length() if present else 0
+        self.values = array.array('l', (self.base if v is None else v
+                                         for v in values))
+        self.missing = _bitmap((i for i, v in enumerate(values)
+                                if v is None), len(values))
+        self.slices = [_bitmap((i for i, v in enumerate(values)
+                                if v is not None and (v - self.base) >> b & 1),
+                               len(values))
+                       for b in range(width)]
+
+    def _list(self):
+        values = list(self.values)
+        for i in _rows(self.missing):
+            values[i] = None
+        return values
+
+    def copy(self):
+        column = _IntColumn(())
+        column.base = self.base
+        column.values = self.values[:]
+        column.missing = self.missing
+        column.slices = list(self.slices)
+        return column
+
+    def set(self, row, value):
+        """Set the value of `row`; row == number of rows appends one."""
+        if value is not None and (value < self.base or
+                                  (value - self.base) >> len(self.slices)):
+            # out of the indexed range; re-slice with the new bounds
+            values = self._list()
+            values[row:row + 1] = [value]
+            self._build(values)
+            return
+        bit = 1 << row
+        if row == len(self.values):
+            self.values.append(self.base)
+        self.values[row] = self.base if value is None else value
+        offset = 0 if value is None else value - self.base
+        self.slices = [s | bit if offset >> b & 1 else s & ~bit
+                       for b, s in enumerate(self.slices)]
+        self.missing = (self.missing | bit if value is None
+                        else self.missing & ~bit)
+
+    def mask(self, op, value, rows):
+        """Rows matching `property op value`."""
+        present = rows & ~self.missing
+        c = value - self.base
+        if c < 0:
+            gt, eq = present, 0
+        elif c >> len(self.slices):
+            gt, eq = 0, 0
+        else:
+            gt, eq = 0, present
+            for b in reversed(range(len(self.slices))):
+                if c >> b & 1:
+                    eq &= self.slices[b]
+                else:
+                    gt |= eq & self.slices[b]
+                    eq &= ~self.slices[b]
+        lt = present & ~(gt | eq)
+        mask = {'=': eq, '!=': lt | gt, '<': lt, '<=': lt | eq,
+                '>': gt, '>=': gt | eq}[op]
+        if op in _NULL_MATCHES:
+            mask |= rows & self.missing
+        return mask
+
+
+class CatalogSnapshot(object):
+    """CatalogSnapshot -- the live conferences as columns, as of `version`"""
+
+    def __init__(self, conferences, version):
+        confs = [c for c in conferences if not c.deleting]
+        self.version = version
+        self.loaded = time.time()
+        self.stalled = None
+        # websafe keys pickle & unpickle far faster than ndb Keys
+        self.keys = [c.key.urlsafe() for c in confs]
+        self.rows = dict((k, i) for i, k in enumerate(self.keys))
+        self.live = (1 << len(confs)) - 1
+        self.columns = {
+            'city': _StringColumn([c.city for c in confs], False),
+            'topics': _StringColumn([c.topics for c in confs], True),
+        }
+        for field in INT_FIELDS:
+            self.columns[field] = _IntColumn(
+                [_intValue(field, c) for c in confs])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def match(self, filters):
+        """Return the keys of conferences matching all of `filters`, a
+        list of (property, operator, value); dates compare as ordinals.
+        """
+        mask = self.live
+        for field, op, value in filters:
+            if not mask:
+                break
+            if field == 'startDate':
+                value = value.toordinal()
+            mask &= self.columns[field].mask(op, value, self.live)
+        return [ndb.Key(urlsafe=self.keys[i]) for i in _rows(mask)]
+
+    def updated(self, changes, version):
+        """Return a copy with `changes`, (key, conference or None) pairs,
+        applied.
+        """
+        snapshot = object.__new__(CatalogSnapshot)
+        snapshot.version = version
+        snapshot.loaded = self.loaded
+        snapshot.stalled = None
+        snapshot.keys = list(self.keys)
+        snapshot.rows = dict(self.rows)
+        snapshot.live = self.live
+        snapshot.columns = dict((f, c.copy())
+                                for f, c in self.columns.iteritems())
+        for key, conf in changes:
+            snapshot._apply(key, conf)
+        return snapshot
+
+    def _apply(self, key, conf):
+        wsck = key.urlsafe()
+        row = self.rows.get(wsck)
+        if conf is None or conf.deleting:
+            # rows are never reused; a removed row only leaves the live mask
+            if row is not None:
+                self.live &= ~(1 << row)
+                del self.rows[wsck]
+            return
+        if row is None:
+            row = self.rows[wsck] = len(self.keys)
+            self.keys.append(wsck)
+            self.live |= 1 << row
+        self.columns['city'].set(row, conf.city)
+        self.columns['topics'].set(row, conf.topics)
+        for field in INT_FIELDS:
+            self.columns[field].set(row, _intValue(field, conf))
+
+
+def matches(conf, filters):
+    """Return whether an entity matches `filters` as CatalogSnapshot.match
+    would match it.
+    """
+    for field, op, value in filters:
+        actual = getattr(conf, field)
+        compare = _COMPARE[op]
+        if isinstance(actual, list):
+            ok = any(compare(v, value) for v in actual)
+        elif actual is None:
+            ok = op in _NULL_MATCHES
+        else:
+            ok = compare(actual, value)
+        if not ok:
+            return False
+    return True
+
+
+# - - - change log - - - - - - - - - - - - - - - - - - - - -
+
+def _clock():
+    # a re-created version starts past any number handed out before
+    return int(time.time() * 1000)
+
+
+def recordChanges(conf_keys):
+    """Log created, updated or removed conferences for the snapshots of
+    all instances; call after the write committed.
+    """
+    if not conf_keys:
+        return
+    last = memcache.incr(VERSION_KEY, delta=len(conf_keys),
+                         initial_value=_clock())
+    if last is None:
+        # memcache is down; snapshots catch up with their next reload
+        return
+    memcache.set_multi(dict((CHANGE_KEY % (last - i), key.urlsafe())
+                            for i, key in enumerate(reversed(conf_keys))),
+                       time=CHANGE_SECONDS)
+
+
+def _currentVersion():
+    version = memcache.get(VERSION_KEY)
+    if version is None:
+        memcache.add(VERSION_KEY, _clock())
+        version = memcache.get(VERSION_KEY)
+    return version
+
+
+# - - - snapshot - - - - - - - - - - - - - - - - - - - - - -
+
+_lock = threading.Lock()
+_snapshot = None
+_disabledUntil = 0
+_TOO_LARGE = object()
+
+
+def _load(version):
+    confs = []
+    cursor = None
+    while True:
+        page, cursor, more = fetchPage(Conference.query(), PAGE_SIZE, cursor)
+        confs.extend(page)
+        if len(confs) > MAX_ROWS:
+            return None
+        if not (more and cursor):
+            break
+    start = time.time()
+    snapshot = CatalogSnapshot(confs, version)
+    logging.info('catalog: loaded %d conferences in %.1fms', len(snapshot),
+                 (time.time() - start) * 1000.0)
+    return snapshot
+
+
+def queueCatalogBuild():
+    """Queue /tasks/catalog unless a build was queued recently."""
+    if memcache.add(BUILDING_KEY, 1, time=BUILD_SECONDS):
+        taskqueue.add(url=CATALOG_TASK_URL)
+
+
+def buildCatalog():
+    """Load the whole catalog & publish it for every instance; return the
+    snapshot, or None when the catalog is over MAX_ROWS.
+    """
+    global _snapshot
+    snapshot = _load(_currentVersion())
+    if snapshot is None:
+        logging.info('catalog: over %d conferences, not snapshotted',
+                     MAX_ROWS)
+        memcache.set(PUBLISHED_KEY, (None, 0), time=MAX_AGE)
+        memcache.delete(BUILDING_KEY)
+        return None
+    data = zlib.compress(pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL))
+    build = '%x' % _clock()
+    chunks = [data[i:i + CHUNK_BYTES]
+              for i in range(0, len(data), CHUNK_BYTES)]
+    failed = memcache.set_multi(
+        dict((CHUNK_KEY % (build, i), c) for i, c in enumerate(chunks)),
+        time=PUBLISHED_SECONDS)
+    if failed:
+        # the next request finding no snapshot queues another build
+        logging.error('catalog: publishing %d chunks failed', len(failed))
+    else:
+        memcache.set(PUBLISHED_KEY, (build, len(chunks)),
+                     time=PUBLISHED_SECONDS)
+        logging.info('catalog: published %d rows in %d bytes',
+                     len(snapshot), len(data))
+    memcache.delete(BUILDING_KEY)
+    _snapshot = snapshot
+    return snapshot
+
+
+def _fetchPublished():
+    """Return the published snapshot, _TOO_LARGE or None if there is none."""
+    published = memcache.get(PUBLISHED_KEY)
+    if published is None:
+        return None
+    build, count = published
+    if build is None:
+        return _TOO_LARGE
+    keys = [CHUNK_KEY % (build, i) for i in range(count)]
+    found = memcache.get_multi(keys)
+    if len(found) != count:
+        return None
+    return pickle.loads(zlib.decompress(''.join(found[k] for k in keys)))
+
+
+def _expired(snapshot):
+    return time.time() - snapshot.loaded >= MAX_AGE
+
+
+def _refresh(snapshot, version):
+    """Bring `snapshot` to `version`; return the new snapshot, or None
+    when only a rebuild can.
+    """
+    behind = version - snapshot.version
+    if not 0 < behind <= MAX_CHANGES:
+        return None
+    numbers = range(snapshot.version + 1, version + 1)
+    logged = memcache.get_multi([CHANGE_KEY % n for n in numbers])
+    applied = []
+    for n in numbers:
+        # a writer logs its change right after bumping the version
+        if CHANGE_KEY % n not in logged:
+            break
+        applied.append(n)
+    if not applied:
+        if snapshot.stalled is None:
+            snapshot.stalled = time.time()
+        elif time.time() - snapshot.stalled >= GAP_SECONDS:
+            return None
+        return snapshot
+    keys = []
+    for n in applied:
+        key = ndb.Key(urlsafe=logged[CHANGE_KEY % n])
+        if key not in keys:
+            keys.append(key)
+    return snapshot.updated(zip(keys, getEntities(keys)), applied[-1])
+
+
+def currentSnapshot():
+    """Return the up-to-date snapshot of this instance, or None when the
+    caller should query the datastore instead: the catalog is too large,
+    a rebuild is pending or another request is refreshing it.
+
+    Requests at most fetch the published snapshot & apply logged
+    changes; loading the catalog is left to /tasks/catalog.
+    """
+    global _snapshot, _disabledUntil
+    if time.time() < _disabledUntil:
+        return None
+    version = _currentVersion()
+    snapshot = _snapshot
+    if snapshot and snapshot.version == version and not _expired(snapshot):
+        return snapshot
+    if not _lock.acquire(False):
+        return None
+    try:
+        snapshot = _snapshot
+        if snapshot is None or _expired(snapshot):
+            snapshot = _fetchPublished()
+            if snapshot is _TOO_LARGE:
+                _disabledUntil = time.time() + MAX_AGE
+                return None
+            if snapshot is None or _expired(snapshot):
+                queueCatalogBuild()
+                return None
+        if snapshot.version != version:
+            snapshot = _refresh(snapshot, version)
+            if snapshot is None:
+                queueCatalogBuild()
+        _snapshot = snapshot
+        return snapshot
+    finally:
+        _lock.release()
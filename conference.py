@@ -20,6 +20,7 @@ from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
+from google.appengine.api import app_identity
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
@@ -31,14 +32,31 @@ from models import ProfileForm
 from models import StringMessage
 from models import BooleanMessage
 from models import Conference
+from models import ArchivedConference
 from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
 from models import TeeShirtSize
 from models import Session
+from models import ArchivedSession
 from models import SessionForm
 from models import SessionForms
+from models import ExportJob
+from models import ExportJobForm
+from models import FacetForm
+from models import FacetForms
+from models import FacetValueForm
+from models import SearchResultForm
+from models import SearchResultForms
+from models import SimilarConferenceForm
+from models import SimilarConferenceForms
+from models import CalendarFeedForm
+from models import SeatHoldForm
+from models import SeatVersionForm
+from models import SeatVersionForms
+from models import SpeakerForm
+from models import SpeakerForms
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
@@ -47,6 +65,63 @@ from settings import ANDROID_AUDIENCE
 
 from utils import getUserId
 
+from instrumentation import instrumented
+from querylog import runQuery
+from notifications import queueConferenceCreated
+from archive import getWithArchive
+from archive import getMultiWithArchive
+from archive import isArchived
+from archive import liveKey
+from caching import cached
+from caching import conferenceGroup
+from caching import invalidateGroup
+from deletion import queueDeleteStep
+from exports import EXPORTS
+from exports import FORMATS
+from exports import startExport
+from facets import FACET_FIELDS
+from facets import facetDeltas
+from facets import facetValues
+from facets import getFacetCounts
+from facets import queueFacetDeltas
+from holds import confirmHold
+from holds import releaseHold
+from holds import takeHold
+from idpool import allocateId
+from idpool import finishRefills
+from ratelimit import rateLimited
+from seatfeed import MAX_WATCHED
+from seatfeed import publishSeats
+from seatfeed import resetSeats
+from seatfeed import waitForSeatChanges
+from catalog import currentSnapshot
+from catalog import matches
+from catalog import recordChanges
+from ical import bumpConferenceVersion
+from ical import bumpUserVersion
+from ical import conferenceFeedPath
+from ical import feedsEnabled
+from ical import userFeedPath
+from textsearch import FIELD_WEIGHTS
+from textsearch import MAX_SEARCH_LIMIT
+from textsearch import SEARCH_LIMIT
+from textsearch import getSearchIndex
+from textsearch import queueReindex
+from similarity import queueSimilarUpdate
+from similarity import similarConferences
+from speakers import SUGGEST_LIMIT
+from speakers import linkSpeakers
+from speakers import matchSpeakers
+from speakers import speakerBackfillDone
+from speakers import speakerKey
+from storage import deleteEntities
+from storage import flushEntities
+from storage import getEntities
+from storage import getEntity
+from storage import putEntity
+from storage import transactional
+from storage import unitOfWork
+
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
@@ -115,6 +190,12 @@ SESS_BY_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     speaker=messages.StringField(1)
 )
 
+SPEAKER_SUGGEST_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    q=messages.StringField(1),
+    limit=messages.IntegerField(2, variant=messages.Variant.INT32),
+)
+
 SESS_QUERY_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
@@ -122,6 +203,25 @@ SESS_QUERY_GET_REQUEST = endpoints.ResourceContainer(
     endDate=messages.StringField(3)
 )
 
+EXPORT_POST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    what=messages.StringField(2),
+    format=messages.StringField(3),
+)
+
+EXPORT_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    jobId=messages.StringField(1),
+)
+
+SEARCH_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    q=messages.StringField(1),
+    kind=messages.StringField(2),
+    limit=messages.IntegerField(3, variant=messages.Variant.INT32),
+)
+
 SESS_DEFAULTS = {
     "duration": 120,
     "typeOfSession": [ "Default", "Session" ],
@@ -130,6 +230,30 @@ SESS_DEFAULTS = {
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
+def _notDeleting(conf):
+    """Residual filter hiding conferences whose deletion is under way."""
+    return not conf.deleting
+
+
+def _matchingResidual(filters):
+    """Residual filter hiding deleting conferences and checking the
+    (field, operator, value) filters the datastore query left out."""
+    return lambda conf: not conf.deleting and matches(conf, filters)
+
+
+@cached('sessions', groups=lambda conf_key: [conferenceGroup(conf_key)])
+def _conferenceSessionKeys(conf_key):
+    """Return the keys of all sessions of a live or archived conference."""
+    model = ArchivedSession if isArchived(conf_key) else Session
+    return runQuery(model.query(ancestor=conf_key), keys_only=True)
+
+
+def _conferenceSessions(conf_key):
+    """Return all sessions of a live or archived conference."""
+    # keys stay far below memcache's value limit; ndb caches the entities
+    return filter(None, getEntities(_conferenceSessionKeys(conf_key)))
+
+
 @endpoints.api(name='conference', version='v1', audiences=[ANDROID_AUDIENCE],
     allowed_client_ids=[WEB_CLIENT_ID, API_EXPLORER_CLIENT_ID, ANDROID_CLIENT_ID, IOS_CLIENT_ID],
     scopes=[EMAIL_SCOPE])
@@ -149,7 +273,8 @@ class ConferenceApi(remote.Service):
                 else:
                     setattr(cf, field.name, getattr(conf, field.name))
             elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
+                # archived conferences keep reporting their live key
+                setattr(cf, field.name, liveKey(conf.key).urlsafe())
         if displayName:
             setattr(cf, 'organizerDisplayName', displayName)
         cf.check_initialized()
@@ -193,22 +318,25 @@ class ConferenceApi(remote.Service):
         # generate Profile Key based on user ID and Conference
         # ID based on Profile key get Conference key from ID
         p_key = ndb.Key(Profile, user_id)
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
+        c_id = allocateId(Conference, p_key)
         c_key = ndb.Key(Conference, c_id, parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        conf = Conference(**data)
+        putEntity(conf)
+        finishRefills()
+        queueFacetDeltas(facetDeltas(set(), facetValues(conf)))
+        queueReindex([c_key])
+        queueSimilarUpdate(c_key)
+        recordChanges([c_key])
+        queueConferenceCreated(user.email(), request, c_key.urlsafe())
         return request
 
 
-    @ndb.transactional()
+    @transactional(deadline=5)
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
         if not user:
@@ -219,9 +347,9 @@ class ConferenceApi(remote.Service):
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
 
         # update existing conference
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = getEntity(ndb.Key(urlsafe=request.websafeConferenceKey))
         # check that conference exists
-        if not conf:
+        if not conf or conf.deleting:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
 
@@ -232,6 +360,7 @@ class ConferenceApi(remote.Service):
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
+        before = facetValues(conf)
         for field in request.all_fields():
             data = getattr(request, field.name)
             # only copy fields where we get data
@@ -243,13 +372,17 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
-        conf.put()
-        prof = ndb.Key(Profile, user_id).get()
+        putEntity(conf)
+        queueFacetDeltas(facetDeltas(before, facetValues(conf)), transactional=True)
+        queueReindex([conf.key], transactional=True)
+        queueSimilarUpdate(conf.key, transactional=True)
+        prof = getEntity(ndb.Key(Profile, user_id))
         return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
+    @instrumented
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -258,29 +391,92 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
+    @instrumented
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
+        conf = self._updateConferenceObject(request)
+        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        bumpConferenceVersion(conf_key)
+        resetSeats(conf_key)
+        recordChanges([conf_key])
+        return conf
+
+
+    @transactional()
+    def _markConferenceDeleting(self, conf_key, user_id):
+        """Flag a conference as deleting & start the cascade task chain."""
+        conf = getWithArchive(conf_key)
+        if not (conf and conf_key.kind() == 'Conference'):
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % conf_key.urlsafe())
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can delete the conference.')
+        # already deleting; the running task chain will finish the job
+        if conf.deleting:
+            return
+        conf.deleting = True
+        putEntity(conf)
+        queueDeleteStep(conf_key.urlsafe(), transactional=True)
+        queueReindex([conf_key], transactional=True)
+        queueSimilarUpdate(conf_key, transactional=True)
+        # facets count live conferences only
+        if not isArchived(conf.key):
+            queueFacetDeltas(facetDeltas(facetValues(conf), set()),
+                             transactional=True)
+
+
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}/delete',
+            http_method='POST', name='deleteConference')
+    @instrumented
+    def deleteConference(self, request):
+        """Delete a conference, its sessions & all references to them."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        self._markConferenceDeleting(conf_key, getUserId(user))
+        bumpConferenceVersion(conf_key)
+        invalidateGroup(conferenceGroup(conf_key))
+        resetSeats(conf_key)
+        recordChanges([conf_key])
+        return BooleanMessage(data=True)
 
 
     @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
+    @instrumented
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
+        conf = getWithArchive(ndb.Key(urlsafe=request.websafeConferenceKey))
+        if not conf or conf.deleting:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+        prof = getEntity(conf.key.parent())
         # return ConferenceForm
         return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
 
 
+    @endpoints.method(CONF_GET_REQUEST, SimilarConferenceForms,
+            path='conference/{websafeConferenceKey}/similar',
+            http_method='GET', name='getSimilarConferences')
+    @instrumented
+    def getSimilarConferences(self, request):
+        """Return the precomputed most similar conferences, best first."""
+        return SimilarConferenceForms(items=[
+            SimilarConferenceForm(websafeKey=wsck, name=name, city=city,
+                                  startDate=startDate, score=score)
+            for wsck, name, city, startDate, score in
+            similarConferences(request.websafeConferenceKey)])
+
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
+    @instrumented
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # make sure user is authed
@@ -290,18 +486,22 @@ class ConferenceApi(remote.Service):
         user_id = getUserId(user)
 
         # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        confs = runQuery(Conference.query(ancestor=ndb.Key(Profile, user_id)),
+                         residual=_notDeleting)
+        prof = getEntity(ndb.Key(Profile, user_id))
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
             items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
         )
 
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
+    def _getQuery(self, request, model=Conference):
+        """Return formatted query from the submitted filters, plus the
+        (field, operator, value) filters it leaves out: inequalities on
+        fields after the first, for the caller to check with matches."""
+        q = model.query()
+        inequality_filter, filters = self._formatFilters(
+            request.filters, multiple_inequalities=True)
 
         # If exists, sort on inequality filter first
         if not inequality_filter:
@@ -310,15 +510,18 @@ class ConferenceApi(remote.Service):
             q = q.order(ndb.GenericProperty(inequality_filter))
             q = q.order(Conference.name)
 
+        residual = []
         for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
+            # the datastore takes inequalities on one field only
+            if filtr["operator"] != "=" and filtr["field"] != inequality_filter:
+                residual.append((filtr["field"], filtr["operator"], filtr["value"]))
+                continue
             formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
-        return q
+        return q, residual
 
 
-    def _formatFilters(self, filters):
+    def _formatFilters(self, filters, multiple_inequalities=False):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
         inequality_field = None
@@ -331,6 +534,8 @@ class ConferenceApi(remote.Service):
                 filtr["operator"] = OPERATORS[filtr["operator"]]
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
+            if filtr["field"] in ["month", "maxAttendees"]:
+                filtr["value"] = int(filtr["value"])
 
             # Every operation except "=" is an inequality
             if filtr["operator"] != "=":
@@ -338,7 +543,8 @@ class ConferenceApi(remote.Service):
                 # disallow the filter if inequality was performed on a different field before
                 # track the field on which the inequality operation is performed
                 if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
+                    if not multiple_inequalities:
+                        raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
                 else:
                     inequality_field = filtr["field"]
 
@@ -346,18 +552,50 @@ class ConferenceApi(remote.Service):
         return (inequality_field, formatted_filters)
 
 
+    def _querySnapshot(self, snapshot, request):
+        """Match the filters against the in-memory catalog; any number of
+        inequality fields is allowed. Returns conferences in query order."""
+        inequality_filter, filters = self._formatFilters(
+            request.filters, multiple_inequalities=True)
+        filters = [(f["field"], f["operator"], f["value"]) for f in filters]
+        # the snapshot may predate a write; the fetched entities decide
+        conferences = [conf for conf in getEntities(snapshot.match(filters))
+                       if conf and not conf.deleting and matches(conf, filters)]
+
+        # same order as the datastore query: inequality field, then name
+        if inequality_filter == 'topics':
+            conferences.sort(key=lambda c: (min(c.topics or [None]), c.name))
+        elif inequality_filter:
+            conferences.sort(
+                key=lambda c: (getattr(c, inequality_filter), c.name))
+        else:
+            conferences.sort(key=lambda c: c.name)
+        return conferences
+
+
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
             path='queryConferences',
             http_method='POST',
             name='queryConferences')
+    @instrumented
     def queryConferences(self, request):
         """Query for conferences."""
-        conferences = self._getQuery(request)
+        snapshot = None if request.includeArchived else currentSnapshot()
+        if snapshot:
+            conferences = self._querySnapshot(snapshot, request)
+        else:
+            # same answers as the snapshot: further inequalities are checked
+            # on the fetched entities
+            q, rest = self._getQuery(request)
+            conferences = runQuery(q, residual=_matchingResidual(rest))
+        if request.includeArchived:
+            q, rest = self._getQuery(request, ArchivedConference)
+            conferences += runQuery(q, residual=_matchingResidual(rest))
 
         # need to fetch organiser displayName from profiles
         # get all keys and use get_multi for speed
         organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        profiles = getEntities(organisers)
 
         # put display names in a dict for easier fetching
         names = {}
@@ -371,6 +609,22 @@ class ConferenceApi(remote.Service):
         )
 
 
+    @endpoints.method(message_types.VoidMessage, FacetForms,
+            path='conference/facets',
+            http_method='GET', name='getConferenceFacets')
+    @instrumented
+    def getConferenceFacets(self, request):
+        """Return conference counts per city, topic & month value."""
+        totals = getFacetCounts()
+        items = []
+        for facet, field in sorted(FACET_FIELDS.items(), key=lambda f: f[1]):
+            counts = sorted(((v, n) for v, n in totals.get(facet, {}).iteritems() if n > 0),
+                            key=lambda vn: (-vn[1], vn[0]))
+            items.append(FacetForm(field=field, values=[
+                FacetValueForm(value=v, count=n) for v, n in counts]))
+        return FacetForms(items=items)
+
+
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
@@ -398,7 +652,7 @@ class ConferenceApi(remote.Service):
         # get Profile from datastore
         user_id = getUserId(user)
         p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        profile = getEntity(p_key)
         # create new Profile if not there
         if not profile:
             profile = Profile(
@@ -407,7 +661,7 @@ class ConferenceApi(remote.Service):
                 mainEmail= user.email(),
                 teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
             )
-            profile.put()
+            putEntity(profile)
 
         return profile      # return Profile
 
@@ -428,7 +682,7 @@ class ConferenceApi(remote.Service):
                         #    setattr(prof, field, str(val).upper())
                         #else:
                         #    setattr(prof, field, val)
-                        prof.put()
+                        putEntity(prof)
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
@@ -436,6 +690,8 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
+    @instrumented
+    @unitOfWork
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
@@ -443,6 +699,9 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(ProfileMiniForm, ProfileForm,
             path='profile', http_method='POST', name='saveProfile')
+    @instrumented
+    @rateLimited
+    @unitOfWork
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
@@ -455,10 +714,10 @@ class ConferenceApi(remote.Service):
         """Create Announcement & assign to memcache; used by
         memcache cron job & putAnnouncement().
         """
-        confs = Conference.query(ndb.AND(
+        confs = runQuery(Conference.query(ndb.AND(
             Conference.seatsAvailable <= 5,
             Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
+        ), projection=[Conference.name])
 
         if confs:
             # If there are almost sold out conferences,
@@ -478,6 +737,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
+    @instrumented
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
         return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
@@ -485,7 +745,8 @@ class ConferenceApi(remote.Service):
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
+    # hot during sell-outs: more, shorter retries within an interactive budget
+    @transactional(xg=True, retries=5, deadline=2)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
         retval = None
@@ -494,7 +755,10 @@ class ConferenceApi(remote.Service):
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
         wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
+        conf = getEntity(ndb.Key(urlsafe=wsck))
+        if not conf and not reg and wsck in prof.conferenceKeysToAttend:
+            # conference is over & archived; just drop the registration
+            conf = getWithArchive(ndb.Key(urlsafe=wsck))
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
@@ -506,6 +770,11 @@ class ConferenceApi(remote.Service):
                 raise ConflictException(
                     "You have already registered for this conference")
 
+            # conference is being deleted
+            if conf.deleting:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % wsck)
+
             # check if seats avail
             if conf.seatsAvailable <= 0:
                 raise ConflictException(
@@ -529,23 +798,30 @@ class ConferenceApi(remote.Service):
                 retval = False
 
         # write things back to the datastore & return
-        prof.put()
-        conf.put()
+        putEntity(prof)
+        if not isArchived(conf.key):
+            putEntity(conf)
+            # seat watchers hear of the change once it has committed
+            if retval:
+                seats, delta = conf.seatsAvailable, -1 if reg else 1
+                ndb.get_context().call_on_commit(
+                    lambda: publishSeats(conf.key, seats, delta))
         return BooleanMessage(data=retval)
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
+    @instrumented
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
         conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
+        conferences = getMultiWithArchive(conf_keys)
 
         # get organizers
         organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        profiles = getEntities(organisers)
 
         # put display names in a dict for easier fetching
         names = {}
@@ -561,22 +837,132 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='POST', name='registerForConference')
+    @instrumented
+    @rateLimited
     def registerForConference(self, request):
         """Register user for selected conference."""
-        return self._conferenceRegistration(request)
+        registered = self._conferenceRegistration(request)
+        bumpUserVersion(getUserId(endpoints.get_current_user()))
+        recordChanges([ndb.Key(urlsafe=request.websafeConferenceKey)])
+        return registered
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='DELETE', name='unregisterFromConference')
+    @instrumented
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
-        return self._conferenceRegistration(request, reg=False)
+        unregistered = self._conferenceRegistration(request, reg=False)
+        bumpUserVersion(getUserId(endpoints.get_current_user()))
+        recordChanges([ndb.Key(urlsafe=request.websafeConferenceKey)])
+        return unregistered
+
+# - - - Seat holds - - - - - - - - - - - - - - - - - - - - -
+
+    def _liveConference(self, wsck):
+        """Return the live, not deleting conference of wsck or raise 404."""
+        conf_key = ndb.Key(urlsafe=wsck)
+        conf = getEntity(conf_key) if conf_key.kind() == 'Conference' \
+            else None
+        if not conf or conf.deleting:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        return conf
+
+
+    @endpoints.method(CONF_GET_REQUEST, SeatHoldForm,
+            path='conference/{websafeConferenceKey}/hold',
+            http_method='POST', name='holdSeat')
+    @instrumented
+    @rateLimited
+    def holdSeat(self, request):
+        """Reserve a seat for the user for a limited time, or extend the
+        user's hold; confirmSeatHold turns it into a registration."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+        wsck = request.websafeConferenceKey
+        conf = self._liveConference(wsck)
+        prof = getEntity(ndb.Key(Profile, user_id))
+        if prof and wsck in prof.conferenceKeysToAttend:
+            raise ConflictException(
+                "You have already registered for this conference")
+        hold = takeHold(conf.key, user_id)
+        if hold is None:
+            raise ConflictException("There are no seats available.")
+        recordChanges([conf.key])
+        return SeatHoldForm(websafeConferenceKey=wsck,
+                            expires=hold.expires.isoformat() + 'Z')
+
+
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}/hold/confirm',
+            http_method='POST', name='confirmSeatHold')
+    @instrumented
+    def confirmSeatHold(self, request):
+        """Register the user with the seat they hold."""
+        prof = self._getProfileFromUser()
+        conf = self._liveConference(request.websafeConferenceKey)
+        registered = confirmHold(conf.key, prof.key.id())
+        if registered is None:
+            raise ConflictException(
+                "You hold no seat for this conference; it may have expired.")
+        if registered:
+            bumpUserVersion(prof.key.id())
+        else:
+            # already registered; the held seat went back
+            recordChanges([conf.key])
+        return BooleanMessage(data=registered)
+
+
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}/hold',
+            http_method='DELETE', name='releaseSeatHold')
+    @instrumented
+    def releaseSeatHold(self, request):
+        """Give back the seat the user holds, e.g. after a failed payment."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        released = releaseHold(conf_key, getUserId(user))
+        if released:
+            recordChanges([conf_key])
+        return BooleanMessage(data=released)
+
+
+    @endpoints.method(SeatVersionForms, SeatVersionForms,
+            path='conferences/seats',
+            http_method='POST', name='watchSeats')
+    @instrumented
+    def watchSeats(self, request):
+        """Wait briefly for seatsAvailable of the given conferences to
+        change from the versions seen; return only the changed ones."""
+        if len(request.items) > MAX_WATCHED:
+            raise endpoints.BadRequestException(
+                'At most %d conferences can be watched' % MAX_WATCHED)
+        seen = {}
+        for item in request.items:
+            try:
+                kind = ndb.Key(urlsafe=item.websafeConferenceKey).kind()
+            except Exception:
+                kind = None
+            if kind != 'Conference':
+                raise endpoints.BadRequestException(
+                    'Invalid conference key: %s' % item.websafeConferenceKey)
+            seen[item.websafeConferenceKey] = item.version or 0
+        return SeatVersionForms(items=[
+            SeatVersionForm(websafeConferenceKey=wsck, version=version,
+                            seatsAvailable=seats)
+            for wsck, version, seats in waitForSeatChanges(seen)])
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='filterPlayground',
             http_method='GET', name='filterPlayground')
+    @instrumented
     def filterPlayground(self, request):
         """Filter Playground"""
         q = Conference.query()
@@ -590,9 +976,113 @@ class ConferenceApi(remote.Service):
         q = q.filter(Conference.month==6)
 
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in q]
+            items=[self._copyConferenceToForm(conf, "") for conf in runQuery(q)]
+        )
+
+# - - - Calendar feeds - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(message_types.VoidMessage, CalendarFeedForm,
+            path='profile/calendar',
+            http_method='GET', name='getCalendarFeeds')
+    @instrumented
+    def getCalendarFeeds(self, request):
+        """Return the iCalendar feed URLs of the user's schedule and of
+        each registered conference."""
+        if not feedsEnabled():
+            raise endpoints.InternalServerErrorException(
+                'Calendar feeds are not configured')
+        prof = self._getProfileFromUser()
+        host = 'https://%s' % app_identity.get_default_version_hostname()
+        return CalendarFeedForm(
+            schedule=host + userFeedPath(prof.key.id()),
+            conferences=[host + conferenceFeedPath(wsck)
+                         for wsck in prof.conferenceKeysToAttend])
+
+
+# - - - Exports - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _copyExportJobToForm(self, job):
+        """Copy relevant fields from ExportJob to ExportJobForm."""
+        return ExportJobForm(
+            jobId=str(job.key.id()),
+            websafeConferenceKey=job.conferenceKey,
+            what=job.what,
+            format=job.format,
+            status=job.status,
+            rows=job.rows,
+            parts=job.parts,
+            location=job.location,
+            error=job.error,
         )
 
+
+    @endpoints.method(EXPORT_POST_REQUEST, ExportJobForm,
+            path='conference/{websafeConferenceKey}/export',
+            http_method='POST', name='exportConference')
+    @instrumented
+    def exportConference(self, request):
+        """Start a background attendee or session export (organizer only)."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        what = request.what or 'attendees'
+        fmt = request.format or 'csv'
+        if what not in EXPORTS or fmt not in FORMATS:
+            raise endpoints.BadRequestException(
+                "Export 'what' must be one of %s and 'format' one of %s" % (
+                    ', '.join(EXPORTS), ', '.join(FORMATS)))
+
+        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        conf = getWithArchive(conf_key)
+        if not (conf and conf_key.kind() == 'Conference'):
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can export the conference.')
+
+        return self._copyExportJobToForm(
+            startExport(conf_key, what, fmt, user_id))
+
+
+    @endpoints.method(EXPORT_GET_REQUEST, ExportJobForm,
+            path='export/{jobId}',
+            http_method='GET', name='getExportJob')
+    @instrumented
+    def getExportJob(self, request):
+        """Return progress & location of an export job."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+
+        job = getEntity(ndb.Key(ExportJob, int(request.jobId))) \
+            if (request.jobId or '').isdigit() else None
+        if not job or job.organizerUserId != getUserId(user):
+            raise endpoints.NotFoundException(
+                'No export job found with id: %s' % request.jobId)
+        return self._copyExportJobToForm(job)
+
+# - - - Search - - - - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(SEARCH_GET_REQUEST, SearchResultForms,
+            path='search',
+            http_method='GET', name='search')
+    @instrumented
+    def search(self, request):
+        """Keyword search over conferences & sessions, best match first."""
+        if request.kind and request.kind not in FIELD_WEIGHTS:
+            raise endpoints.BadRequestException(
+                "'kind' must be one of: %s" % ', '.join(sorted(FIELD_WEIGHTS)))
+        limit = max(1, min(request.limit or SEARCH_LIMIT, MAX_SEARCH_LIMIT))
+        hits = getSearchIndex().search(request.q or '', kind=request.kind,
+                                       limit=limit)
+        return SearchResultForms(items=[
+            SearchResultForm(kind=h.kind, websafeKey=h.docId,
+                             title=h.title, score=h.score) for h in hits])
+
+
 # - - - Session objects - - - - - - - - - - - - - - - - -
     def _copySessionToForm(self, sess):
         """Copy relevant fields from Conference to ConferenceForm."""
@@ -620,14 +1110,14 @@ class ConferenceApi(remote.Service):
         user_id = getUserId(user)
 
         conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
-        conf = conf_key.get()
+        conf = getEntity(conf_key)
 
-        if not (conf and conf_key.kind() == 'Conference'):
+        if not (conf and conf_key.kind() == 'Conference') or conf.deleting:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
 
         # Organizer of the conference
-        prof = conf.key.parent().get()
+        prof = getEntity(conf.key.parent())
 
         if user_id != prof.key.id():
             raise endpoints.UnauthorizedException("You are not the organizer of this conference")
@@ -657,22 +1147,31 @@ class ConferenceApi(remote.Service):
         # generate Profile Key based on user ID and Conference
         # ID based on Profile key get Conference key from ID
         c_key = conf.key
-        s_id = Session.allocate_ids(size=1, parent=c_key)[0]
+        s_id = allocateId(Session, c_key)
         s_key = ndb.Key(Session, s_id, parent=c_key)
         data['key'] = s_key
         data['organizerUserId'] = request.organizerUserId = user_id
+        data['speakerKey'] = linkSpeakers([data['speaker']])[data['speaker']]
 
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        sess_key = Session(**data).put()
+        sess_key = putEntity(Session(**data))
+        flushEntities()
+        finishRefills()
+        bumpConferenceVersion(c_key)
+        invalidateGroup(conferenceGroup(c_key))
+        queueReindex([sess_key])
         taskqueue.add(url='/tasks/featured_speaker',
-                      params={'speaker': sess_key.get().speaker}
+                      params={'speaker': getEntity(sess_key).speaker}
                       )
 
-        return self._copySessionToForm(sess_key.get())
+        return self._copySessionToForm(getEntity(sess_key))
 
     @endpoints.method(CONF_SESS_POST_REQUEST, SessionForm, path='conference/{websafeConferenceKey}/createSession',
                       http_method='POST', name='createSession')
+    @instrumented
+    @rateLimited
+    @unitOfWork
     def createSession(self, request):
         """Create new session."""
         return self._createSessionObject(request)
@@ -680,16 +1179,16 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_GET_REQUEST, SessionForms,
             path='conference/{websafeConferenceKey}/sessions',
             http_method='GET', name='getConferenceSessions')
+    @instrumented
     def getConferenceSessions(self, request):
         """Return conference sessions"""
 
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = getWithArchive(ndb.Key(urlsafe=request.websafeConferenceKey))
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
 
-        # create ancestor query for all key matches for this user
-        sesss = Session.query(ancestor=conf.key)
+        sesss = _conferenceSessions(conf.key)
 
         # return set of ConferenceForm objects per Conference
         return SessionForms(
@@ -699,34 +1198,66 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESS_BY_TYPE_GET_REQUEST, SessionForms,
                       path='conference/{websafeConferenceKey}/sessions/{typeOfSession}',
                       http_method='GET', name='getConferenceSessionsByType')
+    @instrumented
     def getConferenceSessionsByType(self, request):
         """Return conference sessions by Type"""
 
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = getWithArchive(ndb.Key(urlsafe=request.websafeConferenceKey))
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
 
-        # create ancestor query for all key matches for this user
-        sesss = Session.query(Session.typeOfSession == request.typeOfSession, ancestor=conf.key)
+        sesss = [sess for sess in _conferenceSessions(conf.key)
+                 if request.typeOfSession in sess.typeOfSession]
         # return set of ConferenceForm objects per Conference
         return SessionForms(
             items=[self._copySessionToForm(sess) for sess in sesss]
         )
 
+    @staticmethod
+    def _sessionsBySpeaker(speaker, **options):
+        """Return the sessions linked to a speaker, plus unlinked ones
+        (stored before speaker keys) of exactly that name until the
+        backfill has linked them all. Options go to both queries."""
+        key = speakerKey(speaker)
+        if key is None:
+            return []
+        sesss = runQuery(Session.query(Session.speakerKey == key), **options)
+        if speakerBackfillDone(Session._get_kind()):
+            return sesss
+        # a session of that name with a speaker key has this one, so it
+        # was found above; projections keep the key to tell them apart
+        linked = set(s.key for s in sesss)
+        sesss += runQuery(Session.query(Session.speaker == speaker),
+                          residual=lambda s: s.key not in linked, **options)
+        return sesss
+
     @endpoints.method(SESS_BY_SPEAKER_GET_REQUEST, SessionForms,
                       path='sessions/{speaker}',
                       http_method='GET', name='getSessionsBySpeaker')
+    @instrumented
     def getSessionsBySpeaker(self, request):
-        """Return conference sessions by speaker"""
-
-        sesss = Session.query(Session.speaker == request.speaker)
+        """Return conference sessions by speaker, however the name is
+        spelled or capitalized"""
+        sesss = self._sessionsBySpeaker(request.speaker)
 
         # return set of ConferenceForm objects per Conference
         return SessionForms(
             items=[self._copySessionToForm(sess) for sess in sesss]
         )
 
+    @endpoints.method(SPEAKER_SUGGEST_GET_REQUEST, SpeakerForms,
+                      path='speakers/suggest',
+                      http_method='GET', name='suggestSpeakers')
+    @instrumented
+    def suggestSpeakers(self, request):
+        """Return speakers whose name words start with the words of q,
+        for autocomplete"""
+        limit = min(request.limit or SUGGEST_LIMIT, SUGGEST_LIMIT)
+        return SpeakerForms(items=[
+            SpeakerForm(speakerId=speaker_id, name=name)
+            for speaker_id, name in matchSpeakers(request.q, limit)])
+
     # Wish list
     def _sessionRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
@@ -737,7 +1268,7 @@ class ConferenceApi(remote.Service):
         # get conference; check that it exists
         wssk = request.websafeSessionKey
         sess_key = ndb.Key(urlsafe=wssk)
-        sess = sess_key.get()
+        sess = getWithArchive(sess_key)
 
         if not (sess and sess_key.kind() == 'Session'):
             raise endpoints.NotFoundException(
@@ -766,12 +1297,15 @@ class ConferenceApi(remote.Service):
                 retval = False
 
         # write things back to the datastore & return
-        prof.put()
+        putEntity(prof)
+        flushEntities()
+        bumpUserVersion(prof.key.id())
         return BooleanMessage(data=retval)
 
     @endpoints.method(CONF_GET_REQUEST, SessionForms,
             path='session/attending',
             http_method='GET', name='getSessionsInWishlist')
+    @instrumented
     def getSessionsInWishlist(self, request):
         """Get list of sessions that user is interested in."""
         prof = self._getProfileFromUser()  # get user Profile
@@ -780,7 +1314,7 @@ class ConferenceApi(remote.Service):
 
         if request.websafeConferenceKey:
             conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
-            conf = conf_key.get()
+            conf = getEntity(conf_key)
 
             if not (conf and conf_key.kind() == 'Conference'):
                 raise endpoints.NotFoundException(
@@ -790,7 +1324,7 @@ class ConferenceApi(remote.Service):
                 if (key.parent() != conf_key):
                     sess_keys.remove(key)
 
-        sessions = ndb.get_multi(sess_keys)
+        sessions = getMultiWithArchive(sess_keys)
 
         # return set of ConferenceForm objects per Conference
         return SessionForms(items=[self._copySessionToForm(sess) \
@@ -800,6 +1334,8 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESS_GET_REQUEST, BooleanMessage,
             path='session/wishlist/{websafeSessionKey}',
             http_method='POST', name='addSessionToWishlist')
+    @instrumented
+    @unitOfWork
     def addSessionToWishlist(self, request):
         """Add session to user's wish list."""
         return self._sessionRegistration(request)
@@ -807,6 +1343,8 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESS_GET_REQUEST, BooleanMessage,
             path='session/wishlist/{websafeSessionKey}',
             http_method='DELETE', name='deleteSessionInWishlist')
+    @instrumented
+    @unitOfWork
     def deleteSessionInWishlist(self, request):
         """Remove session from user's wish list."""
         return self._sessionRegistration(request, reg=False)
@@ -821,7 +1359,7 @@ class ConferenceApi(remote.Service):
 
         # Check if session exist
         sess_key = ndb.Key(urlsafe=request.websafeSessionKey)
-        sess = sess_key.get()
+        sess = getEntity(sess_key)
 
         if not (sess and sess_key.kind() == 'Session'):
             raise endpoints.NotFoundException(
@@ -848,12 +1386,19 @@ class ConferenceApi(remote.Service):
                 # write to Conference object
                 setattr(sess, field.name, data)
 
-        sess.put()
+        if request.speaker:
+            sess.speakerKey = linkSpeakers([sess.speaker])[sess.speaker]
+        putEntity(sess)
+        flushEntities()
+        bumpConferenceVersion(sess.key.parent())
+        invalidateGroup(conferenceGroup(sess.key.parent()))
+        queueReindex([sess.key])
 
         return self._copySessionToForm(sess)
 
     @endpoints.method(SESS_POST_REQUEST, BooleanMessage, path='session/{websafeSessionKey}',
                       http_method='DELETE', name='deleteSession')
+    @instrumented
     def deleteSession(self, request):
         """Delete an existing session."""
         # Check if user is logged in
@@ -864,7 +1409,7 @@ class ConferenceApi(remote.Service):
 
         # Check if session exist
         sess_key = ndb.Key(urlsafe=request.websafeSessionKey)
-        sess = sess_key.get()
+        sess = getEntity(sess_key)
 
         if not (sess and sess_key.kind() == 'Session'):
             raise endpoints.NotFoundException(
@@ -875,13 +1420,18 @@ class ConferenceApi(remote.Service):
         if user_id != organizer_uid:
             raise endpoints.UnauthorizedException("You are not the organizer of this session")
 
-        sess_key.delete()
+        deleteEntities([sess_key])
+        bumpConferenceVersion(sess_key.parent())
+        invalidateGroup(conferenceGroup(sess_key.parent()))
+        queueReindex([sess_key])
 
         return BooleanMessage(data=True)
 
     @endpoints.method(SESS_POST_REQUEST, SessionForm,
                       path='session/{websafeSessionKey}',
                       http_method='PUT', name='updateSession')
+    @instrumented
+    @unitOfWork
     def updateSession(self, request):
         """Update session w/provided fields & return w/updated info."""
 
@@ -890,11 +1440,12 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESS_GET_REQUEST, SessionForm,
                       path='session/{websafeSessionKey}',
                       http_method='GET', name='getSession')
+    @instrumented
     def getSession(self, request):
         """Retrieve a specific session info."""
 
         sess_key = ndb.Key(urlsafe=request.websafeSessionKey)
-        sess = sess_key.get()
+        sess = getWithArchive(sess_key)
 
         if not (sess and sess_key.kind() == 'Session'):
             raise endpoints.NotFoundException(
@@ -905,19 +1456,24 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESS_QUERY_GET_REQUEST, SessionForms,
                       path='sessions',
                       http_method='GET', name='getSessionsInDateRange')
+    @instrumented
     def getSessionsInDateRange(self, request):
         """Query session within a date range"""
 
         conf_key = None
+        model = Session
         startDate = datetime.min.date()
         endDate = datetime.max.date()
         if request.websafeConferenceKey:
             conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
-            conf = conf_key.get()
+            conf = getWithArchive(conf_key)
 
             if not (conf and conf_key.kind() == 'Conference'):
                 raise endpoints.NotFoundException(
                     'No conference found with key: %s' % request.websafeConferenceKey)
+            if isArchived(conf.key):
+                conf_key = conf.key
+                model = ArchivedSession
 
         if request.startDate:
             startDate = datetime.strptime(request.startDate[:10], "%Y-%m-%d").date()
@@ -926,8 +1482,8 @@ class ConferenceApi(remote.Service):
             endDate = datetime.strptime(request.endDate[:10], "%Y-%m-%d").date()
 
 
-        sessions = Session.query(ndb.AND(Session.date >= startDate, Session.date <= endDate), ancestor=conf_key)\
-                          .order(Session.date)
+        sessions = runQuery(model.query(ndb.AND(model.date >= startDate, model.date <= endDate),
+                                        ancestor=conf_key).order(model.date))
 
         return SessionForms(
             items=[self._copySessionToForm(sess) for sess in sessions]
@@ -936,6 +1492,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(message_types.VoidMessage, SessionForms,
             path='queryPlayground',
             http_method='GET', name='queryPlayground')
+    @instrumented
     def queryPlayground(self, request):
         """Query Playground"""
 
@@ -983,7 +1540,7 @@ class ConferenceApi(remote.Service):
                                   ))
 
         return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in q]
+            items=[self._copySessionToForm(sess) for sess in runQuery(q)]
         )
 
 # - - - Featured Speakers - - - - - - - - - - - - - - - - -
@@ -993,9 +1550,8 @@ class ConferenceApi(remote.Service):
         memcache cron job & putSpekaer().
         """
 
-        sesss = Session.query(
-            Session.speaker == speaker
-        ).fetch(projection=[Session.name])
+        sesss = ConferenceApi._sessionsBySpeaker(
+            speaker, projection=[Session.name])
 
         # More than one session
         if len(sesss) > 1:
@@ -1016,6 +1572,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='session/speaker/get',
             http_method='GET', name='getFeaturedSpeaker')
+    @instrumented
     def getFeaturedSpeaker(self, request):
         """Return Announcement from memcache."""
         return StringMessage(data=memcache.get(MEMCACHE_SPEAKER_KEY) or "")
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""
+deletion.py -- cascading conference deletion in chained background tasks
+
+deleteConference only flags the Conference as deleting; the task chain
+then, in batches:
+
+    sessions       scrub wishlists referencing a batch of sessions, then
+                   drop that batch from the search index & delete it with
+                   keys-only queries & deleteEntities
+    registrations  scrub conferenceKeysToAttend of registered Profiles
+    conference     delete the Conference itself
+
+Every step is idempotent and its position (phase + cursor) travels in the
+task parameters, so a retried task simply redoes its own batch.
+
+"""
+
+import logging
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from archive import archivedKey
+from archive import isArchived
+from archive import liveKey
+from caching import conferenceGroup
+from caching import invalidateGroup
+from models import ArchivedSession
+from models import Profile
+from models import Session
+from querylog import runQuery
+from storage import deleteEntities
+from storage import fetchPage
+from storage import getEntities
+from storage import getEntity
+from storage import putEntity
+from storage import transactional
+from textsearch import getSearchIndex
+
+DELETE_TASK_URL = '/tasks/delete_conference'
+SESSION_BATCH = 30              # sessions per batch (IN filter limit)
+PROFILE_BATCH = 100             # profiles scrubbed per batch
+BATCHES_PER_TASK = 10
+
+PHASES = ('sessions', 'registrations', 'conference')
+
+
+@transactional()
+def _scrubProfile(p_key, conf_wsck, sess_wssks):
+    prof = getEntity(p_key)
+    if prof is None:
+        return
+    attend = [k for k in prof.conferenceKeysToAttend if k != conf_wsck]
+    wishlist = [k for k in prof.sessionKeysToAttend if k not in sess_wssks]
+    if (len(attend) != len(prof.conferenceKeysToAttend) or
+            len(wishlist) != len(prof.sessionKeysToAttend)):
+        prof.conferenceKeysToAttend = attend
+        prof.sessionKeysToAttend = wishlist
+        putEntity(prof)
+
+
+def _scrubProfiles(p_keys, conf_wsck=None, sess_wssks=()):
+    """Remove references from profiles, one small transaction each."""
+    sess_wssks = frozenset(sess_wssks)
+    for p_key in p_keys:
+        _scrubProfile(p_key, conf_wsck, sess_wssks)
+
+
+def _deleteSessions(conf_key):
+    """Scrub wishlists of & delete one batch of sessions; return the
+    number deleted (0 when none are left).
+    """
+    model = ArchivedSession if isArchived(conf_key) else Session
+    keys = runQuery(model.query(ancestor=conf_key), limit=SESSION_BATCH,
+                    keys_only=True)
+    if not keys:
+        return 0
+    # wishlists always hold live session keys
+    wssks = [liveKey(k).urlsafe() for k in keys]
+    cursor = None
+    while True:
+        p_keys, cursor, more = fetchPage(
+            Profile.query(Profile.sessionKeysToAttend.IN(wssks)).order(
+                Profile.key), PROFILE_BATCH, cursor, keys_only=True)
+        _scrubProfiles(p_keys, sess_wssks=wssks)
+        if not (more and cursor):
+            break
+    getSearchIndex().delete(wssks)
+    deleteEntities(keys)
+    invalidateGroup(conferenceGroup(conf_key))
+    return len(keys)
+
+
+def _scrubRegistrations(conf_wsck, cursor):
+    """Scrub one page of registrations; return the next cursor or None."""
+    p_keys, next_cursor, more = fetchPage(
+        Profile.query(Profile.conferenceKeysToAttend == conf_wsck),
+        PROFILE_BATCH, cursor, keys_only=True)
+    _scrubProfiles(p_keys, conf_wsck=conf_wsck)
+    return next_cursor if more and next_cursor else None
+
+
+def runDeleteStep(conf_wsck, phase='sessions', cursor=None):
+    """Run up to BATCHES_PER_TASK batches of a conference deletion.
+
+    `conf_wsck` is the conference's live websafe key. Returns the
+    (phase, cursor) to continue from, or None when the deletion is done.
+    """
+    if phase not in PHASES:
+        raise ValueError('unknown deletion phase: %r' % phase)
+    conf_key = ndb.Key(urlsafe=conf_wsck)
+    if conf_key.kind() != 'Conference':
+        raise ValueError('not a conference key: %r' % conf_wsck)
+    live, archived = getEntities([conf_key, archivedKey(conf_key)])
+    conf = live or archived
+    # only a conference deleteConference flagged (or one already gone,
+    # when a retried task finishes the cascade) may be deleted
+    if conf and not conf.deleting:
+        logging.warning('refusing to delete conference %s: not flagged '
+                        'as deleting', conf_wsck)
+        return None
+    # sessions of an archived conference live under the archived key
+    if live is None and archived:
+        sess_parent = archivedKey(conf_key)
+    else:
+        sess_parent = conf_key
+
+    for _ in range(BATCHES_PER_TASK):
+        if phase == 'sessions':
+            if not _deleteSessions(sess_parent):
+                phase, cursor = 'registrations', None
+        elif phase == 'registrations':
+            cursor = _scrubRegistrations(conf_wsck, cursor)
+            if cursor is None:
+                phase = 'conference'
+        else:
+            deleteEntities([conf_key, archivedKey(conf_key)])
+            logging.info('deleted conference %s', conf_wsck)
+            return None
+    return phase, cursor
+
+
+def queueDeleteStep(conf_wsck, phase='sessions', cursor=None,
+                    transactional=False):
+    params = {'conf': conf_wsck, 'phase': phase}
+    if cursor:
+        params['cursor'] = cursor
+    taskqueue.add(url=DELETE_TASK_URL, params=params,
+                  transactional=transactional)
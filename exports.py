@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+"""
+exports.py -- background attendee & agenda exports for organizers
+
+An ExportJob is advanced by a chain of tasks; each step pages through the
+registrations (or the conference's sessions) with a cursor and writes
+every page as one CSV or JSON Lines part, so memory stays bounded by the
+page size. Parts go to the Cloud Storage bucket of settings.EXPORT_BUCKET
+(the app's default bucket if unset) and are composed into one object once
+the walk is done; a job fails if there is no bucket. Only the
+dev_appserver & testbed fall back to a local directory.
+
+"""
+
+import csv
+import json
+import logging
+import os
+from cStringIO import StringIO
+
+from google.appengine.api import app_identity
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import cloudstorage
+
+from archive import isArchived
+from archive import getWithArchive
+from models import ArchivedSession
+from models import ExportJob
+from models import Profile
+from models import Session
+from settings import EXPORT_BUCKET
+from storage import fetchPage
+from storage import getEntity
+from storage import putEntity
+
+EXPORT_TASK_URL = '/tasks/export'
+EXPORT_PAGE = 200               # rows per datastore page & per part
+PAGES_PER_TASK = 10             # pages written before chaining a new task
+COMPOSE_LIMIT = 32              # max source objects per GCS compose call
+LOCAL_EXPORT_DIR = os.environ.get(
+    'CONFERENCE_EXPORT_DIR', os.path.join('/tmp', 'conference-exports'))
+
+EXPORTS = ('attendees', 'sessions')
+FORMATS = ('csv', 'jsonl')
+
+ATTENDEE_COLUMNS = ('displayName', 'mainEmail', 'teeShirtSize')
+SESSION_COLUMNS = ('name', 'speaker', 'typeOfSession', 'date', 'startTime',
+                   'duration', 'highlists')
+
+
+# - - - storage - - - - - - - - - - - - - - - - - - - - - - -
+
+class ExportStoreError(Exception):
+    """ExportStoreError -- no place to write exports to"""
+
+
+class LocalExportStore(object):
+    """LocalExportStore -- local-directory stand-in for Cloud Storage,
+    for the dev_appserver & testbed only"""
+
+    def __init__(self, root=LOCAL_EXPORT_DIR):
+        self.root = root
+
+    def _path(self, name):
+        path = os.path.join(self.root, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        return path
+
+    def writePart(self, name, data):
+        with open(self._path(name), 'wb') as f:
+            f.write(data)
+
+    def combine(self, parts, name):
+        """Concatenate parts into `name`; return its location."""
+        path = self._path(name)
+        with open(path, 'wb') as out:
+            for part in parts:
+                with open(self._path(part), 'rb') as f:
+                    while True:
+                        chunk = f.read(64 * 1024)
+                        if not chunk:
+                            break
+                        out.write(chunk)
+        return path
+
+    def delete(self, names):
+        for name in names:
+            path = os.path.join(self.root, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class CloudStorageExportStore(object):
+    """CloudStorageExportStore -- parts & result as objects in a bucket"""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def _path(self, name):
+        return '/%s/%s' % (self.bucket, name)
+
+    def writePart(self, name, data):
+        with cloudstorage.open(self._path(name), 'w') as f:
+            f.write(data)
+
+    def _merge(self, sources, target):
+        # compose takes 2..COMPOSE_LIMIT object names without the bucket
+        if len(sources) == 1:
+            cloudstorage.copy2(self._path(sources[0]), self._path(target))
+        else:
+            cloudstorage.compose(sources, self._path(target))
+
+    def combine(self, parts, name):
+        """Compose parts into `name`, COMPOSE_LIMIT objects per call."""
+        sources = [str(p) for p in parts]
+        name = str(name)
+        step = 0
+        while len(sources) > COMPOSE_LIMIT:
+            merged = []
+            for i in range(0, len(sources), COMPOSE_LIMIT):
+                target = '%s.compose-%d-%d' % (name, step, i)
+                self._merge(sources[i:i + COMPOSE_LIMIT], target)
+                merged.append(target)
+            if step:
+                self.delete(sources)
+            sources = merged
+            step += 1
+        self._merge(sources, name)
+        if step:
+            self.delete(sources)
+        return 'gs:/' + self._path(name)
+
+    def delete(self, names):
+        for name in names:
+            try:
+                cloudstorage.delete(self._path(name))
+            except cloudstorage.NotFoundError:
+                pass
+
+
+def _isDevelopment():
+    # the testbed sets no SERVER_SOFTWARE, the dev_appserver 'Development/x'
+    return not os.environ.get('SERVER_SOFTWARE', '').startswith(
+        'Google App Engine')
+
+
+def getExportStore():
+    """Return the Cloud Storage store of the configured bucket; the
+    local stand-in on the dev_appserver & testbed when there is none.
+
+    Raises ExportStoreError in production when no bucket is configured.
+    """
+    bucket = EXPORT_BUCKET or app_identity.get_default_gcs_bucket_name()
+    if bucket:
+        return CloudStorageExportStore(bucket)
+    if _isDevelopment():
+        return LocalExportStore()
+    raise ExportStoreError('no Cloud Storage bucket for exports: set '
+                           'settings.EXPORT_BUCKET or create the '
+                           "app's default bucket")
+
+
+# - - - rows - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _attendeeRow(prof):
+    return [prof.displayName, prof.mainEmail, prof.teeShirtSize]
+
+
+def _sessionRow(sess):
+    return [sess.name, sess.speaker, ';'.join(sess.typeOfSession),
+            str(sess.date) if sess.date else None,
+            sess.startTime.strftime('%H:%M') if sess.startTime else None,
+            sess.duration, sess.highlists]
+
+
+def _encode(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def formatRows(fmt, columns, rows, header=False):
+    """Return CSV or JSON Lines text for a page of rows."""
+    buf = StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buf)
+        if header:
+            writer.writerow(columns)
+        for row in rows:
+            writer.writerow([_encode(v) for v in row])
+    else:
+        for row in rows:
+            buf.write(json.dumps(dict(zip(columns, row)),
+                                 separators=(',', ':')))
+            buf.write('\n')
+    return buf.getvalue()
+
+
+def _exportQuery(job):
+    """Return (query, columns, row builder) for a job."""
+    conf_key = ndb.Key(urlsafe=job.conferenceKey)
+    if job.what == 'attendees':
+        # registrations hold the live key, even for archived conferences
+        query = Profile.query(
+            Profile.conferenceKeysToAttend == job.conferenceKey)
+        return query, ATTENDEE_COLUMNS, _attendeeRow
+    conf = getWithArchive(conf_key)
+    model = ArchivedSession if conf and isArchived(conf.key) else Session
+    query = model.query(ancestor=conf.key if conf else conf_key)
+    return query, SESSION_COLUMNS, _sessionRow
+
+
+# - - - job - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _partName(job, index):
+    return 'exports/%d/part-%05d.%s' % (job.key.id(), index, job.format)
+
+
+def startExport(conf_key, what, fmt, user_id):
+    """Create an ExportJob and queue its first step; return the job."""
+    job = ExportJob(conferenceKey=conf_key.urlsafe(), what=what,
+                    format=fmt, organizerUserId=user_id, status='running')
+    putEntity(job)
+    taskqueue.add(url=EXPORT_TASK_URL, params={'job': job.key.id()})
+    return job
+
+
+def runExportStep(job_id, store=None):
+    """Write up to PAGES_PER_TASK pages of a job; return True when the
+    job needs another step.
+
+    Progress (cursor, rows, parts) is saved after every part, and part
+    names are derived from the part index, so a retried task rewrites at
+    most the part it was in the middle of.
+    """
+    job = getEntity(ndb.Key(ExportJob, int(job_id)))
+    if job is None or job.status != 'running':
+        return False
+    try:
+        store = store or getExportStore()
+    except ExportStoreError as e:
+        logging.error('export %d failed: %s', job.key.id(), e)
+        job.status = 'failed'
+        job.error = str(e)
+        putEntity(job)
+        return False
+    query, columns, build = _exportQuery(job)
+
+    for _ in range(PAGES_PER_TASK):
+        entities, next_cursor, more = fetchPage(query, EXPORT_PAGE,
+                                                job.cursor)
+        if entities or not job.parts:
+            data = formatRows(job.format, columns,
+                              [build(e) for e in entities],
+                              header=not job.parts)
+            store.writePart(_partName(job, job.parts), data)
+            job.parts += 1
+            job.rows += len(entities)
+        job.cursor = next_cursor
+        if not (more and next_cursor):
+            parts = [_partName(job, i) for i in range(job.parts)]
+            job.location = store.combine(
+                parts, 'exports/%d/%s.%s' % (job.key.id(), job.what,
+                                             job.format))
+            job.status = 'done'
+            putEntity(job)
+            # parts outlive the combine until the job is saved as done,
+            # so a retried final step can combine them again
+            store.delete(parts)
+            logging.info('export %d done: %d rows', job.key.id(), job.rows)
+            return False
+        putEntity(job)
+    return True
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+"""
+facets.py -- per-value conference counts for the city, topic & month
+    filters, kept in sharded counters and served from one memcache entry
+
+Writes never count anything: _createConferenceObject,
+_updateConferenceObject, archival and deletion queue the +1/-1 deltas
+their change implies (transactionally where they run in a transaction),
+and /tasks/facets applies them to a shard of each counter.
+
+Applying is idempotent: the shard is picked from the task name, and a
+FacetApplied marker named after the task is written in the same
+transaction as the shard, so a retried task skips the counters it
+already changed. Markers outlive the facets queue's task_age_limit by a
+day and are then purged by /crons/purge_facet_markers.
+
+"""
+
+import json
+import random
+import zlib
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import FacetApplied
+from models import FacetShard
+from querylog import runQuery
+from storage import deleteEntities
+from storage import fetchPage
+from storage import putEntities
+
+FACETS_TASK_URL = '/tasks/facets'
+FACETS_QUEUE = 'facets'
+MARKER_SECONDS = 2 * 24 * 3600  # queue.yaml task_age_limit (1d) + a day
+PURGE_BATCH = 500
+MEMCACHE_FACETS_KEY = 'CONFERENCE_FACETS'
+FACETS_CACHE_SECONDS = 600
+NUM_SHARDS = 10
+CAS_RETRIES = 5
+
+# counted Conference property -> query field name used by the filter UI
+FACET_FIELDS = {
+    'city': 'CITY',
+    'topics': 'TOPIC',
+    'month': 'MONTH',
+}
+
+
+def facetValues(conf):
+    """Return the set of (facet, value) pairs a conference counts for."""
+    values = set()
+    if conf is None:
+        return values
+    if conf.city:
+        values.add(('city', conf.city))
+    for topic in conf.topics or []:
+        values.add(('topics', topic))
+    if conf.month:
+        values.add(('month', str(conf.month)))
+    return values
+
+
+def facetDeltas(old, new):
+    """Return {(facet, value): delta} turning facetValues `old` into `new`."""
+    deltas = dict((fv, -1) for fv in old - new)
+    deltas.update((fv, 1) for fv in new - old)
+    return deltas
+
+
+def queueFacetDeltas(deltas, transactional=False):
+    """Queue a task applying deltas; no-op when nothing changed."""
+    if not deltas:
+        return
+    payload = json.dumps([[f, v, d] for (f, v), d in deltas.iteritems()],
+                         separators=(',', ':'))
+    taskqueue.add(url=FACETS_TASK_URL, params={'deltas': payload},
+                  queue_name=FACETS_QUEUE, transactional=transactional)
+
+
+# - - - counters - - - - - - - - - - - - - - - - - - - - - -
+
+def _shardId(facet, value, shard):
+    return '%s|%s|%d' % (facet, value, shard)
+
+
+@ndb.transactional_tasklet
+def _incrementShard(facet, value, delta, task_name=None):
+    """Add delta to a shard; return False if task_name already did."""
+    if task_name:
+        # a retry of the task lands on the same shard & finds its marker
+        index = (zlib.crc32(task_name) & 0xffffffff) % NUM_SHARDS
+    else:
+        index = random.randrange(NUM_SHARDS)
+    key = ndb.Key(FacetShard, _shardId(facet, value, index))
+    if task_name:
+        marker_key = ndb.Key(FacetApplied, task_name, parent=key)
+        shard, marker = yield key.get_async(), marker_key.get_async()
+        if marker is not None:
+            raise ndb.Return(False)
+    else:
+        shard = yield key.get_async()
+    if shard is None:
+        shard = FacetShard(key=key, facet=facet, value=value, count=0)
+    shard.count += delta
+    if task_name:
+        yield ndb.put_multi_async([shard, FacetApplied(key=marker_key)])
+    else:
+        yield shard.put_async()
+    raise ndb.Return(True)
+
+
+def _adjustCache(deltas):
+    """Apply deltas to the cached totals in place (compare-and-set); a
+    missing cache entry is left to the next read to rebuild.
+    """
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        totals = client.gets(MEMCACHE_FACETS_KEY)
+        if totals is None:
+            return
+        for (facet, value), delta in deltas.iteritems():
+            counts = totals.setdefault(facet, {})
+            counts[value] = counts.get(value, 0) + delta
+        if client.cas(MEMCACHE_FACETS_KEY, totals, FACETS_CACHE_SECONDS):
+            return
+    memcache.delete(MEMCACHE_FACETS_KEY)
+
+
+def applyFacetDeltas(payload, task_name=None):
+    """Apply a queued delta payload to the shards & the cache.
+
+    `task_name` makes it idempotent: deltas a previous run of that task
+    applied are skipped.
+    """
+    deltas = dict(((f, v), d) for f, v, d in json.loads(payload))
+    futures = dict((fv, _incrementShard(fv[0], fv[1], d, task_name))
+                   for fv, d in deltas.iteritems())
+    ndb.Future.wait_all(futures.values())
+    _adjustCache(dict((fv, deltas[fv]) for fv, f in futures.iteritems()
+                      if f.get_result()))
+
+
+def purgeFacetMarkers(now=None):
+    """Delete up to PURGE_BATCH markers older than MARKER_SECONDS;
+    return True if more may be left.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=MARKER_SECONDS)
+    keys = runQuery(FacetApplied.query(FacetApplied.applied < cutoff),
+                    limit=PURGE_BATCH, keys_only=True)
+    deleteEntities(keys)
+    return len(keys) == PURGE_BATCH
+
+
+def getFacetCounts():
+    """Return {facet: {value: count}}; one memcache get when warm."""
+    totals = memcache.get(MEMCACHE_FACETS_KEY)
+    if totals is None:
+        totals = {}
+        for shard in FacetShard.query():
+            counts = totals.setdefault(shard.facet, {})
+            counts[shard.value] = counts.get(shard.value, 0) + shard.count
+        memcache.add(MEMCACHE_FACETS_KEY, totals, FACETS_CACHE_SECONDS)
+    return totals
+
+
+def rebuildFacetCounts(page_size=500):
+    """Recount all live conferences into shard 0, dropping other shards.
+
+    Meant for backfilling or repairing counters while writes are quiet.
+    """
+    totals = {}
+    cursor = None
+    while True:
+        confs, cursor, more = fetchPage(Conference.query(), page_size,
+                                        cursor)
+        for conf in confs:
+            if conf.deleting:
+                continue
+            for fv in facetValues(conf):
+                totals[fv] = totals.get(fv, 0) + 1
+        if not (more and cursor):
+            break
+    deleteEntities(runQuery(FacetShard.query(), keys_only=True))
+    putEntities([FacetShard(key=ndb.Key(FacetShard, _shardId(f, v, 0)),
+                            facet=f, value=v, count=n)
+                 for (f, v), n in totals.iteritems()])
+    memcache.delete(MEMCACHE_FACETS_KEY)
+    return len(totals)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""
+holds.py -- time-limited seat holds: a seat reserved for a user while
+    they pay, turned into a registration by confirming it, and reclaimed
+    in bulk by cron once it expires
+
+A SeatHold is a child of its Conference, so taking or releasing a hold
+writes that one entity group and never the Profile; confirming writes the
+Profile and deletes the hold, leaving the Conference alone.
+
+"""
+
+import logging
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.ext import ndb
+
+from catalog import recordChanges
+from models import Profile
+from models import SeatHold
+from seatfeed import publishSeats
+from storage import deleteEntities
+from storage import getEntities
+from storage import getEntity
+from storage import putEntity
+from storage import transactional
+
+HOLD_SECONDS = 600
+RECLAIM_BATCH = 500             # expired holds looked at per task
+
+
+def holdKey(conf_key, user_id):
+    return ndb.Key(SeatHold, user_id, parent=conf_key)
+
+
+def _moveSeats(conf, delta):
+    """Change seatsAvailable inside a transaction; seat watchers hear of
+    it once the transaction commits."""
+    conf.seatsAvailable += delta
+    putEntity(conf)
+    seats = conf.seatsAvailable
+    ndb.get_context().call_on_commit(
+        lambda: publishSeats(conf.key, seats, delta))
+
+
+@transactional(retries=5, deadline=2)
+def takeHold(conf_key, user_id):
+    """Hold a seat for HOLD_SECONDS, or extend the user's hold.
+
+    Returns the SeatHold, or None if there is no seat left.
+    """
+    conf = getEntity(conf_key)
+    hold = getEntity(holdKey(conf_key, user_id))
+    if hold is None:
+        if not conf or conf.deleting or conf.seatsAvailable <= 0:
+            return None
+        _moveSeats(conf, -1)
+        hold = SeatHold(key=holdKey(conf_key, user_id))
+    hold.expires = datetime.utcnow() + timedelta(seconds=HOLD_SECONDS)
+    putEntity(hold)
+    return hold
+
+
+@transactional()
+def releaseHold(conf_key, user_id):
+    """Drop a user's hold & give its seat back; return False if none."""
+    hold = getEntity(holdKey(conf_key, user_id))
+    if hold is None:
+        return False
+    deleteEntities([hold.key])
+    conf = getEntity(conf_key)
+    if conf:
+        _moveSeats(conf, 1)
+    return True
+
+
+@transactional(xg=True, deadline=2)
+def confirmHold(conf_key, user_id):
+    """Turn the user's unexpired hold into a registration.
+
+    Returns True once registered, False if the user was registered
+    already (the held seat is given back) and None if there is no
+    unexpired hold.
+    """
+    hold, prof = getEntities([holdKey(conf_key, user_id),
+                              ndb.Key(Profile, user_id)])
+    if hold is None or prof is None or hold.expires < datetime.utcnow():
+        return None
+    deleteEntities([hold.key])
+    wsck = conf_key.urlsafe()
+    if wsck in prof.conferenceKeysToAttend:
+        conf = getEntity(conf_key)
+        if conf:
+            _moveSeats(conf, 1)
+        return False
+    prof.conferenceKeysToAttend.append(wsck)
+    putEntity(prof)
+    return True
+
+
+# run by cron, so nobody waits on the retries
+@transactional(retries=8)
+def _reclaim(conf_key, hold_keys, now):
+    holds = [h for h in getEntities(hold_keys) if h and h.expires < now]
+    if not holds:
+        return 0
+    deleteEntities([h.key for h in holds])
+    conf = getEntity(conf_key)
+    # holds of deleted or archived conferences just go
+    if conf:
+        _moveSeats(conf, len(holds))
+    return len(holds)
+
+
+def reclaimExpiredHolds(now=None):
+    """Delete up to RECLAIM_BATCH expired holds, giving their seats back
+    with one transaction per conference.
+
+    Returns True if more expired holds may be left.
+    """
+    now = now or datetime.utcnow()
+    keys = SeatHold.query(SeatHold.expires < now).fetch(RECLAIM_BATCH,
+                                                         keys_only=True)
+    by_conf = {}
+    for key in keys:
+        by_conf.setdefault(key.parent(), []).append(key)
+    reclaimed = 0
+    for conf_key, hold_keys in by_conf.iteritems():
+        reclaimed += _reclaim(conf_key, hold_keys, now)
+    recordChanges(by_conf.keys())
+    if keys:
+        logging.info('reclaimed %d expired seat holds of %d conferences',
+                     reclaimed, len(by_conf))
+    return len(keys) == RECLAIM_BATCH
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+"""
+ical.py -- iCalendar feeds of a conference's sessions and of a user's
+    schedule (registered conferences plus wishlisted sessions), rendered
+    once per content version and served from memcache
+
+Every conference has a version number in memcache, bumped after any write
+to it or its sessions; every user has one, bumped after their
+registrations or wishlist change. A cached feed records the versions it
+was rendered from, so serving a poll is one memcache get_multi (plus one
+for the conference versions of a user feed) and no datastore reads while
+nothing changed. An evicted version is re-created from the clock, so it
+never matches a feed rendered before.
+
+User feed URLs are signed with settings.ICAL_FEED_SECRET. While it is
+unset or still the placeholder, no URL is signed and no user feed is
+served, and importing this module logs an error.
+
+"""
+
+import hashlib
+import hmac
+import logging
+import time
+import urllib
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from archive import getMultiWithArchive
+from archive import getWithArchive
+from archive import isArchived
+from models import ArchivedSession
+from models import Profile
+from models import Session
+from querylog import runQuery
+from settings import ICAL_FEED_SECRET
+from storage import getEntity
+
+FEED_CACHE_SECONDS = 24 * 3600
+DEFAULT_DURATION = 60           # minutes, for sessions without a duration
+PRODID = '-//Udacity//Conference Central//EN'
+LINE_OCTETS = 75
+PLACEHOLDER_SECRET = 'replace with a long random string'
+MIN_SECRET_LENGTH = 16
+
+
+class FeedSecretError(Exception):
+    """FeedSecretError -- no usable secret to sign feed URLs with"""
+
+
+def feedsEnabled():
+    """Return True if ICAL_FEED_SECRET can sign user feed URLs."""
+    return (ICAL_FEED_SECRET != PLACEHOLDER_SECRET and
+            len(ICAL_FEED_SECRET or '') >= MIN_SECRET_LENGTH)
+
+
+if not feedsEnabled():
+    logging.error('ICAL_FEED_SECRET in settings.py is unset or the '
+                  'placeholder: user calendar feeds are disabled')
+
+
+def _conferenceVersionKey(wsck):
+    return 'ICAL_VERSION|c|%s' % wsck
+
+
+def _userVersionKey(user_id):
+    return 'ICAL_VERSION|u|%s' % user_id
+
+
+def _versions(keys):
+    """Return {key: version}, creating missing versions from the clock."""
+    versions = memcache.get_multi(keys)
+    missing = [k for k in keys if k not in versions]
+    if missing:
+        now = int(time.time() * 1000)
+        memcache.add_multi(dict((k, now) for k in missing))
+        versions.update(memcache.get_multi(missing))
+        for k in missing:
+            versions.setdefault(k, now)
+    return versions
+
+
+def bumpConferenceVersion(conf_key):
+    """Invalidate feeds showing a conference; call after the write."""
+    memcache.incr(_conferenceVersionKey(conf_key.urlsafe()))
+
+
+def bumpUserVersion(user_id):
+    """Invalidate a user's schedule feed; call after the write."""
+    memcache.incr(_userVersionKey(user_id))
+
+
+# - - - rendering - - - - - - - - - - - - - - - - - - - - - -
+
+def _escape(text):
+    return (unicode(text or '').replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _fold(line):
+    """Fold a content line into LINE_OCTETS-octet UTF-8 pieces."""
+    data = line.encode('utf-8')
+    pieces = []
+    while len(data) > LINE_OCTETS:
+        cut = LINE_OCTETS if not pieces else LINE_OCTETS - 1
+        # never split a multi-byte character
+        while cut and (ord(data[cut]) & 0xC0) == 0x80:
+            cut -= 1
+        pieces.append(data[:cut])
+        data = data[cut:]
+    pieces.append(data)
+    return '\r\n '.join(pieces)
+
+
+def _conferenceEvent(conf, stamp):
+    if not conf.startDate:
+        return []
+    end = (conf.endDate or conf.startDate) + timedelta(days=1)
+    return [
+        'BEGIN:VEVENT',
+        'UID:%s@conference' % conf.key.urlsafe(),
+        'DTSTAMP:%s' % stamp,
+        'DTSTART;VALUE=DATE:%s' % conf.startDate.strftime('%Y%m%d'),
+        'DTEND;VALUE=DATE:%s' % end.strftime('%Y%m%d'),
+        'SUMMARY:%s' % _escape(conf.name),
+        'DESCRIPTION:%s' % _escape(conf.description),
+        'LOCATION:%s' % _escape(conf.city),
+        'END:VEVENT',
+    ]
+
+
+def _sessionEvent(sess, stamp):
+    if not sess.date:
+        return []
+    lines = [
+        'BEGIN:VEVENT',
+        'UID:%s@session' % sess.key.urlsafe(),
+        'DTSTAMP:%s' % stamp,
+    ]
+    if sess.startTime:
+        # floating local time: sessions carry no time zone
+        start = datetime.combine(sess.date, sess.startTime)
+        end = start + timedelta(minutes=sess.duration or DEFAULT_DURATION)
+        lines += ['DTSTART:%s' % start.strftime('%Y%m%dT%H%M%S'),
+                  'DTEND:%s' % end.strftime('%Y%m%dT%H%M%S')]
+    else:
+        lines += ['DTSTART;VALUE=DATE:%s' % sess.date.strftime('%Y%m%d')]
+    description = sess.highlists or ''
+    if sess.speaker:
+        description = 'Speaker: %s\n%s' % (sess.speaker, description)
+    lines += [
+        'SUMMARY:%s' % _escape(sess.name),
+        'DESCRIPTION:%s' % _escape(description),
+        'END:VEVENT',
+    ]
+    return lines
+
+
+def renderCalendar(name, conferences, sessions):
+    """Return an iCalendar (RFC 5545) document as a UTF-8 str."""
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:%s' % PRODID,
+             'CALSCALE:GREGORIAN', 'X-WR-CALNAME:%s' % _escape(name)]
+    for conf in conferences:
+        lines += _conferenceEvent(conf, stamp)
+    for sess in sessions:
+        lines += _sessionEvent(sess, stamp)
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(_fold(l) for l in lines) + '\r\n'
+
+
+def _feed(versions, body):
+    return {'versions': versions, 'body': body,
+            'etag': '"%s"' % hashlib.md5(body).hexdigest(),
+            'modified': int(time.time())}
+
+
+# - - - feeds - - - - - - - - - - - - - - - - - - - - - - - -
+
+def conferenceFeed(wsck):
+    """Return the cached feed dict (body, etag, modified) of a
+    conference's sessions, or None if there is no such conference.
+    """
+    try:
+        conf_key = ndb.Key(urlsafe=wsck)
+    except Exception:
+        return None
+    if conf_key.kind() != 'Conference':
+        return None
+    vkey = _conferenceVersionKey(wsck)
+    fkey = 'ICAL|c|%s' % wsck
+    cached = memcache.get_multi([vkey, fkey])
+    version = cached.get(vkey) or _versions([vkey])[vkey]
+    feed = cached.get(fkey)
+    if feed and feed['versions'] == {vkey: version}:
+        return feed
+
+    conf = getWithArchive(conf_key)
+    if not conf or conf.deleting:
+        return None
+    model = ArchivedSession if isArchived(conf.key) else Session
+    sessions = runQuery(model.query(ancestor=conf.key))
+    sessions.sort(key=lambda s: (s.date, s.startTime))
+    feed = _feed({vkey: version},
+                 renderCalendar(conf.name, [conf], sessions))
+    memcache.set(fkey, feed, FEED_CACHE_SECONDS)
+    return feed
+
+
+def userFeed(user_id):
+    """Return the cached feed dict of a user's schedule, or None if the
+    user has no profile.
+    """
+    uvkey = _userVersionKey(user_id)
+    fkey = 'ICAL|u|%s' % user_id
+    cached = memcache.get_multi([uvkey, fkey])
+    version = cached.get(uvkey) or _versions([uvkey])[uvkey]
+    feed = cached.get(fkey)
+    if feed and feed['versions'].get(uvkey) == version:
+        confs = [k for k in feed['versions'] if k != uvkey]
+        if not confs or _versions(confs) == dict(
+                (k, feed['versions'][k]) for k in confs):
+            return feed
+
+    prof = getEntity(ndb.Key(Profile, user_id))
+    if not prof:
+        return None
+    sess_keys = [ndb.Key(urlsafe=k) for k in prof.sessionKeysToAttend]
+    conf_wscks = set(prof.conferenceKeysToAttend)
+    conf_wscks.update(k.parent().urlsafe() for k in sess_keys)
+    # versions are read before the entities: a write racing with this
+    # render bumps a version afterwards, so the next poll re-renders
+    versions = _versions([_conferenceVersionKey(k) for k in conf_wscks])
+    versions[uvkey] = version
+
+    entities = getMultiWithArchive(
+        [ndb.Key(urlsafe=k) for k in prof.conferenceKeysToAttend] +
+        sess_keys)
+    confs = [e for e in entities[:len(prof.conferenceKeysToAttend)]
+             if e and not e.deleting]
+    sessions = [e for e in entities[len(prof.conferenceKeysToAttend):] if e]
+    sessions.sort(key=lambda s: (s.date, s.startTime))
+    feed = _feed(versions, renderCalendar(
+        'Schedule of %s' % (prof.displayName or user_id), confs, sessions))
+    memcache.set(fkey, feed, FEED_CACHE_SECONDS)
+    return feed
+
+
+# - - - feed URLs - - - - - - - - - - - - - - - - - - - - - -
+
+def feedSignature(user_id):
+    """Return the signature that makes a user's feed URL unguessable.
+
+    Raises FeedSecretError while ICAL_FEED_SECRET is not set.
+    """
+    if not feedsEnabled():
+        raise FeedSecretError('set ICAL_FEED_SECRET in settings.py to '
+                              'sign calendar feed URLs')
+    return hmac.new(ICAL_FEED_SECRET, user_id.encode('utf-8'),
+                    hashlib.sha256).hexdigest()[:32]
+
+
+def checkFeedSignature(user_id, signature):
+    if not feedsEnabled():
+        return False
+    return hmac.compare_digest(feedSignature(user_id), str(signature))
+
+
+def userFeedPath(user_id):
+    return '/ical/user/%s/%s.ics' % (urllib.quote(user_id.encode('utf-8'),
+                                                   safe=''),
+                                      feedSignature(user_id))
+
+
+def conferenceFeedPath(wsck):
+    return '/ical/conference/%s.ics' % wsck
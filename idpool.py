@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+"""
+idpool.py -- in-process pool of pre-allocated datastore IDs per (kind,
+    parent key), so creating a Conference or Session usually needs no
+    allocate_ids RPC
+
+A pool reserves a block of IDs with one allocate_ids call and hands them
+out under a lock. When a block runs low, the request taking the ID that
+crosses the low-water mark prefetches the next block with
+allocate_ids_async, so the RPC overlaps its own puts; it calls
+finishRefills() before returning, and the prefetched range becomes the
+block's spare. An ndb future belongs to the event loop of the request
+that made it, so no other request ever waits on it: a request finding
+the block empty while another request's prefetch is in flight allocates
+synchronously, restocking the block in the same RPC. A prefetch whose
+request ended without finishing it is given up after
+REFILL_STALE_SECONDS.
+
+Reserved IDs are never handed out by the datastore again, so IDs lost
+with a dropped prefetch, an evicted parent or an instance shutdown only
+leave gaps.
+
+"""
+
+import collections
+import threading
+import time
+
+from google.appengine.api import runtime
+from google.appengine.ext import ndb
+from google.appengine.ext.ndb import eventloop
+
+# IDs reserved per allocate_ids call, per kind
+BLOCK_SIZES = {
+    'Conference': 20,
+    'Session': 100,
+}
+DEFAULT_BLOCK_SIZE = 20
+REFILL_FRACTION = 0.25          # prefetch when this share of a block is left
+REFILL_STALE_SECONDS = 60       # a prefetch this old was abandoned
+MAX_PARENTS = 1000              # parent keys pooled per instance (LRU)
+
+_local = threading.local()
+
+
+class _Refill(object):
+    """_Refill -- an allocate_ids_async prefetch and the request (ndb
+    event loop) that owns it
+    """
+    __slots__ = ('owner', 'started', 'future')
+
+    def __init__(self):
+        self.owner = eventloop.get_event_loop()
+        self.started = time.time()
+        self.future = None
+
+    def mine(self):
+        return self.owner is eventloop.get_event_loop()
+
+    def stale(self):
+        return time.time() - self.started > REFILL_STALE_SECONDS
+
+
+class _Block(object):
+    """_Block -- unused IDs [next, last] of one (kind, parent), the
+    prefetched range to continue with & the prefetch in flight, if any
+    """
+    __slots__ = ('next', 'last', 'spare', 'refill')
+
+    def __init__(self):
+        self.next = 1
+        self.last = 0
+        self.spare = None
+        self.refill = None
+
+    def left(self):
+        return self.last - self.next + 1
+
+    def take(self, count):
+        """Return `count` IDs, moving on to the spare range when this one
+        runs out, or None if neither has enough.
+        """
+        if self.left() < count and self.spare:
+            self.next, self.last = self.spare
+            self.spare = None
+        if self.left() < count:
+            return None
+        ids = range(self.next, self.next + count)
+        self.next += count
+        return ids
+
+
+class IdPool(object):
+    """IdPool -- thread-safe per-parent pools of pre-allocated IDs"""
+
+    def __init__(self, max_parents=MAX_PARENTS):
+        self.max_parents = max_parents
+        self.lock = threading.Lock()
+        self.blocks = collections.OrderedDict()
+        self.closed = False
+
+    def _blockSize(self, model):
+        return BLOCK_SIZES.get(model._get_kind(), DEFAULT_BLOCK_SIZE)
+
+    def _block(self, key):
+        """Return the block of `key` as most recently used; caller locks."""
+        block = self.blocks.pop(key, None) or _Block()
+        self.blocks[key] = block
+        while len(self.blocks) > self.max_parents:
+            self.blocks.popitem(last=False)
+        return block
+
+    def _claimRefill(self, block, size):
+        """Return a new _Refill if `block` ran low and none is in flight;
+        caller locks.
+        """
+        refill = block.refill
+        if refill is not None and not refill.mine() and refill.stale():
+            # its request ended before the prefetch landed
+            block.refill = refill = None
+        if (refill is not None or block.spare is not None or
+                block.left() > size * REFILL_FRACTION):
+            return None
+        block.refill = _Refill()
+        return block.refill
+
+    def _prefetch(self, model, parent, key, refill, size):
+        # started outside the lock: a future that is already done runs
+        # its callback right away
+        refill.future = model.allocate_ids_async(size=size, parent=parent)
+        refill.future.add_immediate_callback(self._install, key, refill)
+        if not hasattr(_local, 'refills'):
+            _local.refills = []
+        _local.refills.append(refill)
+
+    def _install(self, key, refill):
+        """Make a finished prefetch the spare range of its block."""
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is None or block.refill is not refill:
+                return
+            block.refill = None
+            if refill.future.get_exception() is None:
+                block.spare = refill.future.get_result()
+
+    def allocateIds(self, model, parent, count=1):
+        """Return `count` fresh IDs for `model` under `parent`; one
+        allocate_ids RPC at most, none when the pool has enough.
+        """
+        size = self._blockSize(model)
+        key = (model._get_kind(), parent)
+        refill = None
+        with self.lock:
+            block = None if self.closed else self._block(key)
+            ids = block.take(count) if block else None
+            if ids is not None:
+                refill = self._claimRefill(block, size)
+            elif block:
+                refill = block.refill
+        if ids is not None:
+            if refill is not None:
+                self._prefetch(model, parent, key, refill, size)
+            return ids
+
+        if block is None:
+            first, last = model.allocate_ids(size=count, parent=parent)
+            return range(first, last + 1)
+        if refill is not None and refill.mine() and refill.future:
+            # this request's own prefetch is in flight: wait for it
+            refill.future.wait()
+            with self.lock:
+                ids = None if self.closed else self._block(key).take(count)
+            if ids is not None:
+                return ids
+        # one RPC covers this call and restocks the pool; a prefetch of
+        # another request still becomes the spare when it lands
+        first, last = model.allocate_ids(size=count + size, parent=parent)
+        with self.lock:
+            if not self.closed:
+                block = self._block(key)
+                block.next, block.last = first + count, last
+        return range(first, first + count)
+
+    def close(self):
+        """Stop pooling; later calls allocate synchronously."""
+        with self.lock:
+            self.closed = True
+            self.blocks.clear()
+
+
+_pool = IdPool()
+
+
+def allocateId(model, parent):
+    """Return one fresh ID for `model` under `parent`."""
+    return _pool.allocateIds(model, parent)[0]
+
+
+def allocateIds(model, parent, count):
+    """Return `count` fresh IDs, e.g. for bulk creators & imports."""
+    return _pool.allocateIds(model, parent, count)
+
+
+def finishRefills():
+    """Wait for the prefetches this request started, once its own puts
+    are under way; call before the request returns.
+    """
+    refills, _local.refills = getattr(_local, 'refills', []), []
+    loop = eventloop.get_event_loop()
+    # refills left by an earlier request on this thread cannot complete
+    ndb.Future.wait_all([r.future for r in refills if r.owner is loop])
+
+
+def _onShutdown():
+    _pool.close()
+
+runtime.set_shutdown_hook(_onShutdown)
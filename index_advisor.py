@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+
+"""
+index_advisor.py -- derive a minimal index.yaml from query shapes
+
+Shapes come from the slow-query log (a JSON dump of /admin/queries) and/or
+from enumerating every filter combination ConferenceApi._formatFilters
+accepts. For each shape the advisor works out which composite index the
+datastore needs; unless --exact is given, equality filters are served by
+merge-joining one (property, sort...) index per filtered property instead
+of one composite per combination. The estimated index rows written per
+entity are reported for the current index.yaml, for one exact composite
+per shape, and for the proposed set.
+
+    python index_advisor.py --enumerate --shapes queries.json \\
+        --values topics=3 --output index.proposed.yaml
+
+"""
+
+import argparse
+import itertools
+import json
+import re
+import sys
+
+from benchmarks import ROOT
+from benchmarks import setupSdk
+
+setupSdk()
+
+import yaml
+
+from conference import FIELDS
+from models import ArchivedConference
+from models import ArchivedSession
+from models import Conference
+from models import Profile
+from models import Session
+
+MODELS = dict((m._get_kind(), m) for m in (
+    Conference, Profile, Session, ArchivedConference, ArchivedSession))
+
+# number of ancestor path elements (including the entity itself) per kind
+ANCESTOR_DEPTH = {'Profile': 1, 'Conference': 2, 'Session': 3,
+                  'ArchivedConference': 2, 'ArchivedSession': 3}
+
+# average values per repeated property when not given on the command line
+DEFAULT_REPEATED_VALUES = 2
+
+INEQUALITIES = ('<', '<=', '>', '>=', '!=')
+
+_FILTER_RE = re.compile(r'(\w+) (<=|>=|!=|=|<|>)')
+
+
+class Shape(object):
+    """Shape -- one datastore query shape, as the index planner sees it"""
+
+    def __init__(self, kind, equalities=(), inequality=None, orders=(),
+                 ancestor=False, projection=()):
+        self.kind = kind
+        self.equalities = tuple(sorted(set(equalities)))
+        self.inequality = inequality
+        orders = list(orders)
+        # the datastore requires the inequality property to sort first
+        if inequality and (not orders or orders[0][0] != inequality):
+            orders.insert(0, (inequality, 'asc'))
+        self.orders = tuple(orders)
+        self.ancestor = ancestor
+        self.projection = tuple(projection)
+
+    def key(self):
+        return (self.kind, self.equalities, self.inequality, self.orders,
+                self.ancestor, self.projection)
+
+
+# - - - shape sources - - - - - - - - - - - - - - - - - - - -
+
+def enumerateFormatFilterShapes():
+    """Yield every shape _getQuery/_formatFilters can build.
+
+    Any subset of FIELDS may be equality-filtered; at most one field may
+    carry inequalities (including '!='); results sort on that field, then
+    on name. The same shapes run on the archive with includeArchived.
+    """
+    props = sorted(FIELDS.values())
+    for kind in ('Conference', 'ArchivedConference'):
+        for ineq in [None] + props:
+            others = [p for p in props if p != ineq]
+            for n in range(len(others) + 1):
+                for eq in itertools.combinations(others, n):
+                    yield Shape(kind, eq, ineq, [('name', 'asc')])
+
+
+def parseShape(text):
+    """Return the Shapes for one querylog shape string.
+
+    OR filters run as one datastore query per branch, so each branch
+    becomes its own shape.
+    """
+    kind = text.split(' ', 1)[0]
+    ancestor = ' ancestor=' in text
+    orders = []
+    m = re.search(r'orders=\[([^\]]*)\]', text)
+    if m:
+        for part in m.group(1).split(', '):
+            prop, direction = part.rsplit(' ', 1)
+            orders.append((prop, direction))
+    projection = []
+    m = re.search(r'projection=\[([^\]]*)\]', text)
+    if m:
+        projection = m.group(1).split(', ')
+
+    m = re.search(r'filters=\[(.*?)\](?= orders=| projection=|$)', text)
+    filters = m.group(1) if m else ''
+    branches = ['']
+    m = re.search(r'OR\((.*)\)', filters)
+    if m:
+        branches = m.group(1).split(' | ')
+        filters = filters[:m.start()] + filters[m.end():]
+
+    shapes = []
+    for branch in branches:
+        eq, ineq = [], None
+        for prop, op in _FILTER_RE.findall(filters + ' ' + branch):
+            if op in INEQUALITIES:
+                ineq = prop
+            else:
+                eq.append(prop)
+        shapes.append(Shape(kind, eq, ineq, orders, ancestor, projection))
+    return shapes
+
+
+def loadRecordedShapes(path):
+    """Read Shapes from a JSON dump of /admin/queries (or a list of
+    shape strings).
+    """
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = [s['shape'] for s in data.get('shapes', [])]
+    shapes = []
+    for text in data:
+        shapes.extend(parseShape(text))
+    return shapes
+
+
+# - - - index planning - - - - - - - - - - - - - - - - - - -
+
+def requiredIndexes(shape, zigzag=True):
+    """Return the composite indexes (kind, ancestor, props) a shape needs.
+
+    Equality-only queries (with or without ancestor) and single-property
+    sorts or inequalities are served by built-in indexes.
+    """
+    suffix = list(shape.orders)
+    sorted_props = set(p for p, _ in suffix) | set(shape.equalities)
+    suffix += [(p, 'asc') for p in shape.projection if p not in sorted_props]
+    eq = [(p, 'asc') for p in shape.equalities]
+
+    if not suffix:
+        return []
+    if not eq and not shape.ancestor and len(suffix) == 1:
+        return []
+    if zigzag and len(eq) > 1:
+        return [(shape.kind, shape.ancestor, tuple([e] + suffix))
+                for e in eq]
+    return [(shape.kind, shape.ancestor, tuple(eq + suffix))]
+
+
+def minimalIndexes(shapes, zigzag=True):
+    """Return the de-duplicated, sorted index set covering all shapes."""
+    indexes = set()
+    seen = set()
+    for shape in shapes:
+        if shape.key() in seen:
+            continue
+        seen.add(shape.key())
+        indexes.update(requiredIndexes(shape, zigzag))
+    return sorted(indexes)
+
+
+def uncoveredShapes(shapes, indexes):
+    """Return the shapes an index set serves neither exactly nor by zigzag."""
+    available = set(indexes)
+    missing = []
+    for shape in dict((s.key(), s) for s in shapes).itervalues():
+        if not (available.issuperset(requiredIndexes(shape, False)) or
+                available.issuperset(requiredIndexes(shape, True))):
+            missing.append(shape)
+    return missing
+
+
+def loadIndexYaml(path):
+    """Return the composite indexes declared in an index.yaml."""
+    with open(path) as f:
+        data = yaml.safe_load(f) or {}
+    indexes = []
+    for index in data.get('indexes') or []:
+        props = tuple((p['name'], p.get('direction', 'asc'))
+                      for p in index.get('properties', []))
+        ancestor = index.get('ancestor') in (True, 'yes')
+        indexes.append((index['kind'], ancestor, props))
+    return indexes
+
+
+def formatIndexYaml(indexes, report=None):
+    """Render indexes in index.yaml layout, keeping the AUTOGENERATED
+    marker last so dev_appserver still appends new shapes below it.
+    """
+    lines = []
+    if report:
+        lines.append('# Generated by index_advisor.py')
+        for line in formatReport(report).splitlines():
+            lines.append('# ' + line if line else '#')
+        lines.append('')
+    lines.append('indexes:')
+    lines.append('')
+    for kind, ancestor, props in indexes:
+        lines.append('- kind: %s' % kind)
+        if ancestor:
+            lines.append('  ancestor: yes')
+        lines.append('  properties:')
+        for prop, direction in props:
+            lines.append('  - name: %s' % prop)
+            if direction != 'asc':
+                lines.append('    direction: %s' % direction)
+        lines.append('')
+    lines.append('# AUTOGENERATED')
+    lines.append('')
+    return '\n'.join(lines)
+
+
+# - - - write amplification - - - - - - - - - - - - - - - - -
+
+def valueCounts(kind, overrides):
+    """Return {property: average values per entity} for indexed props."""
+    model = MODELS.get(kind)
+    counts = {}
+    if model is None:
+        return counts
+    for prop in model._properties.itervalues():
+        if not prop._indexed:
+            continue
+        n = DEFAULT_REPEATED_VALUES if prop._repeated else 1
+        counts[prop._name] = overrides.get(prop._name, n)
+    return counts
+
+
+def indexRows(index, counts):
+    """Return the index rows one entity writes into a composite index."""
+    kind, ancestor, props = index
+    rows = 1
+    for prop, _ in props:
+        rows *= counts.get(prop, 1)
+    if ancestor:
+        rows *= ANCESTOR_DEPTH.get(kind, 1)
+    return rows
+
+
+def amplification(indexes, overrides):
+    """Return {kind: {builtinRows, compositeRows, composites, total}}."""
+    kinds = set(MODELS) | set(i[0] for i in indexes)
+    result = {}
+    for kind in sorted(kinds):
+        counts = valueCounts(kind, overrides)
+        # one ascending & one descending row per value, plus the kind row
+        builtin = 2 * sum(counts.itervalues()) + 1
+        mine = [i for i in indexes if i[0] == kind]
+        composite = sum(indexRows(i, counts) for i in mine)
+        result[kind] = {
+            'composites': len(mine),
+            'builtinRows': builtin,
+            'compositeRows': composite,
+            'totalRows': builtin + composite,
+        }
+    return result
+
+
+def formatReport(report):
+    columns = ('before', 'exact', 'after')
+    lines = ['Estimated index rows written per new entity '
+             '(composite indexes / total rows):',
+             '%-12s' % 'kind' + ''.join('%18s' % c for c in columns)]
+    for kind in sorted(report['before']):
+        lines.append('%-12s' % kind + ''.join(
+            '%9d / %6g' % (report[c][kind]['composites'],
+                           report[c][kind]['totalRows'])
+            for c in columns))
+    lines.append('')
+    lines.append('Shapes analyzed: %d (%s)' % (
+        report['shapes'], ', '.join(report['sources'])))
+    lines.append('Shapes the current index.yaml cannot serve: %d' %
+                 report['uncoveredBefore'])
+    if report['zigzag']:
+        lines.append('Multi-equality shapes rely on zigzag merge join over '
+                     'per-property indexes;')
+        lines.append('check latency of highly unselective combinations '
+                     'with the slow-query log.')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--enumerate', action='store_true',
+                        help='include every shape _formatFilters can build')
+    parser.add_argument('--shapes', action='append', default=[],
+                        help='JSON dump of /admin/queries (repeatable)')
+    parser.add_argument('--index-yaml', default=ROOT + '/index.yaml')
+    parser.add_argument('--exact', action='store_true',
+                        help='one composite per shape (no zigzag merge)')
+    parser.add_argument('--values', action='append', default=[],
+                        metavar='PROP=N',
+                        help='average values of a repeated property')
+    parser.add_argument('--json', action='store_true',
+                        help='print the report as JSON instead of YAML')
+    parser.add_argument('--output', help='write here instead of stdout')
+    args = parser.parse_args()
+
+    overrides = {}
+    for spec in args.values:
+        prop, n = spec.split('=', 1)
+        overrides[prop] = float(n)
+
+    shapes = []
+    sources = []
+    if args.enumerate or not args.shapes:
+        shapes.extend(enumerateFormatFilterShapes())
+        sources.append('_formatFilters')
+    for path in args.shapes:
+        shapes.extend(loadRecordedShapes(path))
+        sources.append(path)
+
+    before = loadIndexYaml(args.index_yaml)
+    # keep current indexes of kinds no analyzed shape covers
+    covered = set(s.kind for s in shapes)
+    untouched = [i for i in before if i[0] not in covered]
+    exact = minimalIndexes(shapes, zigzag=False) + untouched
+    after = minimalIndexes(shapes, zigzag=not args.exact) + untouched
+
+    report = {
+        'shapes': len(set(s.key() for s in shapes)),
+        'sources': sources,
+        'zigzag': not args.exact,
+        'uncoveredBefore': len(uncoveredShapes(shapes, before)),
+        'before': amplification(before, overrides),
+        'exact': amplification(exact, overrides),
+        'after': amplification(after, overrides),
+    }
+    if args.json:
+        report['indexes'] = [{'kind': k, 'ancestor': a,
+                              'properties': [list(p) for p in props]}
+                             for k, a, props in after]
+        text = json.dumps(report, indent=2, sort_keys=True) + '\n'
+    else:
+        text = formatIndexYaml(after, report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+        sys.stderr.write(formatReport(report) + '\n')
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+
+"""
+instrumentation.py -- lightweight per-endpoint instrumentation for the
+    Conference API: wall time, datastore RPCs by call type, memcache
+    hits/misses and response item counts, aggregated in-process, plus
+    transaction attempts & collisions per call site and per entity group
+
+"""
+
+import bisect
+import functools
+import logging
+import random
+import threading
+import time
+
+import webapp2
+from google.appengine.api import apiproxy_stub_map
+
+# fraction of calls whose individual record is written to the log
+LOG_SAMPLE_RATE = 0.01
+
+# upper bounds (ms) of the latency histogram buckets; last bucket is open
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+                      10000, 30000)
+
+# entity groups tracked for collisions; when full, the half with the
+# fewest collisions is dropped
+MAX_TRACKED_GROUPS = 1000
+
+_HOOK_KEY = 'conference_instrumentation'
+
+_local = threading.local()
+_lock = threading.Lock()
+_stats = {}
+_transactions = {}
+_groups = {}
+_hooked_proxy = None
+
+
+class CallRecord(object):
+    """CallRecord -- counters for a single in-flight call"""
+    __slots__ = ('name', 'start', 'rpcs', 'memcacheHits', 'memcacheMisses',
+                 'items', 'txAttempts', 'txCollisions', 'parent')
+
+    def __init__(self, name, parent):
+        self.name = name
+        self.start = time.time()
+        self.rpcs = {}
+        self.memcacheHits = 0
+        self.memcacheMisses = 0
+        self.items = 0
+        self.txAttempts = 0
+        self.txCollisions = 0
+        self.parent = parent
+
+
+class EndpointStats(object):
+    """EndpointStats -- aggregated counters & latency histogram per name"""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.totalMs = 0.0
+        self.maxMs = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.rpcs = {}
+        self.memcacheHits = 0
+        self.memcacheMisses = 0
+        self.items = 0
+        self.txAttempts = 0
+        self.txCollisions = 0
+
+    def add(self, record, elapsed_ms, failed):
+        """Fold one finished CallRecord into the aggregate."""
+        self.count += 1
+        if failed:
+            self.errors += 1
+        self.totalMs += elapsed_ms
+        if elapsed_ms > self.maxMs:
+            self.maxMs = elapsed_ms
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        for call, n in record.rpcs.iteritems():
+            self.rpcs[call] = self.rpcs.get(call, 0) + n
+        self.memcacheHits += record.memcacheHits
+        self.memcacheMisses += record.memcacheMisses
+        self.items += record.items
+        self.txAttempts += record.txAttempts
+        self.txCollisions += record.txCollisions
+
+    def percentile(self, pct):
+        """Return the bucket upper bound (ms) holding the pct-th percentile."""
+        if not self.count:
+            return 0
+        rank = self.count * pct / 100.0
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                if i < len(LATENCY_BUCKETS_MS):
+                    return LATENCY_BUCKETS_MS[i]
+                break
+        return self.maxMs
+
+    def toDict(self):
+        """Return a JSON-friendly summary of the aggregate."""
+        count = self.count or 1
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'meanMs': round(self.totalMs / count, 3),
+            'maxMs': round(self.maxMs, 3),
+            'p50Ms': self.percentile(50),
+            'p95Ms': self.percentile(95),
+            'p99Ms': self.percentile(99),
+            'histogram': dict(zip(
+                [str(b) for b in LATENCY_BUCKETS_MS] + ['inf'], self.buckets)),
+            'datastoreRpcs': dict(self.rpcs),
+            'datastoreRpcsPerCall': round(
+                sum(self.rpcs.itervalues()) / float(count), 3),
+            'memcacheHits': self.memcacheHits,
+            'memcacheMisses': self.memcacheMisses,
+            'itemsPerCall': round(self.items / float(count), 3),
+            'transactionAttempts': self.txAttempts,
+            'transactionCollisions': self.txCollisions,
+        }
+
+
+class TransactionStats(object):
+    """TransactionStats -- attempts, collisions & retry latency of one
+    transactional call site
+    """
+
+    def __init__(self, site):
+        self.site = site
+        self.count = 0
+        self.failures = 0
+        self.attempts = 0
+        self.collisions = 0
+        self.maxAttempts = 0
+        self.totalMs = 0.0
+        self.backoffMs = 0.0
+
+    def add(self, attempts, collisions, elapsed_ms, backoff_ms, failed):
+        self.count += 1
+        if failed:
+            self.failures += 1
+        self.attempts += attempts
+        self.collisions += collisions
+        self.maxAttempts = max(self.maxAttempts, attempts)
+        self.totalMs += elapsed_ms
+        self.backoffMs += backoff_ms
+
+    def toDict(self):
+        count = self.count or 1
+        return {
+            'count': self.count,
+            'failures': self.failures,
+            'attempts': self.attempts,
+            'collisions': self.collisions,
+            'collisionRate': round(
+                self.collisions / float(self.attempts or 1), 3),
+            'maxAttempts': self.maxAttempts,
+            'meanMs': round(self.totalMs / count, 3),
+            'meanBackoffMs': round(self.backoffMs / count, 3),
+        }
+
+
+# - - - API proxy hooks - - - - - - - - - - - - - - - - - - -
+
+def _datastoreHook(service, call, request, response):
+    """Pre-call hook: count datastore RPCs by call type."""
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        record.rpcs[call] = record.rpcs.get(call, 0) + 1
+
+
+def _memcacheHook(service, call, request, response):
+    """Post-call hook: count memcache hits & misses of Get calls."""
+    record = getattr(_local, 'record', None)
+    if record is None or call != 'Get':
+        return
+    hits = response.item_size()
+    record.memcacheHits += hits
+    record.memcacheMisses += request.key_size() - hits
+
+
+def _installHooks():
+    """Register the RPC hooks on the current API proxy (once per proxy).
+
+    The proxy is re-checked on every call because testbed replaces it.
+    """
+    global _hooked_proxy
+    proxy = apiproxy_stub_map.apiproxy
+    if proxy is _hooked_proxy:
+        return
+    with _lock:
+        if proxy is not _hooked_proxy:
+            proxy.GetPreCallHooks().Append(
+                _HOOK_KEY, _datastoreHook, 'datastore_v3')
+            proxy.GetPostCallHooks().Append(
+                _HOOK_KEY, _memcacheHook, 'memcache')
+            _hooked_proxy = proxy
+
+
+# - - - recording - - - - - - - - - - - - - - - - - - - - - -
+
+def _begin(name):
+    _installHooks()
+    record = CallRecord(name, getattr(_local, 'record', None))
+    _local.record = record
+    return record
+
+
+def _end(record, failed):
+    elapsed_ms = (time.time() - record.start) * 1000.0
+    _local.record = record.parent
+    with _lock:
+        stats = _stats.get(record.name)
+        if stats is None:
+            stats = _stats[record.name] = EndpointStats(record.name)
+        stats.add(record, elapsed_ms, failed)
+    if random.random() < LOG_SAMPLE_RATE:
+        logging.info('instrumentation %s: %.1fms rpcs=%s memcache=%d/%d '
+                     'items=%d%s', record.name, elapsed_ms, record.rpcs,
+                     record.memcacheHits, record.memcacheMisses,
+                     record.items, ' FAILED' if failed else '')
+
+
+def _itemCount(result):
+    """Return the number of items in a response message."""
+    items = getattr(result, 'items', None)
+    if items is None:
+        return 1 if result is not None else 0
+    return len(items)
+
+
+def instrumented(func):
+    """Decorator recording latency & RPC counters for an API method.
+
+    Apply below @endpoints.method so the original signature is kept.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        record = _begin(name)
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            record.items = _itemCount(result)
+            failed = False
+            return result
+        finally:
+            _end(record, failed)
+    return wrapper
+
+
+class InstrumentationMiddleware(object):
+    """InstrumentationMiddleware -- WSGI wrapper recording each request
+    of a webapp2 application under the handler class of its route, so
+    paths holding keys or user IDs share one entry.
+    """
+
+    UNMATCHED = '(unmatched)'   # requests no route matches
+
+    def __init__(self, app):
+        self.app = app
+
+    def _routeName(self, environ):
+        try:
+            route = self.app.router.match(webapp2.Request(environ))[0]
+        except webapp2.exc.HTTPException:
+            return self.UNMATCHED
+        return getattr(route.handler, '__name__', str(route.handler))
+
+    def __call__(self, environ, start_response):
+        record = _begin(self._routeName(environ))
+        status = []
+
+        def _startResponse(s, headers, exc_info=None):
+            status.append(s)
+            return start_response(s, headers, exc_info)
+
+        failed = True
+        try:
+            result = self.app(environ, _startResponse)
+            failed = not status or status[0][:1] == '5'
+            return result
+        finally:
+            _end(record, failed)
+
+
+def recordTransaction(site, attempts, elapsed_ms, backoff_ms, failed):
+    """Fold one transactional call into its site's stats & the current
+    call record.
+
+    `attempts` lists (entity groups touched, collided) per attempt, the
+    groups as key paths like 'Conference/42'.
+    """
+    collisions = sum(1 for _, collided in attempts if collided)
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        record.txAttempts += len(attempts)
+        record.txCollisions += collisions
+    with _lock:
+        stats = _transactions.get(site)
+        if stats is None:
+            stats = _transactions[site] = TransactionStats(site)
+        stats.add(len(attempts), collisions, elapsed_ms, backoff_ms, failed)
+        for groups, collided in attempts:
+            for group in groups:
+                counts = _groups.get(group)
+                if counts is None:
+                    if len(_groups) >= MAX_TRACKED_GROUPS:
+                        _pruneGroups()
+                    counts = _groups[group] = [0, 0]
+                counts[0] += 1
+                counts[1] += collided
+    if collisions:
+        logging.info('transaction %s: %d collisions in %d attempts%s',
+                     site, collisions, len(attempts),
+                     ' FAILED' if failed else '')
+
+
+def _pruneGroups():
+    """Drop the half of the tracked groups with the fewest collisions;
+    caller locks."""
+    ranked = sorted(_groups, key=lambda g: _groups[g][1])
+    for group in ranked[:len(ranked) // 2]:
+        del _groups[group]
+
+
+def getTransactionStats(top=20):
+    """Return per-site transaction stats & the `top` entity groups by
+    collisions.
+    """
+    with _lock:
+        sites = dict((site, stats.toDict())
+                     for site, stats in _transactions.iteritems())
+        hot = sorted(_groups.iteritems(), key=lambda (g, c): -c[1])[:top]
+    return {
+        'sites': sites,
+        'hotGroups': [{'group': g, 'attempts': c[0], 'collisions': c[1]}
+                      for g, c in hot],
+    }
+
+
+def getStats():
+    """Return a snapshot of all aggregated stats, keyed by name."""
+    with _lock:
+        return dict((name, stats.toDict())
+                    for name, stats in _stats.iteritems())
+
+
+def resetStats():
+    """Drop all aggregated stats."""
+    with _lock:
+        _stats.clear()
+        _transactions.clear()
+        _groups.clear()
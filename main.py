@@ -12,10 +12,86 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
+import logging
+import urllib
+from email.utils import formatdate
+from email.utils import mktime_tz
+from email.utils import parsedate_tz
+
 import webapp2
 from google.appengine.api import app_identity
-from google.appengine.api import mail
+from google.appengine.api import taskqueue
+from archive import archiveBatch
+from caching import getCacheStats
+from catalog import CATALOG_TASK_URL
+from catalog import buildCatalog
+from catalog import queueCatalogBuild
+from caching import resetCacheStats
 from conference import ConferenceApi
+from deletion import queueDeleteStep
+from deletion import runDeleteStep
+from exports import EXPORT_TASK_URL
+from exports import runExportStep
+from facets import applyFacetDeltas
+from facets import purgeFacetMarkers
+from facets import rebuildFacetCounts
+from holds import reclaimExpiredHolds
+from ical import checkFeedSignature
+from ical import conferenceFeed
+from ical import userFeed
+from instrumentation import InstrumentationMiddleware
+from instrumentation import getStats
+from instrumentation import getTransactionStats
+from instrumentation import resetStats
+from notifications import sendPendingNotifications
+from querylog import getQueryStats
+from querylog import logSummary
+from similarity import queueSimilarUpdate
+from similarity import rebuildSimilarConferences
+from similarity import updateSimilarConferences
+from speakers import SPEAKER_BACKFILL_MODELS
+from speakers import indexSpeakers
+from speakers import queueSpeakerBackfill
+from speakers import speakerBackfillStep
+from textsearch import BACKFILL_MODELS
+from textsearch import backfillStep
+from textsearch import queueBackfill
+from textsearch import reindex
+from warmup import warmInstance
+
+class TaskHandler(webapp2.RequestHandler):
+    """Base of push queue task handlers: app.yaml limits their URLs to
+    admins, and only requests carrying the header App Engine sets on
+    queued tasks (which clients cannot forge) are served."""
+
+    def dispatch(self):
+        if 'X-AppEngine-QueueName' not in self.request.headers:
+            logging.warning('rejected %s: not a queued task',
+                            self.request.path)
+            self.abort(403)
+        super(TaskHandler, self).dispatch()
+
+
+class CronHandler(webapp2.RequestHandler):
+    """Base of cron handlers doing work themselves: app.yaml limits their
+    URLs to admins, and only requests carrying the header App Engine sets
+    on cron requests (which clients cannot forge) are served."""
+
+    def dispatch(self):
+        if 'X-Appengine-Cron' not in self.request.headers:
+            logging.warning('rejected %s: not a cron request',
+                            self.request.path)
+            self.abort(403)
+        super(CronHandler, self).dispatch()
+
+
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Import & prime this instance before it takes traffic."""
+        warmInstance()
+        self.response.set_status(200)
+
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
@@ -26,7 +102,12 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
+        """Send email confirming Conference creation.
+
+        Legacy push-task path, kept to drain tasks queued before
+        notifications moved to the pull queue.
+        """
+        from google.appengine.api import mail
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
@@ -38,6 +119,226 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
         )
 
 
+class SendNotificationsHandler(CronHandler):
+    def get(self):
+        """Lease queued notifications & send them as per-recipient digests."""
+        done, mails = sendPendingNotifications()
+        if done:
+            logging.info('sent %d notification mails for %d tasks',
+                         mails, done)
+        self.response.set_status(204)
+
+
+class ArchiveConferencesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start the chained archival of past conferences."""
+        taskqueue.add(url='/tasks/archive_conferences')
+        self.response.set_status(204)
+
+
+class ArchiveBatchHandler(TaskHandler):
+    def post(self):
+        """Archive one batch of past conferences; chain the next batch."""
+        cursor = archiveBatch(self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(url='/tasks/archive_conferences',
+                          params={'cursor': cursor})
+        self.response.set_status(204)
+
+
+class CatalogCronHandler(webapp2.RequestHandler):
+    def get(self):
+        """Queue a rebuild of the published conference catalog."""
+        queueCatalogBuild()
+        self.response.set_status(204)
+
+
+class CatalogHandler(TaskHandler):
+    def post(self):
+        """Load the conference catalog & publish it to all instances."""
+        buildCatalog()
+        self.response.set_status(204)
+
+
+class ReclaimHoldsCronHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start the chained reclaim of expired seat holds."""
+        taskqueue.add(url='/tasks/reclaim_holds')
+        self.response.set_status(204)
+
+
+class ReclaimHoldsHandler(TaskHandler):
+    def post(self):
+        """Reclaim one batch of expired seat holds; chain the next."""
+        if reclaimExpiredHolds():
+            taskqueue.add(url='/tasks/reclaim_holds')
+        self.response.set_status(204)
+
+
+class ExportStepHandler(TaskHandler):
+    def post(self):
+        """Write the next pages of an export job; chain if unfinished."""
+        job_id = self.request.get('job')
+        if runExportStep(job_id):
+            taskqueue.add(url=EXPORT_TASK_URL, params={'job': job_id})
+        self.response.set_status(204)
+
+
+class DeleteConferenceHandler(TaskHandler):
+    def post(self):
+        """Run the next batches of a conference deletion; chain if unfinished."""
+        conf_wsck = self.request.get('conf')
+        step = runDeleteStep(conf_wsck,
+                             self.request.get('phase') or 'sessions',
+                             self.request.get('cursor') or None)
+        if step:
+            queueDeleteStep(conf_wsck, *step)
+        self.response.set_status(204)
+
+
+class FacetDeltasHandler(TaskHandler):
+    def post(self):
+        """Apply queued facet count deltas to the sharded counters."""
+        applyFacetDeltas(self.request.get('deltas'),
+                         self.request.headers.get('X-AppEngine-TaskName'))
+        self.response.set_status(204)
+
+
+class PurgeFacetMarkersCronHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start the chained purge of old facet task markers."""
+        taskqueue.add(url='/tasks/purge_facet_markers')
+        self.response.set_status(204)
+
+
+class PurgeFacetMarkersHandler(TaskHandler):
+    def post(self):
+        """Delete one batch of old facet task markers; chain the next."""
+        if purgeFacetMarkers():
+            taskqueue.add(url='/tasks/purge_facet_markers')
+        self.response.set_status(204)
+
+
+class RebuildFacetsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Recount facet counters from the live conferences."""
+        values = rebuildFacetCounts()
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(json.dumps({'values': values}))
+
+
+class SimilarConferencesCronHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start the nightly rebuild of similar-conference lists."""
+        queueSimilarUpdate()
+        self.response.set_status(204)
+
+
+class SimilarConferencesHandler(TaskHandler):
+    def post(self):
+        """Recompute one conference's similar list, or all of them."""
+        conf_wsck = self.request.get('conf')
+        if conf_wsck:
+            updateSimilarConferences(conf_wsck)
+        else:
+            rebuildSimilarConferences()
+        self.response.set_status(204)
+
+
+class SearchIndexHandler(TaskHandler):
+    def post(self):
+        """Re-index changed conferences & sessions in the search index."""
+        reindex(filter(None, self.request.get('keys').split(',')))
+        self.response.set_status(204)
+
+
+class SearchBackfillHandler(TaskHandler):
+    def post(self):
+        """Index one page of a kind into the search index; chain the next."""
+        kind = self.request.get('kind')
+        cursor = backfillStep(kind, self.request.get('cursor') or None)
+        if cursor:
+            queueBackfill(kind, cursor)
+        self.response.set_status(204)
+
+
+class RebuildSearchHandler(webapp2.RequestHandler):
+    def post(self):
+        """Index every conference & session, e.g. after a backend switch."""
+        for kind in sorted(BACKFILL_MODELS):
+            queueBackfill(kind)
+        self.response.set_status(204)
+
+
+class SpeakerIndexHandler(TaskHandler):
+    def post(self):
+        """Add new speakers to the autocomplete prefix index."""
+        indexSpeakers(self.request.get('speakers').split(','))
+        self.response.set_status(204)
+
+
+class SpeakerBackfillHandler(TaskHandler):
+    def post(self):
+        """Link one page of sessions to speakers; chain the next."""
+        kind = self.request.get('kind')
+        cursor = speakerBackfillStep(kind, self.request.get('cursor') or None)
+        if cursor:
+            queueSpeakerBackfill(kind, cursor)
+        self.response.set_status(204)
+
+
+class BackfillSpeakersHandler(webapp2.RequestHandler):
+    def post(self):
+        """Link every live & archived session to its speaker."""
+        for kind in sorted(SPEAKER_BACKFILL_MODELS):
+            queueSpeakerBackfill(kind)
+        self.response.set_status(204)
+
+
+class CalendarFeedHandler(webapp2.RequestHandler):
+    """Serves a cached iCalendar feed with ETag/Last-Modified, answering
+    conditional polls with 304."""
+    cache_control = 'private, max-age=300'
+
+    def serveFeed(self, feed):
+        if feed is None:
+            self.abort(404)
+        self.response.headers['ETag'] = feed['etag']
+        self.response.headers['Last-Modified'] = formatdate(
+            feed['modified'], usegmt=True)
+        self.response.headers['Cache-Control'] = self.cache_control
+        if self._notModified(feed):
+            self.response.set_status(304)
+            return
+        self.response.headers['Content-Type'] = 'text/calendar; charset=utf-8'
+        self.response.out.write(feed['body'])
+
+    def _notModified(self, feed):
+        etags = self.request.headers.get('If-None-Match')
+        if etags:
+            return etags.strip() == '*' or feed['etag'] in [
+                e.strip() for e in etags.split(',')]
+        since = parsedate_tz(self.request.headers.get('If-Modified-Since', ''))
+        return bool(since) and feed['modified'] <= mktime_tz(since)
+
+
+class ConferenceFeedHandler(CalendarFeedHandler):
+    cache_control = 'public, max-age=300'
+
+    def get(self, wsck):
+        """Serve the iCalendar feed of a conference's sessions."""
+        self.serveFeed(conferenceFeed(wsck))
+
+
+class UserFeedHandler(CalendarFeedHandler):
+    def get(self, quoted_user_id, signature):
+        """Serve the iCalendar feed of a user's schedule."""
+        user_id = urllib.unquote(quoted_user_id).decode('utf-8')
+        if not checkFeedSignature(user_id, signature):
+            self.abort(404)
+        self.serveFeed(userFeed(user_id))
+
+
 class FeaturedSpeakerHandler(webapp2.RequestHandler):
     def post(self):
         """Send out featured speaker announcement."""
@@ -45,12 +346,86 @@ class FeaturedSpeakerHandler(webapp2.RequestHandler):
         ConferenceApi._cacheSpeakers(self.request.get('speaker'))
         self.response.set_status(204)
 
+class StatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return this instance's aggregated endpoint stats as JSON."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(json.dumps(getStats(), sort_keys=True))
+
+    def delete(self):
+        """Reset this instance's aggregated endpoint stats."""
+        resetStats()
+        self.response.set_status(204)
+
+class QuerySummaryHandler(CronHandler):
+    def get(self):
+        """Log the app's most expensive query shapes of the last window."""
+        logSummary()
+        self.response.set_status(204)
+
+
+class QueryStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return this instance's query shapes & slow queries as JSON."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(json.dumps(getQueryStats(), sort_keys=True))
+
+
+class TransactionStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return transaction retries per call site & the entity groups
+        colliding most as JSON; DELETE /admin/stats resets them."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(json.dumps(getTransactionStats(),
+                                           sort_keys=True))
+
+
+class CacheStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return cache policies, derived-cache & memcache stats as JSON."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(json.dumps(getCacheStats(), sort_keys=True))
+
+    def delete(self):
+        """Reset this instance's derived-cache counters."""
+        resetCacheStats()
+        self.response.set_status(204)
+
 class testHandler(webapp2.RequestHandler):
     def get(self):
         self.response.out.write("Hello world!")
 
-app = webapp2.WSGIApplication([
+app = InstrumentationMiddleware(webapp2.WSGIApplication([
+    ('/_ah/warmup', WarmupHandler),
     ('/crons/set_announcement', SetAnnouncementHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
+    ('/crons/send_notifications', SendNotificationsHandler),
     ('/tasks/featured_speaker', FeaturedSpeakerHandler),
-], debug=True)
+    ('/tasks/export', ExportStepHandler),
+    ('/tasks/delete_conference', DeleteConferenceHandler),
+    ('/tasks/facets', FacetDeltasHandler),
+    ('/crons/purge_facet_markers', PurgeFacetMarkersCronHandler),
+    ('/tasks/purge_facet_markers', PurgeFacetMarkersHandler),
+    ('/tasks/search_index', SearchIndexHandler),
+    ('/tasks/similar_conferences', SimilarConferencesHandler),
+    ('/tasks/search_backfill', SearchBackfillHandler),
+    ('/tasks/speaker_index', SpeakerIndexHandler),
+    ('/tasks/speaker_backfill', SpeakerBackfillHandler),
+    ('/crons/query_summary', QuerySummaryHandler),
+    ('/crons/archive_conferences', ArchiveConferencesHandler),
+    ('/tasks/archive_conferences', ArchiveBatchHandler),
+    ('/crons/catalog', CatalogCronHandler),
+    (CATALOG_TASK_URL, CatalogHandler),
+    ('/crons/reclaim_holds', ReclaimHoldsCronHandler),
+    ('/tasks/reclaim_holds', ReclaimHoldsHandler),
+    ('/crons/similar_conferences', SimilarConferencesCronHandler),
+    (r'/ical/conference/([^/]+)\.ics', ConferenceFeedHandler),
+    (r'/ical/user/([^/]+)/([0-9a-f]+)\.ics', UserFeedHandler),
+    ('/admin/stats', StatsHandler),
+    ('/admin/queries', QueryStatsHandler),
+    ('/admin/transactions', TransactionStatsHandler),
+    ('/admin/cache', CacheStatsHandler),
+    ('/admin/facets/rebuild', RebuildFacetsHandler),
+    ('/admin/search/rebuild', RebuildSearchHandler),
+    ('/admin/speakers/backfill', BackfillSpeakersHandler),
+], debug=True))
@@ -21,6 +21,10 @@ class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
     http_status = httplib.CONFLICT
 
+class TooManyRequestsException(endpoints.ServiceException):
+    """TooManyRequestsException -- exception mapped to HTTP 429 response"""
+    http_status = 429
+
 class Profile(ndb.Model):
     """Profile -- User profile object"""
     displayName = ndb.StringProperty()
@@ -63,6 +67,15 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    deleting        = ndb.BooleanProperty(default=False)
+
+class SeatHold(ndb.Model):
+    """SeatHold -- seat reserved for one user until expires, child of its
+    Conference & keyed by user ID"""
+    expires         = ndb.DateTimeProperty(required=True)
+
+class ArchivedConference(Conference):
+    """ArchivedConference -- past Conference moved out of the live kind"""
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -110,18 +123,37 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    includeArchived = messages.BooleanField(2)
 
 class Session(ndb.Model):
     """Session -- Session object"""
     name            = ndb.StringProperty(required=True)
     highlists       = ndb.StringProperty()
     speaker         = ndb.StringProperty()
+    speakerKey      = ndb.KeyProperty(kind='Speaker')
     duration        = ndb.IntegerProperty()  # Duration in minutes
     typeOfSession   = ndb.StringProperty(repeated=True)
     date            = ndb.DateProperty()
     startTime       = ndb.TimeProperty()
     organizerUserId = ndb.StringProperty()
 
+class ArchivedSession(Session):
+    """ArchivedSession -- Session of an ArchivedConference"""
+
+class Speaker(ndb.Model):
+    """Speaker -- session speaker, keyed by the normalized name"""
+    name            = ndb.StringProperty(indexed=False)
+
+class SpeakerPrefix(ndb.Model):
+    """SpeakerPrefix -- autocomplete entry keyed by a name prefix: the
+    speakers with a name word starting with it"""
+    speakers        = ndb.JsonProperty()    # sorted [speaker id, name] pairs
+
+class SpeakerBackfill(ndb.Model):
+    """SpeakerBackfill -- marks a session kind, its ID, as fully linked to
+    speakers"""
+    finished        = ndb.DateTimeProperty(auto_now_add=True)
+
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
     name            = messages.StringField(1)
@@ -135,4 +167,122 @@ class SessionForm(messages.Message):
 
 class SessionForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
-    items = messages.MessageField(SessionForm, 1, repeated=True)
\ No newline at end of file
+    items = messages.MessageField(SessionForm, 1, repeated=True)
+
+class ExportJob(ndb.Model):
+    """ExportJob -- background attendee/agenda export of a Conference"""
+    conferenceKey   = ndb.StringProperty()
+    organizerUserId = ndb.StringProperty()
+    what            = ndb.StringProperty()      # attendees | sessions
+    format          = ndb.StringProperty()      # csv | jsonl
+    status          = ndb.StringProperty()      # running | done | failed
+    rows            = ndb.IntegerProperty(default=0)
+    parts           = ndb.IntegerProperty(default=0)
+    cursor          = ndb.StringProperty(indexed=False)
+    location        = ndb.StringProperty(indexed=False)
+    error           = ndb.StringProperty(indexed=False)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+    updated         = ndb.DateTimeProperty(auto_now=True)
+
+class ExportJobForm(messages.Message):
+    """ExportJobForm -- ExportJob outbound form message"""
+    jobId           = messages.StringField(1)
+    websafeConferenceKey = messages.StringField(2)
+    what            = messages.StringField(3)
+    format          = messages.StringField(4)
+    status          = messages.StringField(5)
+    rows            = messages.IntegerField(6, variant=messages.Variant.INT32)
+    parts           = messages.IntegerField(7, variant=messages.Variant.INT32)
+    location        = messages.StringField(8)
+    error           = messages.StringField(9)
+
+class FacetShard(ndb.Model):
+    """FacetShard -- one shard of a conference count per facet value"""
+    facet           = ndb.StringProperty(indexed=False)
+    value           = ndb.StringProperty(indexed=False)
+    count           = ndb.IntegerProperty(default=0, indexed=False)
+
+class FacetApplied(ndb.Model):
+    """FacetApplied -- marker of a facets task applied to the parent
+    FacetShard, keyed by task name"""
+    applied         = ndb.DateTimeProperty(auto_now_add=True)
+
+class FacetValueForm(messages.Message):
+    """FacetValueForm -- conference count of one facet value"""
+    value           = messages.StringField(1)
+    count           = messages.IntegerField(2, variant=messages.Variant.INT32)
+
+class FacetForm(messages.Message):
+    """FacetForm -- counts of all values of one query field"""
+    field           = messages.StringField(1)
+    values          = messages.MessageField(FacetValueForm, 2, repeated=True)
+
+class FacetForms(messages.Message):
+    """FacetForms -- multiple FacetForm outbound form message"""
+    items = messages.MessageField(FacetForm, 1, repeated=True)
+
+class SearchEntry(ndb.Model):
+    """SearchEntry -- text index entry of a Conference or Session"""
+    kind            = ndb.StringProperty()
+    terms           = ndb.StringProperty(repeated=True)
+    prefixes        = ndb.StringProperty(repeated=True)
+    title           = ndb.StringProperty(indexed=False)
+    weights         = ndb.JsonProperty()            # term -> weighted count
+    length          = ndb.IntegerProperty(indexed=False)
+
+class SearchResultForm(messages.Message):
+    """SearchResultForm -- one ranked text search hit"""
+    kind            = messages.StringField(1)
+    websafeKey      = messages.StringField(2)
+    title           = messages.StringField(3)
+    score           = messages.FloatField(4)
+
+class SearchResultForms(messages.Message):
+    """SearchResultForms -- multiple SearchResultForm outbound form message"""
+    items = messages.MessageField(SearchResultForm, 1, repeated=True)
+
+class SimilarConferences(ndb.Model):
+    """SimilarConferences -- precomputed most similar conferences of one"""
+    similar         = ndb.JsonProperty(compressed=True)  # rows of 5 fields
+    updated         = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+class SimilarConferenceForm(messages.Message):
+    """SimilarConferenceForm -- one recommended similar conference"""
+    websafeKey      = messages.StringField(1)
+    name            = messages.StringField(2)
+    city            = messages.StringField(3)
+    startDate       = messages.StringField(4)
+    score           = messages.FloatField(5)
+
+class SimilarConferenceForms(messages.Message):
+    """SimilarConferenceForms -- multiple SimilarConferenceForm outbound form message"""
+    items = messages.MessageField(SimilarConferenceForm, 1, repeated=True)
+
+class CalendarFeedForm(messages.Message):
+    """CalendarFeedForm -- iCalendar feed URLs of a user"""
+    schedule        = messages.StringField(1)
+    conferences     = messages.StringField(2, repeated=True)
+
+class SeatVersionForm(messages.Message):
+    """SeatVersionForm -- seatsAvailable of a conference at a change feed version"""
+    websafeConferenceKey = messages.StringField(1)
+    version         = messages.IntegerField(2)
+    seatsAvailable  = messages.IntegerField(3, variant=messages.Variant.INT32)
+
+class SeatVersionForms(messages.Message):
+    """SeatVersionForms -- multiple SeatVersionForm inbound & outbound form message"""
+    items = messages.MessageField(SeatVersionForm, 1, repeated=True)
+
+class SeatHoldForm(messages.Message):
+    """SeatHoldForm -- seat hold outbound form message"""
+    websafeConferenceKey = messages.StringField(1)
+    expires         = messages.StringField(2)
+
+class SpeakerForm(messages.Message):
+    """SpeakerForm -- speaker outbound form message"""
+    speakerId       = messages.StringField(1)
+    name            = messages.StringField(2)
+
+class SpeakerForms(messages.Message):
+    """SpeakerForms -- multiple SpeakerForm outbound form message"""
+    items = messages.MessageField(SpeakerForm, 1, repeated=True)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+"""
+notifications.py -- organizer notification mail via a pull queue; tasks
+    carry a compact JSON payload, a cron worker leases them in batches,
+    groups them per recipient into digests and sends with bounded
+    concurrency
+
+"""
+
+import json
+import logging
+import threading
+import time
+from Queue import Empty
+from Queue import Queue
+
+from google.appengine.api import app_identity
+from google.appengine.api import taskqueue
+
+NOTIFY_QUEUE = 'notifications'
+LEASE_SECONDS = 120
+LEASE_BATCH = 100               # max tasks leased per lease_tasks call
+MAX_CONCURRENT_SENDS = 5
+MAX_RETRIES = 5                 # leases before a task is dropped
+WORKER_DEADLINE = 45            # seconds a worker run keeps leasing
+
+CONFERENCE_CREATED = 'cc'
+
+
+# - - - producing - - - - - - - - - - - - - - - - - - - - - -
+
+def queueConferenceCreated(email, conf, websafeKey):
+    """Queue a 'conference created' notification for `email`.
+
+    `conf` is the ConferenceForm returned to the organizer.
+    """
+    payload = {
+        't': CONFERENCE_CREATED,
+        'to': email,
+        'k': websafeKey,
+        'n': conf.name,
+        'c': conf.city,
+        'tp': list(conf.topics),
+        's': conf.startDate,
+        'e': conf.endDate,
+        'm': conf.maxAttendees,
+    }
+    taskqueue.Queue(NOTIFY_QUEUE).add(taskqueue.Task(
+        payload=json.dumps(payload, separators=(',', ':')),
+        method='PULL', tag=email))
+
+
+# - - - formatting - - - - - - - - - - - - - - - - - - - - -
+
+def _formatConference(p):
+    lines = [p['n']]
+    if p.get('c'):
+        lines.append('  City: %s' % p['c'])
+    if p.get('s'):
+        lines.append('  Dates: %s - %s' % (p['s'][:10],
+                                           (p.get('e') or '')[:10]))
+    if p.get('tp'):
+        lines.append('  Topics: %s' % ', '.join(p['tp']))
+    if p.get('m'):
+        lines.append('  Max attendees: %d' % p['m'])
+    return '\r\n'.join(lines)
+
+
+def formatDigest(payloads):
+    """Return (subject, body) for one recipient's notifications."""
+    confs = [p for p in payloads if p['t'] == CONFERENCE_CREATED]
+    if len(confs) == 1:
+        subject = 'You created a new Conference!'
+        body = 'Hi, you have created a following conference:\r\n\r\n'
+    else:
+        subject = 'You created %d new Conferences!' % len(confs)
+        body = 'Hi, you have created the following conferences:\r\n\r\n'
+    body += '\r\n\r\n'.join(_formatConference(p) for p in confs)
+    return subject, body
+
+
+# - - - consuming - - - - - - - - - - - - - - - - - - - - - -
+
+def _sendDigests(digests):
+    """Send {recipient: [payload, ...]} mails; return recipients that
+    were sent. At most MAX_CONCURRENT_SENDS mails are in flight.
+    """
+    # only the cron worker sends; keep mail out of instance startup
+    from google.appengine.api import mail
+    sender = 'noreply@%s.appspotmail.com' % (
+        app_identity.get_application_id())
+    work = Queue()
+    for item in digests.iteritems():
+        work.put(item)
+    sent = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                to, payloads = work.get_nowait()
+            except Empty:
+                return
+            subject, body = formatDigest(payloads)
+            try:
+                mail.send_mail(sender, to, subject, body)
+            except Exception:
+                logging.exception('notification mail to %s failed', to)
+                continue
+            with lock:
+                sent.append(to)
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(min(MAX_CONCURRENT_SENDS, len(digests)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sent
+
+
+def sendPendingNotifications(deadline=WORKER_DEADLINE):
+    """Lease, group & send queued notifications until the queue is empty
+    or `deadline` seconds passed; return (tasks done, mails sent).
+    """
+    queue = taskqueue.Queue(NOTIFY_QUEUE)
+    stop = time.time() + deadline
+    done = mails = 0
+    while time.time() < stop:
+        tasks = queue.lease_tasks(LEASE_SECONDS, LEASE_BATCH)
+        if not tasks:
+            break
+
+        digests = {}
+        by_recipient = {}
+        finished = []
+        for task in tasks:
+            try:
+                payload = json.loads(task.payload)
+                to = payload['to']
+            except (ValueError, KeyError):
+                logging.error('dropping malformed notification %s',
+                              task.name)
+                finished.append(task)
+                continue
+            if task.retry_count >= MAX_RETRIES:
+                logging.error('dropping notification to %s after %d '
+                              'attempts', to, task.retry_count)
+                finished.append(task)
+                continue
+            digests.setdefault(to, []).append(payload)
+            by_recipient.setdefault(to, []).append(task)
+
+        for to in _sendDigests(digests):
+            finished.extend(by_recipient[to])
+            mails += 1
+        # unsent tasks stay leased and are retried once the lease expires
+        if finished:
+            queue.delete_tasks(finished)
+        done += len(finished)
+    return done, mails
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+
+"""
+querylog.py -- slow-query log for dynamically built ndb queries; records
+    each query under its normalized shape (kind, filters without values,
+    orders, ancestor kind), with result count, entities skipped by
+    residual in-memory filters and latency
+
+Time is cut into SUMMARY_SECONDS windows aligned to the clock. Each
+instance aggregates its queries in memory (/admin/queries shows the
+instance serving it) and, every PUBLISH_SECONDS while it serves queries
+and whenever a window ends, adds what it recorded since its last publish
+to its own memcache entry for the window. The /crons/query_summary cron
+combines the entries of every instance for the last complete window and
+logs the app's most expensive shapes. Queries an instance recorded after
+its last publish before going idle reach memcache with its next query;
+if that is after the cron summarized their window, they are left out.
+
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.datastore import datastore_query
+from google.appengine.ext import ndb
+
+from storage import getRepository
+
+# queries at or above this latency (ms) go into the slow-query ring buffer
+SLOW_QUERY_MS = 100
+# number of slow queries kept per instance
+SLOW_QUERY_BUFFER = 200
+# number of shapes listed in the periodic summary
+SUMMARY_TOP = 10
+# length (s) of the windows summarized app-wide
+SUMMARY_SECONDS = 15 * 60
+# seconds between an instance's publishes to memcache
+PUBLISH_SECONDS = 60
+CAS_RETRIES = 5
+
+_lock = threading.Lock()
+_shapes = {}                    # this instance, current window
+_unpublished = {}               # this instance, since its last publish
+_slow = collections.deque(maxlen=SLOW_QUERY_BUFFER)
+_window = [None]
+_publishedAt = [time.time()]
+_listedIn = [None]              # last window this instance is listed under
+
+
+class ShapeStats(object):
+    """ShapeStats -- aggregate counters for one normalized query shape"""
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.count = 0
+        self.slow = 0
+        self.totalMs = 0.0
+        self.maxMs = 0.0
+        self.results = 0
+        self.skipped = 0
+
+    def add(self, elapsed_ms, results, skipped):
+        self.count += 1
+        if elapsed_ms >= SLOW_QUERY_MS:
+            self.slow += 1
+        self.totalMs += elapsed_ms
+        if elapsed_ms > self.maxMs:
+            self.maxMs = elapsed_ms
+        self.results += results
+        self.skipped += skipped
+
+    def merge(self, other):
+        """Fold in the counters of another ShapeStats of the same shape."""
+        self.count += other.count
+        self.slow += other.slow
+        self.totalMs += other.totalMs
+        self.maxMs = max(self.maxMs, other.maxMs)
+        self.results += other.results
+        self.skipped += other.skipped
+
+    def toDict(self):
+        count = self.count or 1
+        return {
+            'shape': self.shape,
+            'count': self.count,
+            'slow': self.slow,
+            'meanMs': round(self.totalMs / count, 3),
+            'maxMs': round(self.maxMs, 3),
+            'totalMs': round(self.totalMs, 3),
+            'meanResults': round(self.results / float(count), 3),
+            'meanSkipped': round(self.skipped / float(count), 3),
+        }
+
+
+# - - - shape normalization - - - - - - - - - - - - - - - - -
+
+def _normalizeNode(node):
+    """Return a value-free string for an ndb filter node."""
+    if isinstance(node, ndb.query.FilterNode):
+        name, opsymbol, _ = node.__getnewargs__()
+        return '%s %s' % (name, opsymbol)
+    if isinstance(node, ndb.query.ConjunctionNode):
+        return ' AND '.join(sorted(_normalizeNode(n) for n in node))
+    if isinstance(node, ndb.query.DisjunctionNode):
+        # identical branches (e.g. a != expanded per value) collapse
+        return 'OR(%s)' % ' | '.join(sorted(set(
+            _normalizeNode(n) for n in node)))
+    if isinstance(node, ndb.query.PostFilterNode):
+        return '<post-filter>'
+    return '<%s>' % type(node).__name__
+
+
+def _normalizeOrders(orders):
+    if orders is None:
+        return ''
+    return ', '.join(
+        '%s %s' % (pb.property(),
+                   'desc' if pb.direction() ==
+                   datastore_query.PropertyOrder.DESCENDING else 'asc')
+        for pb in orders._to_pbs())
+
+
+def queryShape(query, projection=None):
+    """Return the normalized shape string of an ndb query."""
+    parts = [query.kind or '<kindless>']
+    if query.ancestor is not None:
+        parts.append('ancestor=%s' % query.ancestor.kind())
+    if query.filters is not None:
+        parts.append('filters=[%s]' % _normalizeNode(query.filters))
+    orders = _normalizeOrders(query.orders)
+    if orders:
+        parts.append('orders=[%s]' % orders)
+    if projection:
+        parts.append('projection=[%s]' % ', '.join(sorted(
+            getattr(p, '_name', p) for p in projection)))
+    return ' '.join(parts)
+
+
+# - - - recording - - - - - - - - - - - - - - - - - - - - - -
+
+def _windowOf(now):
+    return int(now // SUMMARY_SECONDS)
+
+
+def _add(shapes, shape, elapsed_ms, results, skipped):
+    stats = shapes.get(shape)
+    if stats is None:
+        stats = shapes[shape] = ShapeStats(shape)
+    stats.add(elapsed_ms, results, skipped)
+
+
+def recordQuery(shape, elapsed_ms, results, skipped=0):
+    """Fold one executed query into the per-shape aggregates; publish
+    what this instance recorded when a publish is due.
+    """
+    global _shapes, _unpublished, _slow
+    now = time.time()
+    window = _windowOf(now)
+    publish = None
+    with _lock:
+        if _window[0] is None:
+            _window[0] = window
+        if window != _window[0] or now - _publishedAt[0] >= PUBLISH_SECONDS:
+            # swapped under the lock: nothing recorded meanwhile is lost
+            publish = (_window[0], _unpublished)
+            _unpublished = {}
+            _publishedAt[0] = now
+        if window != _window[0]:
+            _window[0] = window
+            _shapes = {}
+            _slow = collections.deque(maxlen=SLOW_QUERY_BUFFER)
+        _add(_shapes, shape, elapsed_ms, results, skipped)
+        _add(_unpublished, shape, elapsed_ms, results, skipped)
+        if elapsed_ms >= SLOW_QUERY_MS:
+            _slow.append({
+                'shape': shape,
+                'ms': round(elapsed_ms, 3),
+                'results': results,
+                'skipped': skipped,
+                'timestamp': int(now),
+            })
+    if publish and publish[1]:
+        publishStats(*publish)
+
+
+# - - - app-wide summary - - - - - - - - - - - - - - - - - - -
+
+def _instanceId():
+    return os.environ.get('INSTANCE_ID', 'local')
+
+
+def _windowKey(window):
+    return 'QUERYLOG|%d' % window
+
+
+def _instanceKey(window, instance):
+    return 'QUERYLOG|%d|%s' % (window, instance)
+
+
+def _casUpdate(key, update, timeout):
+    """Store update(current value or None) under `key` with
+    compare-and-set; give up after CAS_RETRIES collisions.
+    """
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        current = client.gets(key)
+        if current is None:
+            if client.add(key, update(None), timeout):
+                return True
+        elif client.cas(key, update(current), timeout):
+            return True
+    return False
+
+
+def publishStats(window, shapes):
+    """Add an instance's {shape: ShapeStats} to its memcache entry for
+    `window` and list the instance under the window.
+    """
+    instance = _instanceId()
+    timeout = 3 * SUMMARY_SECONDS
+
+    def merge(stored):
+        stored = stored or {}
+        for shape, stats in shapes.iteritems():
+            if shape in stored:
+                stored[shape].merge(stats)
+            else:
+                stored[shape] = stats
+        return stored
+
+    # only this instance writes its entry, yet its threads may race
+    _casUpdate(_instanceKey(window, instance), merge, timeout)
+    if _listedIn[0] != window and _casUpdate(
+            _windowKey(window),
+            lambda ids: ids if ids and instance in ids
+            else (ids or []) + [instance], timeout):
+        _listedIn[0] = window
+
+
+def getQueryStats():
+    """Return per-shape aggregates (slowest total first) & slow queries."""
+    with _lock:
+        shapes = [s.toDict() for s in _shapes.itervalues()]
+        slow = list(_slow)
+    shapes.sort(key=lambda s: s['totalMs'], reverse=True)
+    return {'shapes': shapes, 'slowQueries': slow,
+            'slowQueryMs': SLOW_QUERY_MS}
+
+
+def logSummary(window=None):
+    """Combine the published stats of every instance for `window` (by
+    default the last complete one), log the most expensive shapes and
+    return them.
+    """
+    if window is None:
+        window = _windowOf(time.time()) - 1
+    instances = memcache.get(_windowKey(window)) or []
+    entries = memcache.get_multi([_instanceKey(window, i)
+                                  for i in instances])
+    combined = {}
+    for shapes in entries.itervalues():
+        for shape, stats in shapes.iteritems():
+            if shape in combined:
+                combined[shape].merge(stats)
+            else:
+                combined[shape] = stats
+    top = sorted((s.toDict() for s in combined.itervalues()),
+                 key=lambda s: s['totalMs'], reverse=True)[:SUMMARY_TOP]
+    start = time.strftime('%H:%M', time.gmtime(window * SUMMARY_SECONDS))
+    logging.info('query summary of the %d-minute window from %s UTC: %d '
+                 'shapes from %d of %d instances', SUMMARY_SECONDS // 60,
+                 start, len(combined), len(entries), len(instances))
+    for s in top:
+        log = logging.warning if s['slow'] else logging.info
+        log('query shape %s: count=%d slow=%d mean=%.1fms max=%.1fms '
+            'results=%.1f skipped=%.1f', s['shape'], s['count'], s['slow'],
+            s['meanMs'], s['maxMs'], s['meanResults'], s['meanSkipped'])
+    return top
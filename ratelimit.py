@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+"""
+ratelimit.py -- per-user admission control for write endpoints: a token
+    bucket per (endpoint, user id) shared across instances through
+    memcache, with an in-process fast path
+
+A bucket holds up to `burst` tokens and gains `rate` tokens per second.
+Its shared state is one memcache value, the time at which it would be
+full again (the generic cell rate algorithm), updated with
+compare-and-set and expiring exactly then, so idle buckets cost no
+memory. Instances take tokens in leases of up to LEASE_SIZE, but never
+more than half of what the bucket holds, and spend them locally without
+any RPC; a lease unused for as long as it took to earn is dropped, and
+leases left at instance shutdown are credited back. After a rejection
+the instance also rejects locally until the next token is due. When
+memcache is unavailable, calls are admitted.
+
+"""
+
+import collections
+import functools
+import math
+import threading
+import time
+
+import endpoints
+from google.appengine.api import memcache
+from google.appengine.api import runtime
+
+from models import TooManyRequestsException
+from utils import getUserId
+
+Limit = collections.namedtuple('Limit', 'rate burst')   # tokens/s, tokens
+
+# per-endpoint limits; endpoints not listed are not limited
+RATE_LIMITS = {
+    'registerForConference': Limit(rate=0.5, burst=10),
+    'holdSeat': Limit(rate=0.5, burst=10),
+    'createSession': Limit(rate=0.5, burst=20),
+    'saveProfile': Limit(rate=0.2, burst=5),
+}
+# per-user overrides: {user id: {endpoint: Limit, or None for unlimited}}
+USER_LIMITS = {}
+
+LEASE_SIZE = 5                  # max tokens taken from memcache at once
+MAX_LOCAL_BUCKETS = 10000       # (endpoint, user) buckets kept per instance
+MEMCACHE_NAMESPACE = 'ratelimit'
+CAS_RETRIES = 5
+
+
+class _LocalBucket(object):
+    """_LocalBucket -- this instance's leased tokens of one bucket"""
+    __slots__ = ('tokens', 'expires', 'blocked', 'interval')
+
+    def __init__(self, interval):
+        self.tokens = 0
+        self.expires = 0.0          # leased tokens are dropped after this
+        self.blocked = 0.0          # rejected locally until this
+        self.interval = interval
+
+
+_lock = threading.Lock()
+_buckets = collections.OrderedDict()
+
+
+def limitFor(endpoint, user_id):
+    """Return the Limit applying to a user on an endpoint, or None."""
+    overrides = USER_LIMITS.get(user_id)
+    if overrides and endpoint in overrides:
+        return overrides[endpoint]
+    return RATE_LIMITS.get(endpoint)
+
+
+def _localBucket(key, interval):
+    """Return the bucket of `key` as most recently used; caller locks."""
+    bucket = _buckets.pop(key, None)
+    if bucket is None or bucket.interval != interval:
+        bucket = _LocalBucket(interval)
+    _buckets[key] = bucket
+    while len(_buckets) > MAX_LOCAL_BUCKETS:
+        _buckets.popitem(last=False)
+    return bucket
+
+
+def _memcacheKey(key):
+    return '%s|%s' % key
+
+
+def _lease(key, limit, want, now):
+    """Take up to `want` tokens from the shared bucket of `key`.
+
+    Returns (tokens granted, seconds until the next token when none
+    were), or None when memcache did not answer.
+    """
+    interval = 1.0 / limit.rate
+    tolerance = limit.burst * interval
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        full_at = client.gets(_memcacheKey(key), namespace=MEMCACHE_NAMESPACE)
+        start = max(full_at or now, now)
+        # a little slack for float rounding of whole tokens
+        available = int((tolerance - (start - now)) / interval + 1e-6)
+        if available <= 0:
+            return 0, start - tolerance + interval - now
+        granted = min(want, max(1, available // 2))
+        full_at_after = start + granted * interval
+        timeout = int(math.ceil(full_at_after - now)) + 1
+        if full_at is None:
+            stored = client.add(_memcacheKey(key), full_at_after, timeout,
+                                namespace=MEMCACHE_NAMESPACE)
+        else:
+            stored = client.cas(_memcacheKey(key), full_at_after, timeout,
+                                namespace=MEMCACHE_NAMESPACE)
+        if stored:
+            return granted, 0
+    return None
+
+
+def admit(endpoint, user_id, now=None):
+    """Take one token; return 0 when admitted, else the seconds until
+    the next token.
+    """
+    limit = limitFor(endpoint, user_id)
+    if limit is None:
+        return 0
+    now = now or time.time()
+    interval = 1.0 / limit.rate
+    key = (endpoint, user_id)
+
+    with _lock:
+        bucket = _localBucket(key, interval)
+        if bucket.blocked > now:
+            return int(math.ceil(bucket.blocked - now))
+        if bucket.tokens > 0 and bucket.expires > now:
+            bucket.tokens -= 1
+            return 0
+        bucket.tokens = 0
+
+    want = max(1, min(LEASE_SIZE, limit.burst // 4))
+    leased = _lease(key, limit, want, now)
+    if leased is None:
+        return 0
+    granted, wait = leased
+    with _lock:
+        bucket = _localBucket(key, interval)
+        if granted <= 0:
+            bucket.blocked = now + wait
+            return max(1, int(math.ceil(wait)))
+        bucket.tokens += granted - 1
+        # unused longer than it took to earn them, they would add a burst
+        bucket.expires = now + granted * interval
+    return 0
+
+
+def _creditLeases():
+    """Return unspent leased tokens to their shared buckets."""
+    now = time.time()
+    with _lock:
+        leases = [(key, b.tokens * b.interval)
+                  for key, b in _buckets.iteritems()
+                  if b.tokens > 0 and b.expires > now]
+        _buckets.clear()
+    client = memcache.Client()
+    for key, credit in leases:
+        for _ in range(CAS_RETRIES):
+            full_at = client.gets(_memcacheKey(key),
+                                  namespace=MEMCACHE_NAMESPACE)
+            if full_at is None or full_at - credit <= now:
+                # full anyway once the credit is back
+                client.delete(_memcacheKey(key), namespace=MEMCACHE_NAMESPACE)
+                break
+            if client.cas(_memcacheKey(key), full_at - credit,
+                          int(math.ceil(full_at - credit - now)) + 1,
+                          namespace=MEMCACHE_NAMESPACE):
+                break
+
+
+def rateLimited(func):
+    """Reject calls over the caller's limit on this endpoint with 429.
+
+    Anonymous calls pass through; the endpoint itself rejects them.
+    """
+    @functools.wraps(func)
+    def wrapper(self, request):
+        user = endpoints.get_current_user()
+        if user:
+            retry_after = admit(func.__name__, getUserId(user))
+            if retry_after:
+                raise TooManyRequestsException(
+                    'Too many requests; retry after %d seconds.'
+                    % retry_after)
+        return func(self, request)
+    return wrapper
+
+
+def _onShutdown():
+    _creditLeases()
+    if _previousShutdownHook:
+        _previousShutdownHook()
+
+# chained: the ID pool installs a shutdown hook of its own
+_previousShutdownHook = runtime.set_shutdown_hook(_onShutdown)
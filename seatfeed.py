@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""
+seatfeed.py -- change feed of seatsAvailable, long-polled by registration
+    pages instead of re-fetching getConference
+
+Every registration change adjusts a seat count and bumps a version of its
+conference in memcache once the transaction commits. A watcher passes the
+versions it has seen; watchSeats re-reads the versions (one get_multi),
+first every MIN_POLL_SECONDS and backing off to MAX_POLL_SECONDS, until
+one differs or WATCH_SECONDS pass, then returns only the changed
+conferences. Holds are kept short so a watcher ties up an instance
+thread for a few seconds at a time; the client waits between watches
+that found nothing, longer the quieter the conference. Counts move by memcache incr/decr, so
+concurrent registrations never overwrite each other; a missing count is
+read from the datastore. Conference updates drop the count so it is
+re-read, and a version evicted from memcache is re-created from the
+clock, which watchers see as a change.
+
+"""
+
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from storage import getEntities
+
+WATCH_SECONDS = 5               # longest a watch request is held
+MIN_POLL_SECONDS = 0.25         # first interval between version reads
+MAX_POLL_SECONDS = 1.0          # intervals double up to this
+MAX_WATCHED = 50                # conferences per watch request
+
+
+def _versionKey(wsck):
+    return 'SEATS_VERSION|%s' % wsck
+
+
+def _seatsKey(wsck):
+    return 'SEATS|%s' % wsck
+
+
+def _clock():
+    return int(time.time() * 1000)
+
+
+def _bumpVersion(wsck):
+    memcache.incr(_versionKey(wsck), initial_value=_clock())
+
+
+def publishSeats(conf_key, seats, delta):
+    """Record that a registration moved a conference's seats by `delta`,
+    leaving `seats` available; call once the change has committed.
+    """
+    wsck = conf_key.urlsafe()
+    # the count before the change seeds a missing key, so the first change
+    # after an eviction lands on the committed value
+    if delta < 0:
+        memcache.decr(_seatsKey(wsck), -delta, initial_value=seats - delta)
+    else:
+        memcache.incr(_seatsKey(wsck), delta, initial_value=seats - delta)
+    _bumpVersion(wsck)
+
+
+def resetSeats(conf_key):
+    """Drop a conference's seat count after any other write to it."""
+    wsck = conf_key.urlsafe()
+    memcache.delete(_seatsKey(wsck))
+    _bumpVersion(wsck)
+
+
+def _versions(wscks):
+    keys = [_versionKey(w) for w in wscks]
+    found = memcache.get_multi(keys)
+    missing = [k for k in keys if k not in found]
+    if missing:
+        now = _clock()
+        memcache.add_multi(dict((k, now) for k in missing))
+        found.update(memcache.get_multi(missing))
+    return dict((w, found.get(k, 0)) for w, k in zip(wscks, keys))
+
+
+def _seats(wscks):
+    """Return {wsck: seatsAvailable}, None for missing conferences."""
+    found = memcache.get_multi([_seatsKey(w) for w in wscks])
+    seats = dict((w, found.get(_seatsKey(w))) for w in wscks)
+    missing = [w for w in wscks if seats[w] is None]
+    if missing:
+        confs = getEntities([ndb.Key(urlsafe=w) for w in missing])
+        for wsck, conf in zip(missing, confs):
+            if conf and not conf.deleting:
+                seats[wsck] = conf.seatsAvailable
+    return seats
+
+
+def waitForSeatChanges(seen, timeout=WATCH_SECONDS):
+    """Wait until a version differs from `seen` ({wsck: version}, version
+    0 for none yet) or `timeout` seconds pass; return the changes as
+    (wsck, version, seatsAvailable) tuples, seatsAvailable None for
+    conferences gone or being deleted.
+    """
+    wscks = list(seen)
+    deadline = time.time() + timeout
+    interval = MIN_POLL_SECONDS
+    while True:
+        versions = _versions(wscks)
+        changed = [w for w in wscks if versions[w] != seen[w]]
+        left = deadline - time.time()
+        if changed or left <= 0:
+            break
+        time.sleep(min(interval, left))
+        interval = min(interval * 2, MAX_POLL_SECONDS)
+    seats = _seats(changed) if changed else {}
+    return [(w, versions[w], seats[w]) for w in changed]
@@ -16,3 +16,12 @@ WEB_CLIENT_ID = '776302274474-6v07ju3km4c2l99t144q83np8ueur3nd.apps.googleuserco
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# Secret signing the per-user iCalendar feed URLs; replace with a long
+# random string (changing it invalidates every published feed URL). User
+# feeds stay disabled while this is the placeholder.
+ICAL_FEED_SECRET = 'replace with a long random string'
+
+# Cloud Storage bucket receiving conference exports; empty for the app's
+# default bucket. Exports fail in production if neither exists.
+EXPORT_BUCKET = ''
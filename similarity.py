@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+"""
+similarity.py -- precomputed "you might also like" lists: the top-K most
+    similar live conferences of every conference, scored on topic overlap
+    (Jaccard) plus same city and start month proximity
+
+The nightly job loads every live conference once, builds an inverted
+topic -> conferences index sorted by start date and scores each
+conference only against the conferences it shares a topic with; for
+topics too common to be informative, only the POSTING_WINDOW conferences
+starting closest in time are considered. Creating or updating a
+conference queues a recomputation of its own list. Lists are stored
+denormalized, one SimilarConferences entity per conference, so
+getSimilarConferences is a single get.
+
+"""
+
+import bisect
+import heapq
+import logging
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import SimilarConferences
+from querylog import runQuery
+from storage import deleteEntities
+from storage import fetchPage
+from storage import getEntity
+from storage import putEntities
+from storage import putEntity
+
+SIMILAR_TASK_URL = '/tasks/similar_conferences'
+TOP_K = 10
+POSTING_WINDOW = 200            # neighbours in time considered per topic
+CANDIDATE_LIMIT = 1000          # candidates fetched for one conference
+PAGE_SIZE = 500
+PUT_BATCH = 200
+
+TOPIC_WEIGHT = 0.7
+CITY_WEIGHT = 0.2
+MONTH_WEIGHT = 0.1
+
+
+class _Conf(object):
+    """_Conf -- the fields of a Conference that scoring & lists need"""
+    __slots__ = ('wsck', 'name', 'city', 'month', 'startDate', 'topics')
+
+    def __init__(self, conf):
+        self.wsck = conf.key.urlsafe()
+        self.name = conf.name
+        self.city = conf.city
+        self.month = conf.month or 0
+        self.startDate = str(conf.startDate) if conf.startDate else ''
+        self.topics = frozenset(conf.topics or ())
+
+
+def _monthProximity(a, b):
+    """1.0 for the same month down to 0.0 six months apart; 0.0 if unset."""
+    if not (a and b):
+        return 0.0
+    d = abs(a - b) % 12
+    return 1.0 - min(d, 12 - d) / 6.0
+
+
+def score(a, b, overlap=None):
+    """Similarity of two _Conf in [0, 1]."""
+    if overlap is None:
+        overlap = len(a.topics & b.topics)
+    union = len(a.topics) + len(b.topics) - overlap
+    s = TOPIC_WEIGHT * overlap / float(union) if union else 0.0
+    if a.city and a.city == b.city:
+        s += CITY_WEIGHT
+    return s + MONTH_WEIGHT * _monthProximity(a.month, b.month)
+
+
+def _topK(conf, candidates):
+    """Return the TOP_K [wsck, name, city, startDate, score] rows."""
+    best = heapq.nlargest(TOP_K, ((score(conf, c, n), c)
+                                  for c, n in candidates.iteritems()),
+                          key=lambda sc: sc[0])
+    return [[c.wsck, c.name, c.city, c.startDate, round(s, 4)]
+            for s, c in best]
+
+
+def _liveConferences():
+    confs = []
+    cursor = None
+    while True:
+        page, cursor, more = fetchPage(Conference.query(), PAGE_SIZE, cursor)
+        confs.extend(_Conf(c) for c in page if not c.deleting)
+        if not (more and cursor):
+            return confs
+
+
+def rebuildSimilarConferences():
+    """Recompute every conference's list; drop lists of conferences that
+    are gone. Returns the number of lists written.
+    """
+    confs = _liveConferences()
+    # topic -> conferences sorted by start date (undated ones first)
+    postings = {}
+    for c in confs:
+        for topic in c.topics:
+            postings.setdefault(topic, []).append(c)
+    dates = {}
+    for topic, plist in postings.iteritems():
+        plist.sort(key=lambda c: c.startDate)
+        dates[topic] = [c.startDate for c in plist]
+
+    lists = []
+    for conf in confs:
+        overlap = {}
+        for topic in conf.topics:
+            plist = postings[topic]
+            if len(plist) > POSTING_WINDOW:
+                mid = bisect.bisect_left(dates[topic], conf.startDate)
+                lo = max(0, mid - POSTING_WINDOW // 2)
+                plist = plist[lo:lo + POSTING_WINDOW]
+            for c in plist:
+                if c is not conf:
+                    overlap[c] = overlap.get(c, 0) + 1
+        lists.append(SimilarConferences(id=conf.wsck,
+                                        similar=_topK(conf, overlap)))
+        if len(lists) >= PUT_BATCH:
+            putEntities(lists)
+            lists = []
+    putEntities(lists)
+
+    live = set(c.wsck for c in confs)
+    stale = [k for k in runQuery(SimilarConferences.query(), keys_only=True)
+             if k.id() not in live]
+    deleteEntities(stale)
+    logging.info('similar conferences: %d lists, %d stale dropped',
+                 len(confs), len(stale))
+    return len(confs)
+
+
+# - - - incremental - - - - - - - - - - - - - - - - - - - - -
+
+def queueSimilarUpdate(conf_key=None, transactional=False):
+    """Queue a recomputation of one conference's list, or of all lists
+    when no key is given.
+    """
+    params = {'conf': conf_key.urlsafe()} if conf_key else {}
+    taskqueue.add(url=SIMILAR_TASK_URL, params=params,
+                  transactional=transactional)
+
+
+def updateSimilarConferences(conf_wsck):
+    """Recompute one conference's list from the conferences sharing a
+    topic with it; other lists pick it up on the next nightly run.
+    """
+    conf = getEntity(ndb.Key(urlsafe=conf_wsck))
+    if conf is None or conf.deleting:
+        deleteEntities([ndb.Key(SimilarConferences, conf_wsck)])
+        return
+    target = _Conf(conf)
+    overlap = {}
+    if target.topics:
+        for c in runQuery(Conference.query(Conference.topics.IN(
+                sorted(target.topics))), limit=CANDIDATE_LIMIT):
+            if c.key != conf.key and not c.deleting:
+                other = _Conf(c)
+                overlap[other] = len(target.topics & other.topics)
+    putEntity(SimilarConferences(id=conf_wsck,
+                                 similar=_topK(target, overlap)))
+
+
+def similarConferences(conf_wsck):
+    """Return the stored [wsck, name, city, startDate, score] rows."""
+    similar = getEntity(ndb.Key(SimilarConferences, conf_wsck))
+    return similar.similar if similar else []
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+"""
+speakers.py -- speaker directory: Speaker entities keyed by the
+    normalized speaker name, sessions linked to them, and a sorted-prefix
+    index for autocomplete answered from memcache
+
+Names are normalized by dropping accents, punctuation and case and by
+collapsing whitespace, so 'José  García' and 'jose garcia' are one
+speaker. Every prefix (MIN_PREFIX..MAX_PREFIX chars) of every word of a
+speaker's normalized name has a SpeakerPrefix entity listing up to
+PREFIX_ENTRIES speakers in name order. A suggestion reads the entry of
+the query's longest word (one memcache get; the entity on a miss) and
+checks the other words in memory.
+
+New speakers are added to the index by /tasks/speaker_index; the
+backfill under /tasks/speaker_backfill links existing sessions page by
+page and stores a SpeakerBackfill marker when a kind is done, after
+which no session of that kind lacks its speaker key.
+
+"""
+
+import logging
+import re
+import unicodedata
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import ArchivedSession
+from models import Session
+from models import Speaker
+from models import SpeakerBackfill
+from models import SpeakerPrefix
+from storage import fetchPage
+from storage import getEntity
+from storage import putEntities
+from storage import putEntity
+from storage import transactional
+
+SPEAKER_INDEX_URL = '/tasks/speaker_index'
+SPEAKER_BACKFILL_URL = '/tasks/speaker_backfill'
+MIN_PREFIX = 1
+MAX_PREFIX = 8                  # longer query words are checked in memory
+MAX_ID_LENGTH = 200
+PREFIX_ENTRIES = 50             # speakers kept per prefix
+SUGGEST_LIMIT = 10
+PREFIX_CACHE_SECONDS = 24 * 3600
+BACKFILL_PAGE = 200
+INDEX_BATCH = 20                # speakers indexed per task
+BACKFILL_CHECK_SECONDS = 60     # how long "not done yet" is cached
+
+SPEAKER_BACKFILL_MODELS = dict((m.__name__, m)
+                               for m in (Session, ArchivedSession))
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_backfilled = set()             # kinds known to be done on this instance
+
+
+def normalizeSpeaker(name):
+    """Return the speaker ID of a name: accents, punctuation & case
+    dropped, whitespace collapsed; u'' if nothing is left.
+    """
+    if not name:
+        return u''
+    if isinstance(name, str):
+        name = name.decode('utf-8', 'replace')
+    name = u''.join(c for c in unicodedata.normalize('NFKD', name)
+                    if not unicodedata.combining(c))
+    return u' '.join(_WORD_RE.findall(name.lower()))[:MAX_ID_LENGTH]
+
+
+def speakerKey(name):
+    """Return the Speaker key of a name, or None for a blank name."""
+    speaker_id = normalizeSpeaker(name)
+    return ndb.Key(Speaker, speaker_id) if speaker_id else None
+
+
+def linkSpeakers(names):
+    """Return {name: Speaker key or None}, creating the Speakers not seen
+    before & queueing their autocomplete entries.
+
+    Racing creators of one speaker both put it; the index task is
+    idempotent.
+    """
+    keys = dict((name, speakerKey(name)) for name in set(names))
+    first = {}
+    for name, key in keys.iteritems():
+        if key and key not in first:
+            first[key] = name
+    wanted = sorted(first)
+    new = [Speaker(key=key, name=first[key].strip())
+           for key, speaker in zip(wanted, ndb.get_multi(wanted))
+           if speaker is None]
+    if new:
+        ndb.put_multi(new)
+        queueSpeakerIndex([s.key.id() for s in new])
+    return keys
+
+
+# - - - prefix index - - - - - - - - - - - - - - - - - - - - -
+
+def prefixesOf(speaker_id):
+    return set(word[:n] for word in speaker_id.split()
+               for n in range(MIN_PREFIX, min(len(word), MAX_PREFIX) + 1))
+
+
+def _cacheKey(prefix):
+    return 'SPEAKER_PREFIX|%s' % prefix.encode('utf-8')
+
+
+def queueSpeakerIndex(speaker_ids):
+    # normalized IDs never hold a comma
+    for i in range(0, len(speaker_ids), INDEX_BATCH):
+        taskqueue.add(url=SPEAKER_INDEX_URL, params={
+            'speakers': u','.join(speaker_ids[i:i + INDEX_BATCH])})
+
+
+@transactional(retries=5)
+def _addToPrefix(prefix, speaker_id, name):
+    entry = getEntity(ndb.Key(SpeakerPrefix, prefix))
+    pairs = [p for p in (entry.speakers if entry else [])
+             if p[0] != speaker_id]
+    pairs.append([speaker_id, name])
+    pairs.sort()
+    del pairs[PREFIX_ENTRIES:]
+    putEntity(SpeakerPrefix(id=prefix, speakers=pairs))
+    return pairs
+
+
+def indexSpeakers(speaker_ids):
+    """Add speakers to the entries of all their prefixes & refresh the
+    cached entries.
+    """
+    keys = [ndb.Key(Speaker, i) for i in speaker_ids]
+    for speaker in ndb.get_multi(keys):
+        if speaker is None:
+            continue
+        speaker_id = speaker.key.id()
+        for prefix in sorted(prefixesOf(speaker_id)):
+            pairs = _addToPrefix(prefix, speaker_id, speaker.name)
+            memcache.set(_cacheKey(prefix), pairs, PREFIX_CACHE_SECONDS)
+
+
+def matchSpeakers(text, limit=SUGGEST_LIMIT):
+    """Return up to `limit` (speaker id, name) pairs whose name words
+    start with the words of `text`, in name order.
+    """
+    words = normalizeSpeaker(text).split()
+    if not words:
+        return []
+    prefix = max(words, key=len)[:MAX_PREFIX]
+    pairs = memcache.get(_cacheKey(prefix))
+    if pairs is None:
+        entry = ndb.Key(SpeakerPrefix, prefix).get()
+        pairs = entry.speakers if entry else []
+        memcache.set(_cacheKey(prefix), pairs, PREFIX_CACHE_SECONDS)
+    found = []
+    for speaker_id, name in pairs:
+        names = speaker_id.split()
+        if all(any(n.startswith(w) for n in names) for w in words):
+            found.append((speaker_id, name))
+            if len(found) >= limit:
+                break
+    return found
+
+
+# - - - backfill - - - - - - - - - - - - - - - - - - - - - - -
+
+def queueSpeakerBackfill(kind, cursor=None):
+    params = {'kind': kind}
+    if cursor:
+        params['cursor'] = cursor
+    taskqueue.add(url=SPEAKER_BACKFILL_URL, params=params)
+
+
+def speakerBackfillStep(kind, cursor=None):
+    """Link one page of a session kind to Speakers; return the cursor to
+    continue from, or None when the kind is done.
+    """
+    if kind not in SPEAKER_BACKFILL_MODELS:
+        raise ValueError('unknown speaker backfill kind: %r' % kind)
+    model = SPEAKER_BACKFILL_MODELS[kind]
+    sessions, next_cursor, more = fetchPage(model.query(), BACKFILL_PAGE,
+                                            cursor)
+    keys = linkSpeakers([s.speaker for s in sessions])
+    changed = [s for s in sessions if s.speakerKey != keys[s.speaker]]
+    for sess in changed:
+        sess.speakerKey = keys[sess.speaker]
+    if changed:
+        putEntities(changed)
+        logging.info('linked %d %s entities to speakers', len(changed), kind)
+    if more and next_cursor:
+        return next_cursor
+    putEntity(SpeakerBackfill(id=kind))
+    memcache.set(_backfillKey(kind), True)
+    logging.info('speaker backfill of %s done', kind)
+    return None
+
+
+def _backfillKey(kind):
+    return 'SPEAKER_BACKFILL|%s' % kind
+
+
+def speakerBackfillDone(kind):
+    """Return whether the backfill linked every session of `kind`."""
+    if kind in _backfilled:
+        return True
+    done = memcache.get(_backfillKey(kind))
+    if done is None:
+        done = getEntity(ndb.Key(SpeakerBackfill, kind)) is not None
+        memcache.set(_backfillKey(kind), done,
+                     0 if done else BACKFILL_CHECK_SECONDS)
+    if done:
+        # a finished backfill stays finished: new sessions are linked
+        _backfilled.add(kind)
+    return done
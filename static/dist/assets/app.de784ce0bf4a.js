@@ -0,0 +1,792 @@
+'use strict';
+var app=angular.module('conferenceApp',
+['conferenceControllers','ngRoute','ui.bootstrap']).
+config(['$routeProvider',
+function($routeProvider){
+$routeProvider.
+when('/conference',{
+templateUrl:'/partials/show_conferences.html',
+controller:'ShowConferenceCtrl'
+}).
+when('/conference/create',{
+templateUrl:'/partials/create_conferences.html',
+controller:'CreateConferenceCtrl'
+}).
+when('/conference/detail/:websafeConferenceKey',{
+templateUrl:'/partials/conference_detail.html',
+controller:'ConferenceDetailCtrl'
+}).
+when('/profile',{
+templateUrl:'/partials/profile.html',
+controller:'MyProfileCtrl'
+}).
+when('/',{
+templateUrl:'/partials/home.html'
+}).
+otherwise({
+redirectTo:'/'
+});
+}]);
+app.filter('startFrom',function(){
+var filter=function(data,start){
+return data.slice(start);
+}
+return filter;
+});
+app.constant('HTTP_ERRORS',{
+'UNAUTHORIZED':401
+});
+app.factory('oauth2Provider',function($modal){
+var oauth2Provider={
+CLIENT_ID:'776302274474-6v07ju3km4c2l99t144q83np8ueur3nd.apps.googleusercontent.com',
+SCOPES:'email profile',
+signedIn:false
+}
+oauth2Provider.signIn=function(callback){
+gapi.auth.signIn({
+'clientid':oauth2Provider.CLIENT_ID,
+'cookiepolicy':'single_host_origin',
+'accesstype':'online',
+'approveprompt':'auto',
+'scope':oauth2Provider.SCOPES,
+'callback':callback
+});
+};
+oauth2Provider.signOut=function(){
+gapi.auth.signOut();
+gapi.auth.setToken({access_token:''})
+oauth2Provider.signedIn=false;
+};
+oauth2Provider.showLoginModal=function(){
+var modalInstance=$modal.open({
+templateUrl:'/partials/login.modal.html',
+controller:'OAuth2LoginModalCtrl'
+});
+return modalInstance;
+};
+return oauth2Provider;
+});
+app.factory('conferenceApi',function($timeout){
+var MAX_ENTRIES=100;
+var CACHE_POLICIES={
+getProfile:{fresh:300000,maxAge:3600000},
+getConference:{fresh:30000,maxAge:600000},
+queryConferences:{fresh:30000,maxAge:600000},
+getConferencesCreated:{fresh:60000,maxAge:600000},
+getConferencesToAttend:{fresh:60000,maxAge:600000},
+getSimilarConferences:{fresh:600000,maxAge:3600000}
+};
+var REGISTRATION_READS=['getConference','queryConferences','getConferencesToAttend','getProfile'];
+var INVALIDATES={
+registerForConference:REGISTRATION_READS,
+unregisterFromConference:REGISTRATION_READS,
+confirmSeatHold:REGISTRATION_READS,
+saveProfile:['getProfile'],
+createConference:['queryConferences','getConferencesCreated'],
+updateConference:['getConference','queryConferences','getConferencesCreated','getConferencesToAttend']
+};
+var entries={};
+var entryCount=0;
+var inFlight={};
+var generations={};
+var requestKey=function(method,params){
+return method+':'+angular.toJson(params||{});
+};
+var later=function(callback,resp){
+$timeout(function(){
+callback(angular.copy(resp));
+},0,false);
+};
+var touch=function(key,entry){
+if(entries.hasOwnProperty(key)){
+delete entries[key];
+entryCount--;
+}
+entries[key]=entry;
+entryCount++;
+for(var oldest in entries){
+if(entryCount<=MAX_ENTRIES){
+break;
+}
+delete entries[oldest];
+entryCount--;
+}
+};
+var fetch=function(method,params,key,callback){
+if(inFlight[key]){
+inFlight[key].push(callback);
+return;
+}
+inFlight[key]=[callback];
+var generation=generations[method]||0;
+gapi.client.conference[method](params).execute(function(resp){
+var callbacks=inFlight[key];
+delete inFlight[key];
+if(!resp.error&&CACHE_POLICIES[method]&&generation===(generations[method]||0)){
+touch(key,{method:method,resp:angular.copy(resp),time:new Date().getTime()});
+}
+angular.forEach(callbacks,function(cb){
+cb(angular.copy(resp));
+});
+});
+};
+var conferenceApi={};
+conferenceApi.execute=function(method,params,callback){
+params=params||{};
+var key=requestKey(method,params);
+var policy=CACHE_POLICIES[method];
+if(!policy){
+gapi.client.conference[method](params).execute(function(resp){
+if(!resp.error){
+conferenceApi.invalidate(INVALIDATES[method]||[]);
+}
+callback(resp);
+});
+return;
+}
+var entry=entries[key];
+var age=entry?new Date().getTime()-entry.time:Infinity;
+if(age<policy.fresh){
+touch(key,entry);
+later(callback,entry.resp);
+}else if(age<policy.maxAge){
+later(callback,entry.resp);
+fetch(method,params,key,function(resp){
+if(!resp.error&&!angular.equals(resp,entry.resp)){
+callback(resp);
+}
+});
+}else{
+fetch(method,params,key,callback);
+}
+};
+conferenceApi.invalidate=function(methods){
+angular.forEach(methods,function(method){
+generations[method]=(generations[method]||0)+1;
+});
+for(var key in entries){
+if(methods.indexOf(entries[key].method)>=0){
+delete entries[key];
+entryCount--;
+}
+}
+};
+conferenceApi.clear=function(){
+conferenceApi.invalidate(Object.keys(CACHE_POLICIES));
+};
+conferenceApi.debounce=function(fn,wait){
+var timer=null;
+return function(){
+var args=arguments;
+if(timer){
+$timeout.cancel(timer);
+}
+timer=$timeout(function(){
+timer=null;
+fn.apply(null,args);
+},wait);
+};
+};
+return conferenceApi;
+});
+;
+'use strict';
+var conferenceApp=conferenceApp||{};
+conferenceApp.controllers=angular.module('conferenceControllers',['ui.bootstrap']);
+conferenceApp.controllers.controller('MyProfileCtrl',
+function($scope,$log,oauth2Provider,conferenceApi,HTTP_ERRORS){
+$scope.submitted=false;
+$scope.loading=false;
+$scope.initialProfile={};
+$scope.teeShirtSizes=[
+{'size':'XS_M','text':"XS - Men's"},
+{'size':'XS_W','text':"XS - Women's"},
+{'size':'S_M','text':"S - Men's"},
+{'size':'S_W','text':"S - Women's"},
+{'size':'M_M','text':"M - Men's"},
+{'size':'M_W','text':"M - Women's"},
+{'size':'L_M','text':"L - Men's"},
+{'size':'L_W','text':"L - Women's"},
+{'size':'XL_M','text':"XL - Men's"},
+{'size':'XL_W','text':"XL - Women's"},
+{'size':'XXL_M','text':"XXL - Men's"},
+{'size':'XXL_W','text':"XXL - Women's"},
+{'size':'XXXL_M','text':"XXXL - Men's"},
+{'size':'XXXL_W','text':"XXXL - Women's"}
+];
+$scope.init=function(){
+var retrieveProfileCallback=function(){
+$scope.profile={};
+$scope.loading=true;
+conferenceApi.execute('getProfile',{},function(resp){
+$scope.$apply(function(){
+$scope.loading=false;
+if(resp.error){
+}else{
+$scope.profile.displayName=resp.result.displayName;
+$scope.profile.teeShirtSize=resp.result.teeShirtSize;
+$scope.initialProfile=resp.result;
+}
+});
+});
+};
+if(!oauth2Provider.signedIn){
+var modalInstance=oauth2Provider.showLoginModal();
+modalInstance.result.then(retrieveProfileCallback);
+}else{
+retrieveProfileCallback();
+}
+};
+$scope.saveProfile=function(){
+$scope.submitted=true;
+$scope.loading=true;
+conferenceApi.execute('saveProfile',$scope.profile,function(resp){
+$scope.$apply(function(){
+$scope.loading=false;
+if(resp.error){
+var errorMessage=resp.error.message||'';
+$scope.messages='Failed to update a profile : '+errorMessage;
+$scope.alertStatus='warning';
+$log.error($scope.messages+'Profile : '+JSON.stringify($scope.profile));
+if(resp.code&&resp.code==HTTP_ERRORS.UNAUTHORIZED){
+oauth2Provider.showLoginModal();
+return;
+}
+}else{
+$scope.messages='The profile has been updated';
+$scope.alertStatus='success';
+$scope.submitted=false;
+$scope.initialProfile={
+displayName:$scope.profile.displayName,
+teeShirtSize:$scope.profile.teeShirtSize
+};
+$log.info($scope.messages+JSON.stringify(resp.result));
+}
+});
+});
+};
+})
+;
+conferenceApp.controllers.controller('CreateConferenceCtrl',
+function($scope,$log,oauth2Provider,conferenceApi,HTTP_ERRORS){
+$scope.conference=$scope.conference||{};
+$scope.cities=[
+'Chicago',
+'London',
+'Paris',
+'San Francisco',
+'Tokyo'
+];
+$scope.topics=[
+'Medical Innovations',
+'Programming Languages',
+'Web Technologies',
+'Movie Making',
+'Health and Nutrition'
+];
+$scope.isValidMaxAttendees=function(){
+if(!$scope.conference.maxAttendees||$scope.conference.maxAttendees.length==0){
+return true;
+}
+return/^[\d]+$/.test($scope.conference.maxAttendees)&&$scope.conference.maxAttendees>=0;
+};
+$scope.isValidDates=function(){
+if(!$scope.conference.startDate&&!$scope.conference.endDate){
+return true;
+}
+if($scope.conference.startDate&&!$scope.conference.endDate){
+return true;
+}
+return $scope.conference.startDate<=$scope.conference.endDate;
+};
+$scope.isValidConference=function(conferenceForm){
+return!conferenceForm.$invalid&&
+$scope.isValidMaxAttendees()&&
+$scope.isValidDates();
+};
+$scope.createConference=function(conferenceForm){
+if(!$scope.isValidConference(conferenceForm)){
+return;
+}
+$scope.loading=true;
+conferenceApi.execute('createConference',$scope.conference,function(resp){
+$scope.$apply(function(){
+$scope.loading=false;
+if(resp.error){
+var errorMessage=resp.error.message||'';
+$scope.messages='Failed to create a conference : '+errorMessage;
+$scope.alertStatus='warning';
+$log.error($scope.messages+' Conference : '+JSON.stringify($scope.conference));
+if(resp.code&&resp.code==HTTP_ERRORS.UNAUTHORIZED){
+oauth2Provider.showLoginModal();
+return;
+}
+}else{
+$scope.messages='The conference has been created : '+resp.result.name;
+$scope.alertStatus='success';
+$scope.submitted=false;
+$scope.conference={};
+$log.info($scope.messages+' : '+JSON.stringify(resp.result));
+}
+});
+});
+};
+});
+conferenceApp.controllers.controller('ShowConferenceCtrl',function($scope,$log,oauth2Provider,conferenceApi,HTTP_ERRORS){
+$scope.submitted=false;
+$scope.selectedTab='ALL';
+$scope.filters=[
+];
+$scope.filtereableFields=[
+{enumValue:'CITY',displayName:'City'},
+{enumValue:'TOPIC',displayName:'Topic'},
+{enumValue:'MONTH',displayName:'Start month'},
+{enumValue:'MAX_ATTENDEES',displayName:'Max Attendees'}
+]
+$scope.operators=[
+{displayName:'=',enumValue:'EQ'},
+{displayName:'>',enumValue:'GT'},
+{displayName:'>=',enumValue:'GTEQ'},
+{displayName:'<',enumValue:'LT'},
+{displayName:'<=',enumValue:'LTEQ'},
+{displayName:'!=',enumValue:'NE'}
+];
+$scope.conferences=[];
+$scope.isOffcanvasEnabled=false;
+$scope.tabAllSelected=function(){
+$scope.selectedTab='ALL';
+$scope.queryConferences();
+};
+$scope.tabYouHaveCreatedSelected=function(){
+$scope.selectedTab='YOU_HAVE_CREATED';
+if(!oauth2Provider.signedIn){
+oauth2Provider.showLoginModal();
+return;
+}
+$scope.queryConferences();
+};
+$scope.tabYouWillAttendSelected=function(){
+$scope.selectedTab='YOU_WILL_ATTEND';
+if(!oauth2Provider.signedIn){
+oauth2Provider.showLoginModal();
+return;
+}
+$scope.queryConferences();
+};
+$scope.toggleOffcanvas=function(){
+$scope.isOffcanvasEnabled=!$scope.isOffcanvasEnabled;
+};
+$scope.pagination=$scope.pagination||{};
+$scope.pagination.currentPage=0;
+$scope.pagination.pageSize=20;
+$scope.pagination.numberOfPages=function(){
+return Math.ceil($scope.conferences.length/$scope.pagination.pageSize);
+};
+$scope.pagination.pageArray=function(){
+var pages=[];
+var numberOfPages=$scope.pagination.numberOfPages();
+for(var i=0;i<numberOfPages;i++){
+pages.push(i);
+}
+return pages;
+};
+$scope.pagination.isDisabled=function(event){
+return angular.element(event.target).hasClass('disabled');
+}
+$scope.addFilter=function(){
+$scope.filters.push({
+field:$scope.filtereableFields[0],
+operator:$scope.operators[0],
+value:''
+})
+};
+$scope.clearFilters=function(){
+$scope.filters=[];
+};
+$scope.removeFilter=function(index){
+if($scope.filters[index]){
+$scope.filters.splice(index,1);
+}
+};
+var FILTER_DEBOUNCE=400;
+var queryOnFilterChange=conferenceApi.debounce(function(){
+if($scope.selectedTab=='ALL'){
+$scope.queryConferencesAll();
+}
+},FILTER_DEBOUNCE);
+$scope.$watch('filters',function(newValue,oldValue){
+if(newValue!==oldValue){
+queryOnFilterChange();
+}
+},true);
+$scope.queryConferences=function(){
+$scope.submitted=false;
+if($scope.selectedTab=='ALL'){
+$scope.queryConferencesAll();
+}else if($scope.selectedTab=='YOU_HAVE_CREATED'){
+$scope.getConferencesCreated();
+}else if($scope.selectedTab=='YOU_WILL_ATTEND'){
+$scope.getConferencesAttend();
+}
+};
+$scope.queryConferencesAll=function(){
+var sendFilters={
+filters:[]
+}
+for(var i=0;i<$scope.filters.length;i++){
+var filter=$scope.filters[i];
+if(filter.field&&filter.operator&&filter.value){
+sendFilters.filters.push({
+field:filter.field.enumValue,
+operator:filter.operator.enumValue,
+value:filter.value
+});
+}
+}
+$scope.loading=true;
+conferenceApi.execute('queryConferences',sendFilters,function(resp){
+$scope.$apply(function(){
+$scope.loading=false;
+if(resp.error){
+var errorMessage=resp.error.message||'';
+$scope.messages='Failed to query conferences : '+errorMessage;
+$scope.alertStatus='warning';
+$log.error($scope.messages+' filters : '+JSON.stringify(sendFilters));
+}else{
+$scope.submitted=false;
+$scope.messages='Query succeeded : '+JSON.stringify(sendFilters);
+$scope.alertStatus='success';
+$log.info($scope.messages);
+$scope.conferences=[];
+angular.forEach(resp.items,function(conference){
+$scope.conferences.push(conference);
+});
+}
+$scope.submitted=true;
+});
+});
+}
+$scope.getConferencesCreated=function(){
+$scope.loading=true;
+conferenceApi.execute('getConferencesCreated',{},function(resp){
+$scope.$apply(function(){
+$scope.loading=false;
+if(resp.error){
+var errorMessage=resp.error.message||'';
+$scope.messages='Failed to query the conferences created : '+errorMessage;
+$scope.alertStatus='warning';
+$log.error($scope.messages);
+if(resp.code&&resp.code==HTTP_ERRORS.UNAUTHORIZED){
+oauth2Provider.showLoginModal();
+return;
+}
+}else{
+$scope.submitted=false;
+$scope.messages='Query succeeded : Conferences you have created';
+$scope.alertStatus='success';
+$log.info($scope.messages);
+$scope.conferences=[];
+angular.forEach(resp.items,function(conference){
+$scope.conferences.push(conference);
+});
+}
+$scope.submitted=true;
+});
+});
+};
+$scope.getConferencesAttend=function(){
+$scope.loading=true;
+conferenceApi.execute('getConferencesToAttend',{},function(resp){
+$scope.$apply(function(){
+if(resp.error){
+var errorMessage=resp.error.message||'';
+$scope.messages='Failed to query the conferences to attend : '+errorMessage;
+$scope.alertStatus='warning';
+$log.error($scope.messages);
+if(resp.code&&resp.code==HTTP_ERRORS.UNAUTHORIZED){
+oauth2Provider.showLoginModal();
+return;
+}
+}else{
+$scope.conferences=resp.result.items;
+$scope.loading=false;
+$scope.messages='Query succeeded : Conferences you will attend (or you have attended)';
+$scope.alertStatus='success';
+$log.info($scope.messages);
+}
+$scope.submitted=true;
+});
+});
+};
+});
+conferenceApp.controllers.controller('ConferenceDetailCtrl',function($scope,$log,$routeParams,$timeout,conferenceApi,HTTP_ERRORS){
+$scope.conference={};
+var WATCH_MIN_DELAY=1000;
+var WATCH_IDLE_MAX_DELAY=15000;
+var WATCH_MAX_DELAY=60000;
+var seatVersion=0;
+var watchDelay=0;
+var idleDelay=0;
+var watchTimer=null;
+var watching=false;
+$scope.similarConferences=[];
+$scope.isUserAttending=false;
+$scope.init=function(){
+$scope.loading=true;
+conferenceApi.execute('getConference',{
+websafeConferenceKey:$routeParams.websafeConferenceKey
+},function(resp){
+$scope.$apply(function(){
+$scope.loading=false;
+if(resp.error){
+var errorMessage=resp.error.message||'';
+$scope.messages='Failed to get the conference : '+$routeParams.websafeKey
++' '+errorMessage;
+$scope.alertStatus='warning';
+$log.error($scope.messages);
+}else{
+$scope.alertStatus='success';
+$scope.conference=resp.result;
+startWatchingSeats();
+}
+});
+});
+$scope.loading=true;
+conferenceApi.execute('getProfile',{},function(resp){
+$scope.$apply(function(){
+$scope.loading=false;
+if(resp.error){
+}else{
+var profile=resp.result;
+for(var i=0;i<profile.conferenceKeysToAttend.length;i++){
+if($routeParams.websafeConferenceKey==profile.conferenceKeysToAttend[i]){
+$scope.alertStatus='info';
+$scope.messages='You are attending this conference';
+$scope.isUserAttending=true;
+}
+}
+}
+});
+});
+conferenceApi.execute('getSimilarConferences',{
+websafeConferenceKey:$routeParams.websafeConferenceKey
+},function(resp){
+$scope.$apply(function(){
+if(resp.error){
+$log.error('Failed to get similar conferences: '+(resp.error.message||''));
+}else{
+$scope.similarConferences=resp.result.items||[];
+}
+});
+});
+};
+var watchSeats=function(){
+watchTimer=null;
+conferenceApi.execute('watchSeats',{
+items:[{websafeConferenceKey:$routeParams.websafeConferenceKey,version:seatVersion}]
+},function(resp){
+if(!watching){
+return;
+}
+var delay=0;
+if(resp.error){
+watchDelay=Math.min(WATCH_MAX_DELAY,Math.max(WATCH_MIN_DELAY,watchDelay*2));
+delay=watchDelay/2+Math.random()*watchDelay/2;
+$log.error('Failed to watch seats: '+(resp.error.message||''));
+}else{
+watchDelay=0;
+var items=resp.result.items||[];
+if(items.length){
+idleDelay=0;
+delay=WATCH_MIN_DELAY;
+}else{
+idleDelay=Math.min(WATCH_IDLE_MAX_DELAY,Math.max(WATCH_MIN_DELAY,idleDelay*2));
+delay=idleDelay;
+}
+$scope.$apply(function(){
+angular.forEach(items,function(item){
+seatVersion=item.version;
+if(item.seatsAvailable!==undefined){
+$scope.conference.seatsAvailable=item.seatsAvailable;
+}
+});
+});
+}
+watchTimer=$timeout(watchSeats,delay,false);
+});
+};
+var startWatchingSeats=function(){
+if(!watching){
+watching=true;
+watchSeats();
+}
+};
+$scope.$on('$destroy',function(){
+watching=false;
+if(watchTimer){
+$timeout.cancel(watchTimer);
+}
+});
+$scope.registerForConference=function(){
+$scope.loading=true;
+conferenceApi.execute('registerForConference',{
+websafeConferenceKey:$routeParams.websafeConferenceKey
+},function(resp){
+$scope.$apply(function(){
+$scope.loading=false;
+if(resp.error){
+var errorMessage=resp.error.message||'';
+$scope.messages='Failed to register for the conference : '+errorMessage;
+$scope.alertStatus='warning';
+$log.error($scope.messages);
+if(resp.code&&resp.code==HTTP_ERRORS.UNAUTHORIZED){
+oauth2Provider.showLoginModal();
+return;
+}
+}else{
+if(resp.result){
+$scope.messages='Registered for the conference';
+$scope.alertStatus='success';
+$scope.isUserAttending=true;
+$scope.conference.seatsAvailable=$scope.conference.seatsAvailable-1;
+}else{
+$scope.messages='Failed to register for the conference';
+$scope.alertStatus='warning';
+}
+}
+});
+});
+};
+$scope.unregisterFromConference=function(){
+$scope.loading=true;
+conferenceApi.execute('unregisterFromConference',{
+websafeConferenceKey:$routeParams.websafeConferenceKey
+},function(resp){
+$scope.$apply(function(){
+$scope.loading=false;
+if(resp.error){
+var errorMessage=resp.error.message||'';
+$scope.messages='Failed to unregister from the conference : '+errorMessage;
+$scope.alertStatus='warning';
+$log.error($scope.messages);
+if(resp.code&&resp.code==HTTP_ERRORS.UNAUTHORIZED){
+oauth2Provider.showLoginModal();
+return;
+}
+}else{
+if(resp.result){
+$scope.messages='Unregistered from the conference';
+$scope.alertStatus='success';
+$scope.conference.seatsAvailable=$scope.conference.seatsAvailable+1;
+$scope.isUserAttending=false;
+$log.info($scope.messages);
+}else{
+var errorMessage=resp.error.message||'';
+$scope.messages='Failed to unregister from the conference : '+$routeParams.websafeKey+
+' : '+errorMessage;
+$scope.messages='Failed to unregister from the conference';
+$scope.alertStatus='warning';
+$log.error($scope.messages);
+}
+}
+});
+});
+};
+});
+conferenceApp.controllers.controller('RootCtrl',function($scope,$location,oauth2Provider,conferenceApi){
+$scope.isActive=function(viewLocation){
+return viewLocation===$location.path();
+};
+$scope.getSignedInState=function(){
+return oauth2Provider.signedIn;
+};
+$scope.signIn=function(){
+oauth2Provider.signIn(function(){
+gapi.client.oauth2.userinfo.get().execute(function(resp){
+$scope.$apply(function(){
+if(resp.email){
+oauth2Provider.signedIn=true;
+$scope.alertStatus='success';
+$scope.rootMessages='Logged in with '+resp.email;
+}
+});
+});
+});
+};
+$scope.initSignInButton=function(){
+gapi.signin.render('signInButton',{
+'callback':function(){
+jQuery('#signInButton button').attr('disabled','true').css('cursor','default');
+if(gapi.auth.getToken()&&gapi.auth.getToken().access_token){
+$scope.$apply(function(){
+oauth2Provider.signedIn=true;
+});
+}
+},
+'clientid':oauth2Provider.CLIENT_ID,
+'cookiepolicy':'single_host_origin',
+'scope':oauth2Provider.SCOPES
+});
+};
+$scope.signOut=function(){
+oauth2Provider.signOut();
+conferenceApi.clear();
+$scope.alertStatus='success';
+$scope.rootMessages='Logged out';
+};
+$scope.collapseNavbar=function(){
+angular.element(document.querySelector('.navbar-collapse')).removeClass('in');
+};
+});
+conferenceApp.controllers.controller('OAuth2LoginModalCtrl',
+function($scope,$modalInstance,$rootScope,oauth2Provider){
+$scope.singInViaModal=function(){
+oauth2Provider.signIn(function(){
+gapi.client.oauth2.userinfo.get().execute(function(resp){
+$scope.$root.$apply(function(){
+oauth2Provider.signedIn=true;
+$scope.$root.alertStatus='success';
+$scope.$root.rootMessages='Logged in with '+resp.email;
+});
+$modalInstance.close();
+});
+});
+};
+});
+conferenceApp.controllers.controller('DatepickerCtrl',function($scope){
+$scope.today=function(){
+$scope.dt=new Date();
+};
+$scope.today();
+$scope.clear=function(){
+$scope.dt=null;
+};
+$scope.disabled=function(date,mode){
+return(mode==='day'&&(date.getDay()===0||date.getDay()===6));
+};
+$scope.toggleMin=function(){
+$scope.minDate=($scope.minDate)?null:new Date();
+};
+$scope.toggleMin();
+$scope.open=function($event){
+$event.preventDefault();
+$event.stopPropagation();
+$scope.opened=true;
+};
+$scope.dateOptions={
+'year-format':"'yy'",
+'starting-day':1
+};
+$scope.formats=['dd-MMMM-yyyy','yyyy/MM/dd','shortDate'];
+$scope.format=$scope.formats[0];
+});
+;
+angular.module('conferenceApp').run(['$templateCache',function($templateCache){
+$templateCache.put("/partials/conference_detail.html","<div ng-controller=\"ConferenceDetailCtrl\">\n    <div class=\"row\">\n        <div class=\"col-lg-12\">\n            <div id=\"messages\" class=\"alert alert-{{alertStatus}}\" ng-show=\"messages\">\n                <span ng-bind=\"messages\"><\/span>\n                <i class=\"dismiss-messages pull-right glyphicon glyphicon-remove\" ng-click=\"messages = ''\"\n                   ng-show=\"messages\"><\/i>\n            <\/div>\n            <img class=\"spinner\" src=\"/img/ajax-loader.gif\" ng-show=\"loading\"/>\n        <\/div>\n    <\/div>\n\n    <div class=\"row\" ng-init=\"init()\">\n        <div class=\"col-md-9\">\n            <div class=\"well well-sm\">\n                <h2>{{conference.name}}<\/h2>\n                <h5>{{conference.description}}<\/h5>\n                <div>\n                    <label for=\"registered\">Registered/Open: <\/label>\n                    <span id=\"registered\">{{conference.maxAttendees - conference.seatsAvailable}} / {{conference.maxAttendees}}<\/span>\n                <\/div>\n                <div>\n                    <label for=\"organizer\">Organizer: <\/label>\n                    <span id=\"organizer\">{{conference.organizerDisplayName}}<\/span>\n                <\/div>\n                <p><a class=\"btn btn-primary\" ng-hide=\"isUserAttending\" ng-click=\"registerForConference()\"\n                        ng-disabled=\"loading\">Register<\/a><\/p>\n                <p><a class=\"btn btn-primary\" ng-show=\"isUserAttending\" ng-click=\"unregisterFromConference()\"\n                        ng-disabled=\"loading\">Unregister<\/a><\/p>\n            <\/div>\n\n            <form class=\"form\" novalidate role=\"form\">\n                <fieldset>\n                    <div>\n                        <label for=\"city\">City: <\/label>\n                        <span id=\"city\">{{conference.city}}<\/span>\n                    <\/div>\n                    <div>\n                        <label for=\"topics\">Topics: <\/label>\n                        <span id=\"topics\">\n                            <span ng-repeat=\"topic in conference.topics\" class=\"label label-primary label-separated\">{{topic}}<\/span>\n                        <\/span>\n                    <\/div>\n                    <div>\n                        <label for=\"startDate\">Start Date: <\/label>\n                        <span id=\"startDate\">{{conference.startDate | date:'dd-MMMM-yyyy'}}<\/span>\n                    <\/div>\n                    <div>\n                        <label for=\"endDate\">End Date: <\/label>\n                        <span id=\"endDate\">{{conference.endDate | date:'dd-MMMM-yyyy'}}<\/span>\n                    <\/div>\n                <\/fieldset>\n            <\/form>\n        <\/div>\n        <div class=\"col-md-3\" ng-show=\"similarConferences.length > 0\">\n            <h4>You might also like<\/h4>\n            <ul class=\"list-unstyled\">\n                <li ng-repeat=\"similar in similarConferences\">\n                    <a href=\"#/conference/detail/{{similar.websafeKey}}\">{{similar.name}}<\/a>\n                    <br/><small>{{similar.city}} &middot; {{similar.startDate | date:'dd-MMMM-yyyy'}}<\/small>\n                <\/li>\n            <\/ul>\n        <\/div>\n    <\/div>\n<\/div>\n");
+$templateCache.put("/partials/create_conferences.html","<div ng-controller=\"CreateConferenceCtrl\">\n    <div class=\"row\">\n        <div class=\"col-lg-12\">\n            <div id=\"messages\" class=\"alert alert-{{alertStatus}}\" ng-show=\"messages\">\n                <span ng-bind=\"messages\"><\/span>\n                <i class=\"dismiss-messages pull-right glyphicon glyphicon-remove\" ng-click=\"messages = ''\"\n                   ng-show=\"messages\"><\/i>\n            <\/div>\n            <img class=\"spinner\" src=\"/img/ajax-loader.gif\" ng-show=\"loading\"/>\n        <\/div>\n    <\/div>\n    <div class=\"row\">\n        <div class=\"col-md-8\">\n            <h3>Create a conference<\/h3>\n\n            <form name=\"conferenceForm\" novalidate role=\"form\">\n                <div class=\"form-group\">\n                    <label for=\"name\">Name <span class=\"required\">*<\/span><\/label>\n                    <span class=\"label label-danger\"\n                        ng-show=\"conferenceForm.name.$error.required\">Required!<\/span>\n                    <input id=\"name\" type=\"text\" name=\"name\" ng-model=\"conference.name\" class=\"form-control\"\n                           ng-required=\"true\"/>\n                <\/div>\n\n                <div class=\"form-group\">\n                    <label for=\"city\">City<\/label>\n                    <select id=\"city\" ng-model=\"conference.city\" name=\"city\" ng-options=\"city for city in cities\"\n                            class=\"form-control\">\n                    <\/select>\n                <\/div>\n\n                <div class=\"form-group\">\n                    <label for=\"description\">Description<\/label>\n                    <textarea id=\"description\" type=\"text\" name=\"description\" ng-model=\"conference.description\"\n                              class=\"form-control\"><\/textarea>\n                <\/div>\n\n                <div class=\"form-group\">\n                    <label for=\"topics\">Topics<\/label>\n                    <select id=\"topics\" ng-model=\"conference.topics\" name=\"topics\"\n                            ng-options=\"topic for topic in topics\"\n                            class=\"form-control\" multiple>\n                    <\/select>\n                <\/div>\n\n                <div class=\"form-group\" ng-controller=\"DatepickerCtrl\">\n                    <label for=\"startDate\">Start Date<\/label>\n                    <p class=\"input-group\">\n                        <input id=\"startDate\" type=\"text\" class=\"form-control\" datepicker-popup=\"{{format}}\"\n                               ng-model=\"conference.startDate\" is-open=\"opened\"\n                               datepicker-options=\"dateOptions\"\n                               close-text=\"Close\"/>\n                    <span class=\"input-group-btn\">\n                        <button class=\"btn btn-default\" ng-click=\"open($event)\"><i\n                                class=\"glyphicon glyphicon-calendar\"><\/i>\n                        <\/button>\n                    <\/span>\n                    <\/p>\n                <\/div>\n\n                <div class=\"form-group\" ng-controller=\"DatepickerCtrl\">\n                    <label for=\"endDate\">End Date<\/label>\n                    <span class=\"label label-danger\"\n                        ng-show=\"!isValidDates()\">End Date must be later or equal to Start Date!<\/span>\n                    <p class=\"input-group\">\n                        <input id=\"endDate\" type=\"text\" class=\"form-control\" datepicker-popup=\"{{format}}\"\n                               ng-model=\"conference.endDate\" is-open=\"opened\"\n                               datepicker-options=\"dateOptions\"\n                               close-text=\"Close\"/>\n                    <span class=\"input-group-btn\">\n                        <button class=\"btn btn-default\" ng-click=\"open($event)\"><i\n                                class=\"glyphicon glyphicon-calendar\"><\/i>\n                        <\/button>\n                    <\/span>\n                    <\/p>\n                <\/div>\n\n                <div class=\"form-group\">\n                    <label for=\"maxAttendees\">Max Attendees<\/label>\n                    <span class=\"label label-danger\"\n                        ng-show=\"!isValidMaxAttendees()\">Must be an integer!<\/span>\n                    <!-- The input type is text as the conference.maxAttendees will be undefined,\n                    hence isValidMaxAttendees will be true when input type is number -->\n                    <input id=\"maxAttendees\" type=\"text\" name=\"maxAttendees\" ng-model=\"conference.maxAttendees\"\n                           class=\"form-control\"/>\n                <\/div>\n\n                <button ng-click=\"createConference(conferenceForm)\" class=\"btn btn-primary\"\n                        ng-disabled=\"!isValidConference(conferenceForm) || loading\">Create\n                <\/button>\n            <\/form>\n        <\/div>\n    <\/div>\n<\/div>");
+$templateCache.put("/partials/home.html","<div class=\"intro-header\">\n    <div class=\"row\">\n        <div class=\"col-lg-12\">\n            <div class=\"intro-message\">\n                <h1>Welcome to Conference Central<\/h1>\n\n                <h3>Lets you manage conferences<\/h3>\n                <hr class=\"intro-divider\">\n                <ul class=\"list-inline intro-social-buttons\">\n                    <li id=\"signInLink\" ng-hide=\"getSignedInState()\" on-click=\"return false\">\n                        <a class=\"btn btn-default btn-lg\" ng-click=\"signIn()\">Google+ SignIn<\/a>\n                    <\/li>\n                    <li id=\"signOutLink\" ng-show=\"getSignedInState()\" on-click=\"return false\">\n                        <a class=\"btn btn-default btn-lg\" ng-click=\"signOut()\">Log out<\/a>\n                    <\/li>\n                <\/ul>\n            <\/div>\n        <\/div>\n    <\/div>\n<\/div>\n<div class=\"section-a\">\n    <div class=\"row\">\n        <div class=\"col-lg-5 col-sm-6\">\n            <hr>\n            <div class=\"clearfix\"><\/div>\n            <h2>View conferences<\/h2>\n\n            <p class=\"lead\">View by city, topics, date, max attendees.<\/p>\n            <a href=\"#/conference\" class=\"btn btn-default btn-lg\">View conferences<\/a>\n        <\/div>\n        <div class=\"col-lg-5 col-lg-offset-2 col-sm-6\">\n            <img class=\"img-responsive\" src=\"/img/business1.jpg\" alt=\"\">\n        <\/div>\n    <\/div>\n<\/div>\n\n<div class=\"section-a\">\n    <div class=\"row\">\n        <div class=\"col-lg-5 col-lg-offset-1 col-sm-push-6  col-sm-6\">\n            <hr class=\"section-heading-spacer\">\n            <div class=\"clearfix\"><\/div>\n            <h2 class=\"section-heading\">Create new conferences<\/h2>\n\n            <p class=\"lead\">In 10 seconds or less.<\/p>\n            <a href=\"#/conference/create\" class=\"btn btn-default btn-lg\">Create a conference<\/a>\n        <\/div>\n        <div class=\"col-lg-5 col-sm-pull-6  col-sm-6\">\n            <img class=\"img-responsive\" src=\"/img/business2.jpg\" alt=\"\">\n        <\/div>\n    <\/div>\n<\/div>\n\n<div class=\"section-a\">\n    <div class=\"row\">\n        <div class=\"col-lg-5 col-sm-6\">\n            <hr>\n            <div class=\"clearfix\"><\/div>\n            <h2 class=\"section-heading\">Update your profile<\/h2>\n            <a href=\"#/profile\" class=\"btn btn-default btn-lg\">View my profile<\/a>\n        <\/div>\n        <div class=\"col-lg-5 col-lg-offset-2 col-sm-6\">\n            <img class=\"img-responsive\" src=\"/img/business3.jpg\" alt=\"\">\n        <\/div>\n    <\/div>\n<\/div>\n");
+$templateCache.put("/partials/login.modal.html","<div>\n    <div class=\"alert alert-warning\">\n        <h3>Please sign in to complete this action.<\/h3>\n    <\/div>\n    <div class=\"modal-footer\">\n        <button class=\"btn btn-primary pull-left\" ng-click=\"singInViaModal()\">Google+ SignIn<\/button>\n    <\/div>\n<\/div>");
+$templateCache.put("/partials/profile.html","<div ng-controller=\"MyProfileCtrl\" ng-init=\"init()\">\n    <div class=\"row\">\n        <div class=\"col-lg-12\">\n            <div id=\"messages\" class=\"alert alert-{{alertStatus}}\" ng-show=\"messages\">\n                <span ng-bind=\"messages\"><\/span>\n                <i class=\"dismiss-messages pull-right glyphicon glyphicon-remove\" ng-click=\"messages = ''\"\n                   ng-show=\"messages\"><\/i>\n            <\/div>\n            <img class=\"spinner\" src=\"/img/ajax-loader.gif\" ng-show=\"loading\"/>\n        <\/div>\n    <\/div>\n    <div class=\"row\">\n        <div class=\"col-md-8\">\n            <h3>My Profile<\/h3>\n            <form name=\"profileForm\" novalidate role=\"form\">\n                <div class=\"form-group\" ng-class=\"{'has-warning': profile.displayName != initialProfile.displayName}\">\n                    <label for=\"displayName\">Display Name <\/label>\n                    <span class=\"label label-warning\"\n                          ng-show=\"profile.displayName != initialProfile.displayName\"> Changed<\/span>\n                    <input id=\"displayName\" type=\"text\" name=\"displayName\" ng-model=\"profile.displayName\"\n                           class=\"form-control\"/>\n                <\/div>\n\n                <div class=\"form-group\" ng-class=\"{'has-warning': profile.teeShirtSize != initialProfile.teeShirtSize}\">\n                    <label for=\"teeShirtSize\">Tee shirt size<\/label>\n                    <span class=\"label label-warning\"\n                          ng-show=\"profile.teeShirtSize != initialProfile.teeShirtSize\"> Changed<\/span>\n                    <select id=\"teeShirtSize\" ng-model=\"profile.teeShirtSize\" name=\"teeShirtSize\" ng-options=\"\nshirt.size as shirt.text for shirt in teeShirtSizes\"\n                            class=\"form-control\">\n                    <\/select>\n                <\/div>\n\n                <button ng-click=\"saveProfile(profileForm)\" class=\"btn btn-primary\"\n                        ng-disabled=\"loading\">Update profile\n                <\/button>\n            <\/form>\n        <\/div>\n    <\/div>\n<\/div>");
+$templateCache.put("/partials/show_conferences.html","<div ng-controller=\"ShowConferenceCtrl\">\n    <div class=\"row\">\n        <div class=\"col-lg-12\">\n            <div id=\"messages\" class=\"alert alert-{{alertStatus}}\" ng-show=\"messages\">\n                <span ng-bind=\"messages\"><\/span>\n                <i class=\"dismiss-messages pull-right glyphicon glyphicon-remove\" ng-click=\"messages = ''\"\n                   ng-show=\"messages\"><\/i>\n            <\/div>\n            <img class=\"spinner\" src=\"/img/ajax-loader.gif\" ng-show=\"loading\"/>\n        <\/div>\n    <\/div>\n\n    <div class=\"row\">\n        <div class=\"col-lg-12\">\n            <h3>Show conferences<\/h3>\n        <\/div>\n    <\/div>\n\n    <tabset id=\"show-conferences-tab\" justified=\"true\">\n        <tab select=\"tabAllSelected()\" heading=\"All\"><\/tab>\n        <tab select=\"tabYouHaveCreatedSelected()\" heading=\"You've created\"><\/tab>\n        <tab select=\"tabYouWillAttendSelected()\" heading=\"You'll attend (You've attended)\"><\/tab>\n    <\/tabset>\n\n    <div class=\"row row-offcanvas row-offcanvas-right\" ng-class=\"{active: isOffcanvasEnabled}\">\n        <div class=\"col-xs-12 col-sm-8\">\n\n            <button ng-click=\"queryConferences();\" class=\"btn btn-primary pull-right\">\n                <i class=\"glyphicon glyphicon-search\"><\/i> Search\n            <\/button>\n\n            <p class=\"pull-right visible-xs\">\n                <button ng-hide=\"selectedTab != 'ALL'\" type=\"button\" class=\"btn btn-primary btn-sm\" data-toggle=\"offcanvas\"\n                        ng-click=\"isOffcanvasEnabled = !isOffcanvasEnabled\">\n                    <i class=\"glyphicon glyphicon-chevron-left\" ng-show=\"isOffcanvasEnabled\"><\/i>\n                    <span ng-show=\"isOffcanvasEnabled\">Hide<\/span>\n                    <span ng-hide=\"isOffcanvasEnabled\">Show<\/span>\n                    filters\n                    <i class=\"glyphicon glyphicon-chevron-right\" ng-hide=\"isOffcanvasEnabled\"><\/i>\n                <\/button>\n            <\/p>\n\n            <div ng-show=\"submitted && conferences.length == 0\">\n                <h4>No matching results.<\/h4>\n            <\/div>\n            <div class=\"table-responsive\" ng-show=\"conferences.length > 0\">\n                <table id=\"conference-table\" class=\"table table-striped table-hover\">\n                    <thead>\n                    <tr>\n                        <th>Details<\/th>\n                        <th>Name<\/th>\n                        <th>City<\/th>\n                        <th>Start Date<\/th>\n                        <th>Organizer<\/th>\n                        <th>Registered/Open<\/th>\n                    <\/tr>\n                    <\/thead>\n                    <tbody>\n                    <tr ng-repeat=\"conference in conferences | startFrom: pagination.currentPage * pagination.pageSize | limitTo: pagination.pageSize\">\n                        <td><a href=\"#/conference/detail/{{conference.websafeKey}}\">Details<\/a><\/td>\n                        <td>{{conference.name}}<\/td>\n                        <td>{{conference.city}}<\/td>\n                        <td>{{conference.startDate | date:'dd-MMMM-yyyy'}}<\/td>\n                        <td>{{conference.organizerDisplayName}}<\/td>\n                        <td>{{conference.maxAttendees - conference.seatsAvailable}} / {{conference.maxAttendees}}<\/td>\n                    <\/tr>\n                    <\/tbody>\n                <\/table>\n            <\/div>\n\n            <ul class=\"pagination\" ng-show=\"conferences.length > 0\">\n                <li ng-class=\"{disabled: pagination.currentPage == 0 }\">\n                    <a ng-class=\"{disabled: pagination.currentPage == 0 }\"\n                       ng-click=\"pagination.isDisabled($event) || (pagination.currentPage = 0)\">&lt&lt<\/a>\n                <\/li>\n                <li ng-class=\"{disabled: pagination.currentPage == 0 }\">\n                    <a ng-class=\"{disabled: pagination.currentPage == 0 }\"\n                       ng-click=\"pagination.isDisabled($event) || (pagination.currentPage = pagination.currentPage - 1)\">&lt<\/a>\n                <\/li>\n\n                <!-- ng-repeat creates a new scope. Need to specify the pagination.currentPage as $parent.pagination.currentPage -->\n                <li ng-repeat=\"page in pagination.pageArray()\" ng-class=\"{active: $parent.pagination.currentPage == page}\">\n                    <a ng-click=\"$parent.pagination.currentPage = page\">{{page + 1}}<\/a>\n                <\/li>\n\n                <li ng-class=\"{disabled: pagination.currentPage == pagination.numberOfPages() - 1}\">\n                    <a ng-class=\"{disabled: pagination.currentPage == pagination.numberOfPages() - 1}\"\n                       ng-click=\"pagination.isDisabled($event) || (pagination.currentPage = pagination.currentPage + 1)\">&gt<\/a>\n                <\/li>\n                <li ng-class=\"{disabled: pagination.currentPage == pagination.numberOfPages() - 1}\">\n                    <a ng-class=\"{disabled: pagination.currentPage == pagination.numberOfPages() - 1}\"\n                       ng-click=\"pagination.isDisabled($event) || (pagination.currentPage = pagination.numberOfPages() - 1)\">&gt&gt<\/a>\n                <\/li>\n            <\/ul>\n        <\/div>\n\n        <div ng-hide=\"selectedTab != 'ALL'\" class=\"col-xs-6 col-sm-4 sidebar-offcanvas\" id=\"sidebar\" role=\"navigation\">\n            <button ng-click=\"addFilter()\" class=\"btn btn-primary\">\n                <i class=\"glyphicon glyphicon-plus\"><\/i> Filter\n            <\/button>\n            <button ng-click=\"clearFilters()\" class=\"btn btn-primary\" ng-disabled=\"filters.length == 0\">Clear<\/button>\n\n            <ul id=\"filters\" ng-repeat=\"filter in filters\">\n                <li>\n                    <form class=\"form-horizontal\" name=\"filterForm-$index\" novalidate role=\"form\">\n                        <div class=\"form-group-condensed\">\n                            <label class=\"form-control-static\">Field: <\/label>\n                            <select class=\"form-control-sm\" ng-model=\"filters[$index].field\"\n                                    ng-options=\"field.displayName for field in filtereableFields\">\n                            <\/select>\n                        <\/div>\n                        <div class=\"form-group-condensed\">\n                            <label class=\"form-control-static\">Operator: <\/label>\n                            <select class=\"form-control-sm\" ng-model=\"filters[$index].operator\"\n                                    ng-options=\"operator.displayName for operator in operators\">\n                            <\/select>\n                        <\/div>\n                        <div class=\"form-roup-condensed\" ng-class=\"{'has-error': filters[$index].value.length == 0}\">\n                            <label class=\"form-control-static\">Value: <\/label>\n                            <input type=\"text\" class=\"form-control-sm\" name=\"value\" ng-model=\"filters[$index].value\"\n                                   ng-required=\"true\">\n                            <span class=\"label label-danger\"\n                                  ng-show=\"filters[$index].value.length == 0\">Required<\/span>\n                        <\/div>\n                        <div class=\"form-group-condensed\">\n                            <button class=\"btn btn-danger btn-xs\" ng-click=\"removeFilter($index)\"><i\n                                    class=\"glyphicon glyphicon-remove\"><\/i><\/button>\n                        <\/div>\n                    <\/form>\n                <\/li>\n            <\/ul>\n        <\/div>\n\n    <\/div>\n<\/div>\n");
+}]);
+;
@@ -130,3 +130,189 @@ app.factory('oauth2Provider', function ($modal) {
 
     return oauth2Provider;
 });
+
+
+/**
+ * @ngdoc service
+ * @name conferenceApi
+ *
+ * @description
+ * Service that wraps the gapi conference client for all the pages.
+ * Reads listed in CACHE_POLICIES are kept in an in-memory LRU cache: a response younger than
+ * fresh ms is served as is, an older one up to maxAge ms is served at once and revalidated in the
+ * background (stale-while-revalidate), and the callback runs again if the revalidated response
+ * differs. Identical reads in flight at the same time share one request. Mutations drop the
+ * cached reads listed in INVALIDATES once they succeed.
+ * Callbacks always run asynchronously, outside the digest, like gapi callbacks do, and each gets
+ * its own copy of a response, so a page changing it leaves the cache intact.
+ */
+app.factory('conferenceApi', function ($timeout) {
+    var MAX_ENTRIES = 100;
+
+    var CACHE_POLICIES = {
+        getProfile: {fresh: 300000, maxAge: 3600000},
+        getConference: {fresh: 30000, maxAge: 600000},
+        queryConferences: {fresh: 30000, maxAge: 600000},
+        getConferencesCreated: {fresh: 60000, maxAge: 600000},
+        getConferencesToAttend: {fresh: 60000, maxAge: 600000},
+        getSimilarConferences: {fresh: 600000, maxAge: 3600000}
+    };
+
+    var REGISTRATION_READS = ['getConference', 'queryConferences', 'getConferencesToAttend', 'getProfile'];
+    var INVALIDATES = {
+        registerForConference: REGISTRATION_READS,
+        unregisterFromConference: REGISTRATION_READS,
+        confirmSeatHold: REGISTRATION_READS,
+        saveProfile: ['getProfile'],
+        createConference: ['queryConferences', 'getConferencesCreated'],
+        updateConference: ['getConference', 'queryConferences', 'getConferencesCreated', 'getConferencesToAttend']
+    };
+
+    /**
+     * Cached responses by request key, least recently used first (object keys keep insertion order).
+     */
+    var entries = {};
+    var entryCount = 0;
+
+    /**
+     * Callbacks waiting for a read in flight, by request key.
+     */
+    var inFlight = {};
+
+    /**
+     * Bumped by every invalidation of a method, so a read that started before it is not cached.
+     */
+    var generations = {};
+
+    var requestKey = function (method, params) {
+        return method + ':' + angular.toJson(params || {});
+    };
+
+    var later = function (callback, resp) {
+        $timeout(function () {
+            callback(angular.copy(resp));
+        }, 0, false);
+    };
+
+    var touch = function (key, entry) {
+        if (entries.hasOwnProperty(key)) {
+            delete entries[key];
+            entryCount--;
+        }
+        entries[key] = entry;
+        entryCount++;
+        for (var oldest in entries) {
+            if (entryCount <= MAX_ENTRIES) {
+                break;
+            }
+            delete entries[oldest];
+            entryCount--;
+        }
+    };
+
+    var fetch = function (method, params, key, callback) {
+        if (inFlight[key]) {
+            inFlight[key].push(callback);
+            return;
+        }
+        inFlight[key] = [callback];
+        var generation = generations[method] || 0;
+        gapi.client.conference[method](params).execute(function (resp) {
+            var callbacks = inFlight[key];
+            delete inFlight[key];
+            if (!resp.error && CACHE_POLICIES[method] && generation === (generations[method] || 0)) {
+                touch(key, {method: method, resp: angular.copy(resp), time: new Date().getTime()});
+            }
+            angular.forEach(callbacks, function (cb) {
+                cb(angular.copy(resp));
+            });
+        });
+    };
+
+    var conferenceApi = {};
+
+    /**
+     * Invokes a conference API method; callback receives the gapi response, for a revalidated
+     * stale read possibly twice.
+     *
+     * @param {string} method the API method name
+     * @param {Object} params the request parameters
+     * @param {Function} callback called with the response
+     */
+    conferenceApi.execute = function (method, params, callback) {
+        params = params || {};
+        var key = requestKey(method, params);
+        var policy = CACHE_POLICIES[method];
+        if (!policy) {
+            gapi.client.conference[method](params).execute(function (resp) {
+                if (!resp.error) {
+                    conferenceApi.invalidate(INVALIDATES[method] || []);
+                }
+                callback(resp);
+            });
+            return;
+        }
+        var entry = entries[key];
+        var age = entry ? new Date().getTime() - entry.time : Infinity;
+        if (age < policy.fresh) {
+            touch(key, entry);
+            later(callback, entry.resp);
+        } else if (age < policy.maxAge) {
+            later(callback, entry.resp);
+            fetch(method, params, key, function (resp) {
+                if (!resp.error && !angular.equals(resp, entry.resp)) {
+                    callback(resp);
+                }
+            });
+        } else {
+            fetch(method, params, key, callback);
+        }
+    };
+
+    /**
+     * Drops the cached responses of the given methods.
+     *
+     * @param {string[]} methods
+     */
+    conferenceApi.invalidate = function (methods) {
+        angular.forEach(methods, function (method) {
+            generations[method] = (generations[method] || 0) + 1;
+        });
+        for (var key in entries) {
+            if (methods.indexOf(entries[key].method) >= 0) {
+                delete entries[key];
+                entryCount--;
+            }
+        }
+    };
+
+    /**
+     * Drops everything cached, e.g. when the user signs out.
+     */
+    conferenceApi.clear = function () {
+        conferenceApi.invalidate(Object.keys(CACHE_POLICIES));
+    };
+
+    /**
+     * Returns a function that calls fn once no call has come for wait ms.
+     *
+     * @param {Function} fn
+     * @param {number} wait in ms
+     * @returns {Function}
+     */
+    conferenceApi.debounce = function (fn, wait) {
+        var timer = null;
+        return function () {
+            var args = arguments;
+            if (timer) {
+                $timeout.cancel(timer);
+            }
+            timer = $timeout(function () {
+                timer = null;
+                fn.apply(null, args);
+            }, wait);
+        };
+    };
+
+    return conferenceApi;
+});
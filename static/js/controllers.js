@@ -25,7 +25,7 @@ conferenceApp.controllers = angular.module('conferenceControllers', ['ui.bootstr
  * A controller used for the My Profile page.
  */
 conferenceApp.controllers.controller('MyProfileCtrl',
-    function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+    function ($scope, $log, oauth2Provider, conferenceApi, HTTP_ERRORS) {
         $scope.submitted = false;
         $scope.loading = false;
 
@@ -63,21 +63,19 @@ conferenceApp.controllers.controller('MyProfileCtrl',
             var retrieveProfileCallback = function () {
                 $scope.profile = {};
                 $scope.loading = true;
-                gapi.client.conference.getProfile().
-                    execute(function (resp) {
-                        $scope.$apply(function () {
-                            $scope.loading = false;
-                            if (resp.error) {
-                                // Failed to get a user profile.
-                            } else {
-                                // Succeeded to get the user profile.
-                                $scope.profile.displayName = resp.result.displayName;
-                                $scope.profile.teeShirtSize = resp.result.teeShirtSize;
-                                $scope.initialProfile = resp.result;
-                            }
-                        });
-                    }
-                );
+                conferenceApi.execute('getProfile', {}, function (resp) {
+                    $scope.$apply(function () {
+                        $scope.loading = false;
+                        if (resp.error) {
+                            // Failed to get a user profile.
+                        } else {
+                            // Succeeded to get the user profile.
+                            $scope.profile.displayName = resp.result.displayName;
+                            $scope.profile.teeShirtSize = resp.result.teeShirtSize;
+                            $scope.initialProfile = resp.result;
+                        }
+                    });
+                });
             };
             if (!oauth2Provider.signedIn) {
                 var modalInstance = oauth2Provider.showLoginModal();
@@ -94,35 +92,34 @@ conferenceApp.controllers.controller('MyProfileCtrl',
         $scope.saveProfile = function () {
             $scope.submitted = true;
             $scope.loading = true;
-            gapi.client.conference.saveProfile($scope.profile).
-                execute(function (resp) {
-                    $scope.$apply(function () {
-                        $scope.loading = false;
-                        if (resp.error) {
-                            // The request has failed.
-                            var errorMessage = resp.error.message || '';
-                            $scope.messages = 'Failed to update a profile : ' + errorMessage;
-                            $scope.alertStatus = 'warning';
-                            $log.error($scope.messages + 'Profile : ' + JSON.stringify($scope.profile));
-
-                            if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
-                                oauth2Provider.showLoginModal();
-                                return;
-                            }
-                        } else {
-                            // The request has succeeded.
-                            $scope.messages = 'The profile has been updated';
-                            $scope.alertStatus = 'success';
-                            $scope.submitted = false;
-                            $scope.initialProfile = {
-                                displayName: $scope.profile.displayName,
-                                teeShirtSize: $scope.profile.teeShirtSize
-                            };
-
-                            $log.info($scope.messages + JSON.stringify(resp.result));
+            conferenceApi.execute('saveProfile', $scope.profile, function (resp) {
+                $scope.$apply(function () {
+                    $scope.loading = false;
+                    if (resp.error) {
+                        // The request has failed.
+                        var errorMessage = resp.error.message || '';
+                        $scope.messages = 'Failed to update a profile : ' + errorMessage;
+                        $scope.alertStatus = 'warning';
+                        $log.error($scope.messages + 'Profile : ' + JSON.stringify($scope.profile));
+
+                        if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+                            oauth2Provider.showLoginModal();
+                            return;
                         }
-                    });
+                    } else {
+                        // The request has succeeded.
+                        $scope.messages = 'The profile has been updated';
+                        $scope.alertStatus = 'success';
+                        $scope.submitted = false;
+                        $scope.initialProfile = {
+                            displayName: $scope.profile.displayName,
+                            teeShirtSize: $scope.profile.teeShirtSize
+                        };
+
+                        $log.info($scope.messages + JSON.stringify(resp.result));
+                    }
                 });
+            });
         };
     })
 ;
@@ -135,7 +132,7 @@ conferenceApp.controllers.controller('MyProfileCtrl',
  * A controller used for the Create conferences page.
  */
 conferenceApp.controllers.controller('CreateConferenceCtrl',
-    function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+    function ($scope, $log, oauth2Provider, conferenceApi, HTTP_ERRORS) {
 
         /**
          * The conference object being edited in the page.
@@ -214,31 +211,30 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
             }
 
             $scope.loading = true;
-            gapi.client.conference.createConference($scope.conference).
-                execute(function (resp) {
-                    $scope.$apply(function () {
-                        $scope.loading = false;
-                        if (resp.error) {
-                            // The request has failed.
-                            var errorMessage = resp.error.message || '';
-                            $scope.messages = 'Failed to create a conference : ' + errorMessage;
-                            $scope.alertStatus = 'warning';
-                            $log.error($scope.messages + ' Conference : ' + JSON.stringify($scope.conference));
-
-                            if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
-                                oauth2Provider.showLoginModal();
-                                return;
-                            }
-                        } else {
-                            // The request has succeeded.
-                            $scope.messages = 'The conference has been created : ' + resp.result.name;
-                            $scope.alertStatus = 'success';
-                            $scope.submitted = false;
-                            $scope.conference = {};
-                            $log.info($scope.messages + ' : ' + JSON.stringify(resp.result));
+            conferenceApi.execute('createConference', $scope.conference, function (resp) {
+                $scope.$apply(function () {
+                    $scope.loading = false;
+                    if (resp.error) {
+                        // The request has failed.
+                        var errorMessage = resp.error.message || '';
+                        $scope.messages = 'Failed to create a conference : ' + errorMessage;
+                        $scope.alertStatus = 'warning';
+                        $log.error($scope.messages + ' Conference : ' + JSON.stringify($scope.conference));
+
+                        if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+                            oauth2Provider.showLoginModal();
+                            return;
                         }
-                    });
+                    } else {
+                        // The request has succeeded.
+                        $scope.messages = 'The conference has been created : ' + resp.result.name;
+                        $scope.alertStatus = 'success';
+                        $scope.submitted = false;
+                        $scope.conference = {};
+                        $log.info($scope.messages + ' : ' + JSON.stringify(resp.result));
+                    }
                 });
+            });
         };
     });
 
@@ -249,7 +245,7 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
  * @description
  * A controller used for the Show conferences page.
  */
-conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, conferenceApi, HTTP_ERRORS) {
 
     /**
      * Holds the status if the query is being executed.
@@ -408,6 +404,22 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         }
     };
 
+    /**
+     * Re-runs the query of the 'ALL' tab once the filters have stopped changing for FILTER_DEBOUNCE ms.
+     */
+    var FILTER_DEBOUNCE = 400;
+    var queryOnFilterChange = conferenceApi.debounce(function () {
+        if ($scope.selectedTab == 'ALL') {
+            $scope.queryConferencesAll();
+        }
+    }, FILTER_DEBOUNCE);
+
+    $scope.$watch('filters', function (newValue, oldValue) {
+        if (newValue !== oldValue) {
+            queryOnFilterChange();
+        }
+    }, true);
+
     /**
      * Query the conferences depending on the tab currently selected.
      *
@@ -441,31 +453,30 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
             }
         }
         $scope.loading = true;
-        gapi.client.conference.queryConferences(sendFilters).
-            execute(function (resp) {
-                $scope.$apply(function () {
-                    $scope.loading = false;
-                    if (resp.error) {
-                        // The request has failed.
-                        var errorMessage = resp.error.message || '';
-                        $scope.messages = 'Failed to query conferences : ' + errorMessage;
-                        $scope.alertStatus = 'warning';
-                        $log.error($scope.messages + ' filters : ' + JSON.stringify(sendFilters));
-                    } else {
-                        // The request has succeeded.
-                        $scope.submitted = false;
-                        $scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters);
-                        $scope.alertStatus = 'success';
-                        $log.info($scope.messages);
+        conferenceApi.execute('queryConferences', sendFilters, function (resp) {
+            $scope.$apply(function () {
+                $scope.loading = false;
+                if (resp.error) {
+                    // The request has failed.
+                    var errorMessage = resp.error.message || '';
+                    $scope.messages = 'Failed to query conferences : ' + errorMessage;
+                    $scope.alertStatus = 'warning';
+                    $log.error($scope.messages + ' filters : ' + JSON.stringify(sendFilters));
+                } else {
+                    // The request has succeeded.
+                    $scope.submitted = false;
+                    $scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters);
+                    $scope.alertStatus = 'success';
+                    $log.info($scope.messages);
 
-                        $scope.conferences = [];
-                        angular.forEach(resp.items, function (conference) {
-                            $scope.conferences.push(conference);
-                        });
-                    }
-                    $scope.submitted = true;
-                });
+                    $scope.conferences = [];
+                    angular.forEach(resp.items, function (conference) {
+                        $scope.conferences.push(conference);
+                    });
+                }
+                $scope.submitted = true;
             });
+        });
     }
 
     /**
@@ -473,36 +484,35 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.getConferencesCreated = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesCreated().
-            execute(function (resp) {
-                $scope.$apply(function () {
-                    $scope.loading = false;
-                    if (resp.error) {
-                        // The request has failed.
-                        var errorMessage = resp.error.message || '';
-                        $scope.messages = 'Failed to query the conferences created : ' + errorMessage;
-                        $scope.alertStatus = 'warning';
-                        $log.error($scope.messages);
-
-                        if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
-                            oauth2Provider.showLoginModal();
-                            return;
-                        }
-                    } else {
-                        // The request has succeeded.
-                        $scope.submitted = false;
-                        $scope.messages = 'Query succeeded : Conferences you have created';
-                        $scope.alertStatus = 'success';
-                        $log.info($scope.messages);
+        conferenceApi.execute('getConferencesCreated', {}, function (resp) {
+            $scope.$apply(function () {
+                $scope.loading = false;
+                if (resp.error) {
+                    // The request has failed.
+                    var errorMessage = resp.error.message || '';
+                    $scope.messages = 'Failed to query the conferences created : ' + errorMessage;
+                    $scope.alertStatus = 'warning';
+                    $log.error($scope.messages);
 
-                        $scope.conferences = [];
-                        angular.forEach(resp.items, function (conference) {
-                            $scope.conferences.push(conference);
-                        });
+                    if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+                        oauth2Provider.showLoginModal();
+                        return;
                     }
-                    $scope.submitted = true;
-                });
+                } else {
+                    // The request has succeeded.
+                    $scope.submitted = false;
+                    $scope.messages = 'Query succeeded : Conferences you have created';
+                    $scope.alertStatus = 'success';
+                    $log.info($scope.messages);
+
+                    $scope.conferences = [];
+                    angular.forEach(resp.items, function (conference) {
+                        $scope.conferences.push(conference);
+                    });
+                }
+                $scope.submitted = true;
             });
+        });
     };
 
     /**
@@ -511,31 +521,30 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.getConferencesAttend = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesToAttend().
-            execute(function (resp) {
-                $scope.$apply(function () {
-                    if (resp.error) {
-                        // The request has failed.
-                        var errorMessage = resp.error.message || '';
-                        $scope.messages = 'Failed to query the conferences to attend : ' + errorMessage;
-                        $scope.alertStatus = 'warning';
-                        $log.error($scope.messages);
+        conferenceApi.execute('getConferencesToAttend', {}, function (resp) {
+            $scope.$apply(function () {
+                if (resp.error) {
+                    // The request has failed.
+                    var errorMessage = resp.error.message || '';
+                    $scope.messages = 'Failed to query the conferences to attend : ' + errorMessage;
+                    $scope.alertStatus = 'warning';
+                    $log.error($scope.messages);
 
-                        if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
-                            oauth2Provider.showLoginModal();
-                            return;
-                        }
-                    } else {
-                        // The request has succeeded.
-                        $scope.conferences = resp.result.items;
-                        $scope.loading = false;
-                        $scope.messages = 'Query succeeded : Conferences you will attend (or you have attended)';
-                        $scope.alertStatus = 'success';
-                        $log.info($scope.messages);
+                    if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+                        oauth2Provider.showLoginModal();
+                        return;
                     }
-                    $scope.submitted = true;
-                });
+                } else {
+                    // The request has succeeded.
+                    $scope.conferences = resp.result.items;
+                    $scope.loading = false;
+                    $scope.messages = 'Query succeeded : Conferences you will attend (or you have attended)';
+                    $scope.alertStatus = 'success';
+                    $log.info($scope.messages);
+                }
+                $scope.submitted = true;
             });
+        });
     };
 });
 
@@ -547,9 +556,34 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
  * @description
  * A controller used for the conference detail page.
  */
-conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, $timeout, conferenceApi, HTTP_ERRORS) {
     $scope.conference = {};
 
+    /**
+     * Backoff bounds of the seatsAvailable watch, in milliseconds. After a change the next
+     * watch waits at least WATCH_MIN_DELAY so a sell-out's changes arrive in batches. The
+     * server holds a watch for up to 5 seconds; after watches that found no change the wait
+     * grows from WATCH_MIN_DELAY to WATCH_IDLE_MAX_DELAY, so quiet pages poll rarely.
+     */
+    var WATCH_MIN_DELAY = 1000;
+    var WATCH_IDLE_MAX_DELAY = 15000;
+    var WATCH_MAX_DELAY = 60000;
+
+    /**
+     * Change feed version of seatsAvailable last seen; 0 before the first answer.
+     */
+    var seatVersion = 0;
+    var watchDelay = 0;
+    var idleDelay = 0;
+    var watchTimer = null;
+    var watching = false;
+
+    /**
+     * Holds the conferences most similar to this one.
+     * @type {Array}
+     */
+    $scope.similarConferences = [];
+
     $scope.isUserAttending = false;
 
     /**
@@ -559,9 +593,9 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      */
     $scope.init = function () {
         $scope.loading = true;
-        gapi.client.conference.getConference({
+        conferenceApi.execute('getConference', {
             websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        }, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -575,13 +609,14 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                     // The request has succeeded.
                     $scope.alertStatus = 'success';
                     $scope.conference = resp.result;
+                    startWatchingSeats();
                 }
             });
         });
 
         $scope.loading = true;
         // If the user is attending the conference, updates the status message and available function.
-        gapi.client.conference.getProfile().execute(function (resp) {
+        conferenceApi.execute('getProfile', {}, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -599,17 +634,85 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                 }
             });
         });
+
+        // Precomputed "you might also like" list; a single get on the server.
+        conferenceApi.execute('getSimilarConferences', {
+            websafeConferenceKey: $routeParams.websafeConferenceKey
+        }, function (resp) {
+            $scope.$apply(function () {
+                if (resp.error) {
+                    $log.error('Failed to get similar conferences: ' + (resp.error.message || ''));
+                } else {
+                    $scope.similarConferences = resp.result.items || [];
+                }
+            });
+        });
     };
 
 
+    /**
+     * Long-polls the conference.watchSeats change feed and applies seatsAvailable changes.
+     * The server holds each call until seats change or its timeout passes; failed calls
+     * are retried with jittered exponential backoff.
+     */
+    var watchSeats = function () {
+        watchTimer = null;
+        conferenceApi.execute('watchSeats', {
+            items: [{websafeConferenceKey: $routeParams.websafeConferenceKey, version: seatVersion}]
+        }, function (resp) {
+            if (!watching) {
+                return;
+            }
+            var delay = 0;
+            if (resp.error) {
+                watchDelay = Math.min(WATCH_MAX_DELAY, Math.max(WATCH_MIN_DELAY, watchDelay * 2));
+                delay = watchDelay / 2 + Math.random() * watchDelay / 2;
+                $log.error('Failed to watch seats: ' + (resp.error.message || ''));
+            } else {
+                watchDelay = 0;
+                var items = resp.result.items || [];
+                if (items.length) {
+                    idleDelay = 0;
+                    delay = WATCH_MIN_DELAY;
+                } else {
+                    idleDelay = Math.min(WATCH_IDLE_MAX_DELAY, Math.max(WATCH_MIN_DELAY, idleDelay * 2));
+                    delay = idleDelay;
+                }
+                $scope.$apply(function () {
+                    angular.forEach(items, function (item) {
+                        seatVersion = item.version;
+                        if (item.seatsAvailable !== undefined) {
+                            $scope.conference.seatsAvailable = item.seatsAvailable;
+                        }
+                    });
+                });
+            }
+            watchTimer = $timeout(watchSeats, delay, false);
+        });
+    };
+
+    var startWatchingSeats = function () {
+        if (!watching) {
+            watching = true;
+            watchSeats();
+        }
+    };
+
+    $scope.$on('$destroy', function () {
+        watching = false;
+        if (watchTimer) {
+            $timeout.cancel(watchTimer);
+        }
+    });
+
     /**
      * Invokes the conference.registerForConference method.
      */
     $scope.registerForConference = function () {
         $scope.loading = true;
-        gapi.client.conference.registerForConference({
+        conferenceApi.execute('registerForConference', {
             websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        }, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -644,9 +747,9 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      */
     $scope.unregisterFromConference = function () {
         $scope.loading = true;
-        gapi.client.conference.unregisterFromConference({
+        conferenceApi.execute('unregisterFromConference', {
             websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        }, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -691,7 +794,7 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
  * such as user authentications.
  *
  */
-conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oauth2Provider) {
+conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oauth2Provider, conferenceApi) {
 
     /**
      * Returns if the viewLocation is the currently viewed page.
@@ -755,6 +858,7 @@ conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oa
      */
     $scope.signOut = function () {
         oauth2Provider.signOut();
+        conferenceApi.clear();
         $scope.alertStatus = 'success';
         $scope.rootMessages = 'Logged out';
     };
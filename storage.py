@@ -0,0 +1,613 @@
+#!/usr/bin/env python
+
+"""
+storage.py -- repository layer for Conference, Session & Profile
+    entities: gets, puts, deletes, ndb queries with cursors and
+    transactions, on ndb or on a local SQLite database
+
+The API talks to the configured repository only, so its logic can be
+profiled and load-tested locally on SQLite, without the datastore stub's
+overhead. Select the backend with the environment variable
+
+    CONFERENCE_STORAGE_BACKEND=ndb|sqlite
+    CONFERENCE_SQLITE_PATH=/tmp/conference.db   (default: in memory)
+
+Queries stay ndb.Query objects; the SQLite repository translates their
+filters, ancestor and orders into SQL over an indexed table of property
+values, one row per (entity, property, value) as in the datastore's own
+indexes. Entities are stored as their datastore protocol buffers. Kinds
+other than STORED_KINDS always go to ndb.
+
+API methods decorated with @unitOfWork, and every @transactional
+function, collect their writes in a UnitOfWork: repeated puts of one key
+become one, re-reads are answered from memory and everything is stored
+with one putMulti when the method returns or just before the commit.
+@transactional retries collisions itself, after a jittered exponential
+backoff within a per-call-site deadline, and reports attempts, collisions
+and the entity groups involved to instrumentation.
+
+"""
+
+import collections
+import functools
+import os
+import random
+import sqlite3
+import threading
+from datetime import date
+from datetime import datetime
+from datetime import time
+from time import sleep
+from timeit import default_timer
+
+from google.appengine.api import datastore_errors
+from google.appengine.datastore import entity_pb
+from google.appengine.datastore import datastore_query
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from instrumentation import recordTransaction
+
+STORAGE_BACKEND = os.environ.get('CONFERENCE_STORAGE_BACKEND', 'ndb')
+SQLITE_PATH = os.environ.get('CONFERENCE_SQLITE_PATH', ':memory:')
+STORED_KINDS = frozenset(['Conference', 'ArchivedConference', 'Session',
+                          'ArchivedSession', 'Profile'])
+
+# @transactional defaults: collisions retried, seconds slept before the
+# first retry (doubled per retry, fully jittered) & the longest sleep
+TX_RETRIES = 3
+TX_BACKOFF = 0.02
+TX_MAX_BACKOFF = 1.0
+
+
+class Repository(object):
+    """Repository -- entity storage the API reads & writes through"""
+
+    def get(self, key):
+        return self.getMulti([key])[0]
+
+    def getMulti(self, keys):
+        """Return the entities of `keys`, None where missing."""
+        raise NotImplementedError
+
+    def put(self, entity):
+        return self.putMulti([entity])[0]
+
+    def putMulti(self, entities):
+        """Store `entities`, completing missing IDs; return their keys."""
+        raise NotImplementedError
+
+    def deleteMulti(self, keys):
+        raise NotImplementedError
+
+    def fetch(self, query, **options):
+        """Run an ndb query; options as for Query.fetch() (limit,
+        offset, keys_only, projection).
+        """
+        raise NotImplementedError
+
+    def fetchPage(self, query, page_size, cursor=None, keys_only=False):
+        """Return (results, websafe cursor or None, more)."""
+        raise NotImplementedError
+
+    def transaction(self, func, xg=False, retries=0):
+        """Run func() in a transaction, joining one already running.
+
+        Collisions are retried `retries` times, then raise
+        TransactionFailedError.
+        """
+        raise NotImplementedError
+
+
+class NdbRepository(Repository):
+    """NdbRepository -- the App Engine datastore, through ndb"""
+
+    def getMulti(self, keys):
+        return ndb.get_multi(keys)
+
+    def putMulti(self, entities):
+        return ndb.put_multi(entities)
+
+    def deleteMulti(self, keys):
+        ndb.delete_multi(keys)
+
+    def fetch(self, query, **options):
+        return query.fetch(**options)
+
+    def fetchPage(self, query, page_size, cursor=None, keys_only=False):
+        start = Cursor(urlsafe=cursor) if cursor else None
+        results, next_cursor, more = query.fetch_page(
+            page_size, start_cursor=start, keys_only=keys_only)
+        return (results, next_cursor.urlsafe() if next_cursor else None,
+                more)
+
+    def transaction(self, func, xg=False, retries=0):
+        return ndb.transaction(func, xg=xg, retries=retries,
+                               propagation=ndb.TransactionOptions.ALLOWED)
+
+
+# - - - SQLite - - - - - - - - - - - - - - - - - - - - - - -
+
+# datastore order puts null before numbers & strings, as this does
+_NULL = -2 ** 63
+_EPOCH = datetime(1970, 1, 1)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    key TEXT PRIMARY KEY, kind TEXT NOT NULL, pb BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS ancestors (
+    ancestor TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (ancestor, key));
+CREATE TABLE IF NOT EXISTS properties (
+    kind TEXT NOT NULL, name TEXT NOT NULL, value, key TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS properties_value
+    ON properties (kind, name, value, key);
+CREATE INDEX IF NOT EXISTS properties_key ON properties (key);
+CREATE TABLE IF NOT EXISTS ids (kind TEXT PRIMARY KEY, last INTEGER);
+"""
+
+
+def _indexValue(value):
+    """Encode a property value so SQLite compares it like the datastore."""
+    if value is None:
+        return _NULL
+    if isinstance(value, ndb.Key):
+        return value.urlsafe()
+    if isinstance(value, datetime):
+        delta = value.replace(tzinfo=None) - _EPOCH
+    elif isinstance(value, date):
+        delta = datetime(value.year, value.month, value.day) - _EPOCH
+    elif isinstance(value, time):
+        delta = datetime.combine(_EPOCH.date(), value) - _EPOCH
+    else:
+        return value
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+
+
+def _indexRows(entity, key):
+    """Return the (kind, name, value, key) index rows of an entity."""
+    kind = entity.key.kind()
+    rows = []
+    for prop in entity._properties.itervalues():
+        if not prop._indexed or isinstance(prop, ndb.StructuredProperty):
+            continue
+        values = prop._get_value(entity)
+        if not prop._repeated:
+            values = [values]
+        for value in values:
+            rows.append((kind, prop._name, _indexValue(value), key))
+    return rows
+
+
+class SqliteRepository(Repository):
+    """SqliteRepository -- a local SQLite database, for profiling & load
+    tests; one connection, with writers serialized by a lock
+    """
+
+    _adapter = ndb.ModelAdapter()
+    _operators = {'=': '=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+
+    def __init__(self, path=SQLITE_PATH):
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.text_factory = str
+        self.conn.execute('PRAGMA synchronous = OFF')
+        self.conn.executescript(_SCHEMA)
+        self.fallback = NdbRepository()
+
+    def _stored(self, kind):
+        return kind in STORED_KINDS
+
+    # - - - entities - - - - - - - - - - - - - - - - - - - - -
+
+    def getMulti(self, keys):
+        ndb_keys = [k for k in keys if not self._stored(k.kind())]
+        found = dict(zip(ndb_keys, self.fallback.getMulti(ndb_keys)))
+        wanted = [k.urlsafe() for k in keys if self._stored(k.kind())]
+        with self.lock:
+            for i in range(0, len(wanted), 500):
+                batch = wanted[i:i + 500]
+                for key, pb in self.conn.execute(
+                        'SELECT key, pb FROM entities WHERE key IN (%s)'
+                        % ','.join('?' * len(batch)), batch):
+                    entity = self._entity(pb)
+                    found[entity.key] = entity
+        return [found.get(k) for k in keys]
+
+    def _entity(self, pb):
+        return self._adapter.pb_to_entity(entity_pb.EntityProto(str(pb)))
+
+    def _completeKey(self, entity):
+        key = entity.key
+        if key is not None and key.id() is not None:
+            return key
+        kind = key.kind() if key else entity._get_kind()
+        parent = key.parent() if key else None
+        last = self.conn.execute('SELECT last FROM ids WHERE kind = ?',
+                                 (kind,)).fetchone()
+        new_id = (last[0] if last else 0) + 1
+        self.conn.execute('INSERT OR REPLACE INTO ids VALUES (?, ?)',
+                          (kind, new_id))
+        entity.key = ndb.Key(kind, new_id, parent=parent)
+        return entity.key
+
+    def putMulti(self, entities):
+        stored, others = [], []
+        for i, entity in enumerate(entities):
+            kind = entity.key.kind() if entity.key else entity._get_kind()
+            (stored if self._stored(kind) else others).append(i)
+        keys = [None] * len(entities)
+        for i, key in zip(others, self.fallback.putMulti(
+                [entities[i] for i in others])):
+            keys[i] = key
+        for i, key in zip(stored, self._atomic(
+                lambda: self._write([entities[i] for i in stored]))):
+            keys[i] = key
+        return keys
+
+    def _write(self, entities):
+        keys = []
+        for entity in entities:
+            key = self._completeKey(entity)
+            keys.append(key)
+            wsk = key.urlsafe()
+            self._deleteRows([wsk])
+            self.conn.execute(
+                'INSERT INTO entities VALUES (?, ?, ?)',
+                (wsk, key.kind(), sqlite3.Binary(
+                    self._adapter.entity_to_pb(entity).Encode())))
+            self.conn.executemany(
+                'INSERT INTO ancestors VALUES (?, ?)',
+                [(ancestor.urlsafe(), wsk) for ancestor in self._path(key)])
+            self.conn.executemany('INSERT INTO properties VALUES (?, ?, ?, ?)',
+                                  _indexRows(entity, wsk))
+        return keys
+
+    def _path(self, key):
+        while key is not None:
+            yield key
+            key = key.parent()
+
+    def _deleteRows(self, wsks):
+        for table in ('entities', 'ancestors', 'properties'):
+            self.conn.executemany('DELETE FROM %s WHERE key = ?' % table,
+                                  [(wsk,) for wsk in wsks])
+
+    def deleteMulti(self, keys):
+        self.fallback.deleteMulti(
+            [k for k in keys if not self._stored(k.kind())])
+        wsks = [k.urlsafe() for k in keys if self._stored(k.kind())]
+        self._atomic(lambda: self._deleteRows(wsks))
+
+    # - - - queries - - - - - - - - - - - - - - - - - - - - -
+
+    def _where(self, node, kind, params):
+        """Translate an ndb filter node into SQL, appending its params."""
+        if isinstance(node, ndb.query.FilterNode):
+            name, op, value = node.__getnewargs__()
+            if name == '__key__':
+                params.append(value.urlsafe())
+                return 'e.key %s ?' % self._operators[op]
+            params.extend([kind, name, _indexValue(value)])
+            return ('e.key IN (SELECT p.key FROM properties p WHERE '
+                    'p.kind = ? AND p.name = ? AND p.value %s ?)'
+                    % self._operators[op])
+        if isinstance(node, ndb.query.ConjunctionNode):
+            return '(%s)' % ' AND '.join(self._where(n, kind, params)
+                                         for n in node)
+        if isinstance(node, ndb.query.DisjunctionNode):
+            return '(%s)' % ' OR '.join(self._where(n, kind, params)
+                                        for n in node)
+        raise ValueError('%s filters are not supported on SQLite'
+                         % type(node).__name__)
+
+    def _select(self, query, columns, params):
+        """Return the SQL of `query` up to its ORDER BY clause."""
+        kind = query.kind
+        params.append(kind)
+        sql = ['SELECT %s FROM entities e WHERE e.kind = ?' % columns]
+        if query.ancestor is not None:
+            sql.append('AND e.key IN (SELECT key FROM ancestors '
+                       'WHERE ancestor = ?)')
+            params.append(query.ancestor.urlsafe())
+        if query.filters is not None:
+            sql.append('AND ' + self._where(query.filters, kind, params))
+        orders = []
+        if query.orders is not None:
+            for pb in query.orders._to_pbs():
+                name = pb.property()
+                if name == '__key__':
+                    orders.append('e.key')
+                    continue
+                desc = pb.direction() == (
+                    datastore_query.PropertyOrder.DESCENDING)
+                # entities without the property are not in its index
+                sql.append('AND e.key IN (SELECT key FROM properties '
+                           'WHERE kind = ? AND name = ?)')
+                params.extend([kind, name])
+                orders.append('(SELECT %s(value) FROM properties WHERE '
+                              'key = e.key AND name = %s)%s'
+                              % ('MAX' if desc else 'MIN',
+                                 self._quote(name), ' DESC' if desc else ''))
+        sql.append('ORDER BY %s' % ', '.join(orders + ['e.key']))
+        return ' '.join(sql)
+
+    def _quote(self, name):
+        return "'%s'" % name.replace("'", "''")
+
+    def fetch(self, query, **options):
+        if not self._stored(query.kind):
+            return self.fallback.fetch(query, **options)
+        # projections return whole entities, a superset of the fields
+        keys_only = options.get('keys_only')
+        limit = options.get('limit')
+        params = []
+        sql = self._select(query, 'e.key' if keys_only else 'e.pb', params)
+        sql += ' LIMIT ? OFFSET ?'
+        params.extend([-1 if limit is None else limit,
+                       options.get('offset') or 0])
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        if keys_only:
+            return [ndb.Key(urlsafe=row[0]) for row in rows]
+        return [self._entity(row[0]) for row in rows]
+
+    def fetchPage(self, query, page_size, cursor=None, keys_only=False):
+        if not self._stored(query.kind):
+            return self.fallback.fetchPage(query, page_size, cursor,
+                                           keys_only)
+        # cursors are offsets; good enough for a local test database
+        offset = int(cursor or 0)
+        results = self.fetch(query, limit=page_size + 1, offset=offset,
+                             keys_only=keys_only)
+        more = len(results) > page_size
+        results = results[:page_size]
+        return results, str(offset + len(results)) if results else None, more
+
+    def _atomic(self, func):
+        """Run func() in a SQLite transaction, or in the running one."""
+        with self.lock:
+            if self.depth:
+                return func()
+            self.depth += 1
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = func()
+            except:
+                self.conn.execute('ROLLBACK')
+                raise
+            else:
+                self.conn.execute('COMMIT')
+                return result
+            finally:
+                self.depth -= 1
+
+    def transaction(self, func, xg=False, retries=0):
+        # an ndb transaction around it carries transactional tasks
+        return ndb.transaction(lambda: self._atomic(func), xg=True,
+                               retries=retries,
+                               propagation=ndb.TransactionOptions.ALLOWED)
+
+
+# - - - configured repository - - - - - - - - - - - - - - - -
+
+_repository = None
+
+
+def getRepository():
+    """Return the configured repository."""
+    global _repository
+    if _repository is None:
+        if STORAGE_BACKEND == 'sqlite':
+            _repository = SqliteRepository(SQLITE_PATH)
+        else:
+            _repository = NdbRepository()
+    return _repository
+
+
+def setRepository(repository):
+    """Switch the repository, e.g. to benchmark both in one process."""
+    global _repository
+    _repository = repository
+
+
+# - - - unit of work - - - - - - - - - - - - - - - - - - - -
+
+class UnitOfWork(object):
+    """UnitOfWork -- the Conference, Session & Profile entities one API
+    call or transaction has read or written: an identity map serving
+    re-reads from memory, plus the written entities, one per key, that
+    flush() stores with a single putMulti
+    """
+
+    def __init__(self, repository, transactional=False):
+        self.repository = repository
+        self.transactional = transactional
+        self.entities = {}      # key -> entity, or None if missing
+        self.dirty = collections.OrderedDict()
+
+    def getMulti(self, keys):
+        missing = [k for k in keys if k not in self.entities]
+        if missing:
+            self.entities.update(zip(missing,
+                                     self.repository.getMulti(missing)))
+        return [self.entities[k] for k in keys]
+
+    def putMulti(self, entities):
+        keys = []
+        for entity in entities:
+            key = entity.key
+            if key is None or key.id() is None:
+                # the repository completes the ID
+                key = self.repository.put(entity)
+            else:
+                self.dirty[key] = entity
+            self.entities[key] = entity
+            keys.append(key)
+        return keys
+
+    def deleteMulti(self, keys):
+        for key in keys:
+            self.dirty.pop(key, None)
+            self.entities[key] = None
+        self.repository.deleteMulti(keys)
+
+    def flush(self):
+        if self.dirty:
+            entities = self.dirty.values()
+            self.dirty.clear()
+            self.repository.putMulti(entities)
+
+
+_local = threading.local()
+
+
+def _unit():
+    return getattr(_local, 'unit', None)
+
+
+def _target():
+    return _unit() or getRepository()
+
+
+def getEntity(key):
+    return _target().getMulti([key])[0]
+
+
+def getEntities(keys):
+    return _target().getMulti(keys)
+
+
+def putEntity(entity):
+    """Store an entity; deferred to the next flush inside a unit of work."""
+    return _target().putMulti([entity])[0]
+
+
+def putEntities(entities):
+    return _target().putMulti(entities)
+
+
+def deleteEntities(keys):
+    _target().deleteMulti(keys)
+
+
+def flushEntities():
+    """Write the deferred puts now, e.g. before queueing a task or bumping
+    a cache version that must see them.
+    """
+    unit = _unit()
+    if unit is not None:
+        unit.flush()
+
+
+def fetchPage(query, page_size, cursor=None, keys_only=False):
+    return getRepository().fetchPage(query, page_size, cursor, keys_only)
+
+
+def unitOfWork(func):
+    """Run an API method in a unit of work, flushed once when it returns.
+
+    Queries only see flushed writes; call flushEntities() before side
+    effects that read what was put.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwds):
+        if _unit() is not None:
+            return func(*args, **kwds)
+        unit = _local.unit = UnitOfWork(getRepository())
+        try:
+            result = func(*args, **kwds)
+            unit.flush()
+            return result
+        finally:
+            _local.unit = None
+    return wrapper
+
+
+def _entityGroups(unit):
+    """Return the entity groups a unit of work read or wrote, as key
+    paths like 'Conference/42'.
+    """
+    roots = set(key.root() for key in unit.entities)
+    return sorted('/'.join(str(part) for part in root.flat())
+                  for root in roots)
+
+
+def _backoff(retry):
+    """Return the seconds to sleep before the `retry`-th retry."""
+    return random.uniform(0, min(TX_MAX_BACKOFF,
+                                 TX_BACKOFF * 2 ** (retry - 1)))
+
+
+def transactional(xg=False, retries=TX_RETRIES, deadline=None):
+    """@ndb.transactional() on the configured repository, in a unit of
+    work of its own that is flushed just before the commit.
+
+    A collision is retried up to `retries` times after a jittered
+    exponential backoff, unless the sleep would end more than `deadline`
+    seconds after the first attempt began; then TransactionFailedError
+    is raised. Attempts are recorded under the function's name.
+    """
+    def decorator(func):
+        site = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwds):
+            outer = _unit()
+            if outer is not None and outer.transactional:
+                return func(*args, **kwds)
+            if outer is not None:
+                # the transaction must read what the request wrote so far
+                outer.flush()
+            repository = getRepository()
+            units = []
+
+            def attempt():
+                unit = _local.unit = UnitOfWork(repository, True)
+                units.append(unit)
+                try:
+                    result = func(*args, **kwds)
+                    unit.flush()
+                    return result
+                finally:
+                    _local.unit = outer
+
+            if ndb.in_transaction():
+                # joins a transaction someone else retries
+                return repository.transaction(attempt, xg=xg)
+
+            start = default_timer()
+            slept = 0.0
+            attempts = []
+            failed = True
+            try:
+                while True:
+                    try:
+                        result = repository.transaction(attempt, xg=xg)
+                        attempts.append((_entityGroups(units[-1]), False))
+                        break
+                    except datastore_errors.TransactionFailedError:
+                        attempts.append((_entityGroups(units[-1])
+                                         if units else [], True))
+                        if len(attempts) > retries:
+                            raise
+                        delay = _backoff(len(attempts))
+                        if deadline is not None and (
+                                default_timer() + delay - start > deadline):
+                            raise
+                        sleep(delay)
+                        slept += delay
+                        del units[:]
+                failed = False
+            finally:
+                if attempts:
+                    recordTransaction(
+                        site, attempts,
+                        (default_timer() - start) * 1000.0, slept * 1000.0,
+                        failed)
+            if outer is not None:
+                outer.entities.update(units[-1].entities)
+            return result
+        return wrapper
+    return decorator
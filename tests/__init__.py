@@ -0,0 +1,8 @@
+"""
+tests -- tests of the Conference API against the App Engine testbed stubs
+
+Run from the repository root, e.g.:
+
+    APPENGINE_SDK=/path/to/google_appengine python -m unittest discover tests
+
+"""
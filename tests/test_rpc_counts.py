@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+"""
+test_rpc_counts.py -- exact datastore Get & Put RPCs of every write path,
+    recorded by the instrumentation hooks
+
+Each test seeds a small dataset, starts a fresh request (empty ndb
+context cache; entities written by the seed are not in memcache) and
+calls one endpoint or task, so every entity read outside the unit of
+work's identity map costs one Get.
+
+"""
+
+import unittest
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+from benchmarks import harness
+
+import webapp2
+from google.appengine.ext import ndb
+
+from main import app as handlers
+from archive import archivedKey
+from conference import ConferenceApi
+from conference import CONF_GET_REQUEST
+from conference import CONF_POST_REQUEST
+from conference import CONF_SESS_POST_REQUEST
+from conference import EXPORT_POST_REQUEST
+from conference import SESS_GET_REQUEST
+from conference import SESS_POST_REQUEST
+from holds import HOLD_SECONDS
+from holds import holdKey
+from instrumentation import getStats
+from instrumentation import resetStats
+from models import ConferenceForm
+from models import Conference
+from models import Profile
+from models import ProfileMiniForm
+from models import SeatHold
+from models import Session
+from models import Speaker
+from models import TeeShirtSize
+from speakers import speakerKey
+from storage import getEntity
+from storage import putEntities
+from storage import putEntity
+
+ORGANIZER = harness.userEmail(0)
+ATTENDEE = harness.userEmail(1)
+SPEAKER = 'Speaker 1'
+
+# explicit IDs stay clear of the ones allocate_ids hands out
+CONF_KEY = ndb.Key(Profile, ORGANIZER, Conference, 1001)
+PAST_CONF_KEY = ndb.Key(Profile, ORGANIZER, Conference, 1002)
+SESS_KEY = ndb.Key(Session, 1001, parent=CONF_KEY)
+PAST_SESS_KEYS = [ndb.Key(Session, 1002 + i, parent=PAST_CONF_KEY)
+                  for i in range(2)]
+
+
+class WriteRpcTest(unittest.TestCase):
+    """WriteRpcTest -- one test per write endpoint & write task"""
+
+    def setUp(self):
+        self.testbed = harness.activateTestbed()
+        self.api = ConferenceApi()
+        today = date.today()
+        putEntities([
+            Profile(key=ndb.Key(Profile, ORGANIZER), displayName='Organizer',
+                    mainEmail=ORGANIZER),
+            Profile(key=ndb.Key(Profile, ATTENDEE), displayName='Attendee',
+                    mainEmail=ATTENDEE),
+            Conference(key=CONF_KEY, name='Live', organizerUserId=ORGANIZER,
+                       topics=['Web Technologies'], city='London',
+                       startDate=today + timedelta(days=30),
+                       endDate=today + timedelta(days=31),
+                       month=(today + timedelta(days=30)).month,
+                       maxAttendees=10, seatsAvailable=10),
+            Conference(key=PAST_CONF_KEY, name='Past',
+                       organizerUserId=ORGANIZER, topics=['Movie Making'],
+                       city='Paris', startDate=today - timedelta(days=31),
+                       endDate=today - timedelta(days=30),
+                       month=(today - timedelta(days=31)).month,
+                       maxAttendees=10, seatsAvailable=10),
+            Speaker(key=speakerKey(SPEAKER), name=SPEAKER),
+        ])
+        putEntities([
+            Session(key=key, name='Session %d' % key.id(), speaker=SPEAKER,
+                    speakerKey=speakerKey(SPEAKER), duration=60,
+                    typeOfSession=['Workshop'], date=today,
+                    organizerUserId=ORGANIZER)
+            for key in [SESS_KEY] + PAST_SESS_KEYS])
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def call(self, user, method, request):
+        """Call an API method as `user` in a fresh request."""
+        harness.setUser(user)
+        harness.newRequest()
+        resetStats()
+        return method(request)
+
+    def assertRpcs(self, name, **expected):
+        """Assert the datastore RPCs of the one recorded call of `name`,
+        by call type (e.g. Get=1, Put=1)."""
+        stats = getStats()[name]
+        self.assertEqual((stats['count'], stats['errors']), (1, 0))
+        rpcs = stats['datastoreRpcs']
+        self.assertEqual(dict((call, rpcs.get(call, 0)) for call in expected),
+                         expected)
+
+    def update(self, key, **values):
+        entity = getEntity(key)
+        for name, value in values.iteritems():
+            setattr(entity, name, value)
+        putEntity(entity)
+
+    # - - - conferences - - - - - - - - - - - - - - - - - - - -
+
+    def testCreateConference(self):
+        self.call(ORGANIZER, self.api.createConference, ConferenceForm(
+            name='New', city='London', topics=['Medical Innovations'],
+            startDate='2030-06-01', endDate='2030-06-03', maxAttendees=100))
+        # the ID comes from the pool or an AllocateIds call
+        self.assertRpcs('createConference', Get=0, Put=1)
+
+    def testUpdateConference(self):
+        self.call(ORGANIZER, self.api.updateConference,
+                  CONF_POST_REQUEST.combined_message_class(
+                      websafeConferenceKey=CONF_KEY.urlsafe(),
+                      description='updated'))
+        # conference & organizer profile, one entity group
+        self.assertRpcs('updateConference', Get=2, Put=1)
+
+    def testDeleteConference(self):
+        self.call(ORGANIZER, self.api.deleteConference,
+                  CONF_GET_REQUEST.combined_message_class(
+                      websafeConferenceKey=CONF_KEY.urlsafe()))
+        # flags the conference; the task chain deletes it
+        self.assertRpcs('deleteConference', Get=1, Put=1)
+        self.assertTrue(getEntity(CONF_KEY).deleting)
+
+    def testExportConference(self):
+        self.call(ORGANIZER, self.api.exportConference,
+                  EXPORT_POST_REQUEST.combined_message_class(
+                      websafeConferenceKey=CONF_KEY.urlsafe()))
+        self.assertRpcs('exportConference', Get=1, Put=1)
+
+    # - - - profiles & registration - - - - - - - - - - - - - -
+
+    def testSaveProfile(self):
+        self.call(ATTENDEE, self.api.saveProfile, ProfileMiniForm(
+            displayName='Renamed', teeShirtSize=TeeShirtSize.M_M))
+        # both fields changed, one flush
+        self.assertRpcs('saveProfile', Get=1, Put=1)
+
+    def testRegisterForConference(self):
+        self.call(ATTENDEE, self.api.registerForConference,
+                  CONF_GET_REQUEST.combined_message_class(
+                      websafeConferenceKey=CONF_KEY.urlsafe()))
+        # profile & conference read in turn, written in one Put
+        self.assertRpcs('registerForConference', Get=2, Put=1)
+        self.assertEqual(getEntity(CONF_KEY).seatsAvailable, 9)
+
+    def testUnregisterFromConference(self):
+        self.update(ndb.Key(Profile, ATTENDEE),
+                    conferenceKeysToAttend=[CONF_KEY.urlsafe()])
+        self.update(CONF_KEY, seatsAvailable=9)
+        self.call(ATTENDEE, self.api.unregisterFromConference,
+                  CONF_GET_REQUEST.combined_message_class(
+                      websafeConferenceKey=CONF_KEY.urlsafe()))
+        self.assertRpcs('unregisterFromConference', Get=2, Put=1)
+        self.assertEqual(getEntity(CONF_KEY).seatsAvailable, 10)
+
+    # - - - seat holds - - - - - - - - - - - - - - - - - - - - -
+
+    def hold(self):
+        putEntity(SeatHold(key=holdKey(CONF_KEY, ATTENDEE),
+                           expires=datetime.utcnow() +
+                           timedelta(seconds=HOLD_SECONDS)))
+        self.update(CONF_KEY, seatsAvailable=9)
+
+    def testHoldSeat(self):
+        self.call(ATTENDEE, self.api.holdSeat,
+                  CONF_GET_REQUEST.combined_message_class(
+                      websafeConferenceKey=CONF_KEY.urlsafe()))
+        # conference & profile checked, then conference & hold read in
+        # the transaction; hold & conference share the Put
+        self.assertRpcs('holdSeat', Get=4, Put=1)
+        self.assertEqual(getEntity(CONF_KEY).seatsAvailable, 9)
+
+    def testConfirmSeatHold(self):
+        self.hold()
+        self.call(ATTENDEE, self.api.confirmSeatHold,
+                  CONF_GET_REQUEST.combined_message_class(
+                      websafeConferenceKey=CONF_KEY.urlsafe()))
+        # profile & conference checked, then hold & profile in one Get;
+        # only the profile is written, the hold is deleted
+        self.assertRpcs('confirmSeatHold', Get=3, Put=1, Delete=1)
+
+    def testReleaseSeatHold(self):
+        self.hold()
+        self.call(ATTENDEE, self.api.releaseSeatHold,
+                  CONF_GET_REQUEST.combined_message_class(
+                      websafeConferenceKey=CONF_KEY.urlsafe()))
+        self.assertRpcs('releaseSeatHold', Get=2, Put=1, Delete=1)
+        self.assertEqual(getEntity(CONF_KEY).seatsAvailable, 10)
+
+    # - - - sessions - - - - - - - - - - - - - - - - - - - - - -
+
+    def testCreateSession(self):
+        self.call(ORGANIZER, self.api.createSession,
+                  CONF_SESS_POST_REQUEST.combined_message_class(
+                      websafeConferenceKey=CONF_KEY.urlsafe(),
+                      name='New session', speaker=SPEAKER,
+                      date='2030-06-01', startTime='10:00'))
+        # conference, organizer & the (existing) speaker; the re-read of
+        # the new session comes from the unit of work
+        self.assertRpcs('createSession', Get=3, Put=1)
+
+    def testUpdateSession(self):
+        self.call(ORGANIZER, self.api.updateSession,
+                  SESS_POST_REQUEST.combined_message_class(
+                      websafeSessionKey=SESS_KEY.urlsafe(),
+                      highlists='updated'))
+        self.assertRpcs('updateSession', Get=1, Put=1)
+
+    def testDeleteSession(self):
+        self.call(ORGANIZER, self.api.deleteSession,
+                  SESS_POST_REQUEST.combined_message_class(
+                      websafeSessionKey=SESS_KEY.urlsafe()))
+        self.assertRpcs('deleteSession', Get=1, Put=0, Delete=1)
+
+    def testAddSessionToWishlist(self):
+        self.call(ATTENDEE, self.api.addSessionToWishlist,
+                  SESS_GET_REQUEST.combined_message_class(
+                      websafeSessionKey=SESS_KEY.urlsafe()))
+        self.assertRpcs('addSessionToWishlist', Get=2, Put=1)
+
+    def testDeleteSessionInWishlist(self):
+        self.update(ndb.Key(Profile, ATTENDEE),
+                    sessionKeysToAttend=[SESS_KEY.urlsafe()])
+        self.call(ATTENDEE, self.api.deleteSessionInWishlist,
+                  SESS_GET_REQUEST.combined_message_class(
+                      websafeSessionKey=SESS_KEY.urlsafe()))
+        self.assertRpcs('deleteSessionInWishlist', Get=2, Put=1)
+
+    # - - - archive - - - - - - - - - - - - - - - - - - - - - - -
+
+    def testArchiveBatch(self):
+        harness.newRequest()
+        resetStats()
+        resp = webapp2.Request.blank(
+            '/tasks/archive_conferences', POST={},
+            headers={'X-AppEngine-QueueName': 'default'}).get_response(
+                handlers)
+        self.assertEqual(resp.status_int, 204)
+        # the past conference's sessions (one Get, one Put), then the
+        # conference itself in its transaction
+        self.assertRpcs('ArchiveBatchHandler', Get=2, Put=2, Delete=2)
+        self.assertIsNone(getEntity(PAST_CONF_KEY))
+        self.assertIsNotNone(getEntity(archivedKey(PAST_CONF_KEY)))
+        self.assertIsNotNone(getEntity(CONF_KEY))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+
+"""
+textsearch.py -- keyword search over Conference name/description and
+    Session name/highlists/speaker, with prefix matching of the last
+    word and ranked results
+
+Two backends share one interface (put/delete/search):
+
+    LocalSearchIndex     inverted index kept in SearchEntry entities; each
+                         term & term prefix is an indexed list value, so a
+                         query is a merge join over built-in indexes
+    SearchApiIndex       the App Engine Search API, selected with
+                         CONFERENCE_SEARCH_BACKEND=searchapi
+
+Writes never touch the index directly: they queue the changed keys to
+/tasks/search_index, which re-reads the entities and re-indexes (or drops)
+them, so a retried or reordered task always converges on the latest state.
+
+"""
+
+import collections
+import os
+import re
+
+from google.appengine.api import search
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from archive import getMultiWithArchive
+from archive import liveKey
+from models import ArchivedConference
+from models import ArchivedSession
+from models import Conference
+from models import SearchEntry
+from models import Session
+from querylog import runQuery
+
+SEARCH_TASK_URL = '/tasks/search_index'
+SEARCH_BACKFILL_URL = '/tasks/search_backfill'
+SEARCH_BACKEND = os.environ.get('CONFERENCE_SEARCH_BACKEND', 'local')
+SEARCH_INDEX_NAME = 'conference'
+
+SEARCH_LIMIT = 20               # hits returned by default
+MAX_SEARCH_LIMIT = 100
+MAX_QUERY_TERMS = 8
+CANDIDATE_LIMIT = 500           # matching entries ranked per query
+MIN_PREFIX = 2
+MAX_PREFIX = 10                 # longer prefixes are checked in memory
+PREFIX_FACTOR = 0.5             # a prefix match counts half an exact one
+SATURATION = 1.2                # BM25 k1
+LENGTH_BIAS = 0.75              # BM25 b
+AVERAGE_LENGTH = 12.0           # typical weighted length of a document
+BACKFILL_PAGE = 200
+
+# indexed text per kind & the weight of a term occurring in each field
+FIELD_WEIGHTS = {
+    'Conference': {'name': 3.0, 'description': 1.0},
+    'Session': {'name': 3.0, 'speaker': 2.0, 'highlists': 1.0},
+}
+
+BACKFILL_MODELS = dict((m.__name__, m) for m in (
+    Conference, Session, ArchivedConference, ArchivedSession))
+
+STOPWORDS = frozenset(
+    'a an and are as at be by for from in is it of on or the to with'.split())
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+Document = collections.namedtuple('Document', 'docId kind title fields')
+SearchHit = collections.namedtuple('SearchHit', 'docId kind title score')
+
+
+# - - - text - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def tokenize(text):
+    """Return the lower-cased terms of `text`, stopwords dropped."""
+    if not text:
+        return []
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    return [t for t in _TOKEN_RE.findall(text.lower())
+            if t not in STOPWORDS]
+
+
+def prefixesOf(terms):
+    """Return the indexed prefixes (MIN_PREFIX..MAX_PREFIX chars) of terms."""
+    return set(t[:n] for t in terms
+               for n in range(MIN_PREFIX, min(len(t), MAX_PREFIX) + 1))
+
+
+def parseQuery(text):
+    """Return (terms, prefix) of a query.
+
+    Every word must match exactly except the last, which also matches as
+    the start of a word still being typed; a last word too short to be
+    a prefix is matched exactly.
+    """
+    words = tokenize(text)[:MAX_QUERY_TERMS]
+    if not words:
+        return [], None
+    terms, prefix = set(words[:-1]), words[-1]
+    if len(prefix) < MIN_PREFIX:
+        terms.add(prefix)
+        prefix = None
+    return sorted(terms), prefix
+
+
+def documentFor(entity):
+    """Return the Document indexing a Conference/Session (archived ones
+    under their live key), or None when it should not be searchable.
+    """
+    if entity is None or getattr(entity, 'deleting', False):
+        return None
+    key = liveKey(entity.key)
+    fields = dict((f, getattr(entity, f)) for f in FIELD_WEIGHTS[key.kind()])
+    return Document(key.urlsafe(), key.kind(), entity.name, fields)
+
+
+def _score(weights, length, terms, prefix):
+    """BM25-style score of one entry, or None when `prefix` turns out not
+    to match.
+
+    Every hit contains every query term, so inverse document frequency
+    would scale all hits alike and is left out.
+    """
+    norm = SATURATION * (1 - LENGTH_BIAS +
+                         LENGTH_BIAS * length / AVERAGE_LENGTH)
+
+    def saturate(tf):
+        return tf * (SATURATION + 1) / (tf + norm)
+
+    score = sum(saturate(weights.get(t, 0.0)) for t in terms)
+    if prefix:
+        if prefix in weights:
+            score += saturate(weights[prefix])
+        else:
+            tf = max([w for t, w in weights.iteritems()
+                      if t.startswith(prefix)] or [0.0])
+            if not tf:
+                return None
+            score += PREFIX_FACTOR * saturate(tf)
+    return score
+
+
+# - - - backends - - - - - - - - - - - - - - - - - - - - - - -
+
+class LocalSearchIndex(object):
+    """LocalSearchIndex -- inverted index kept in SearchEntry entities"""
+
+    def _entry(self, doc):
+        weights = {}
+        for field, text in doc.fields.iteritems():
+            w = FIELD_WEIGHTS[doc.kind].get(field, 1.0)
+            for t in tokenize(text):
+                weights[t] = weights.get(t, 0.0) + w
+        return SearchEntry(id=doc.docId, kind=doc.kind,
+                           terms=sorted(weights),
+                           prefixes=sorted(prefixesOf(weights)),
+                           title=doc.title, weights=weights,
+                           length=int(sum(weights.itervalues())))
+
+    def put(self, docs):
+        ndb.put_multi([self._entry(doc) for doc in docs])
+
+    def delete(self, doc_ids):
+        ndb.delete_multi([ndb.Key(SearchEntry, i) for i in doc_ids])
+
+    def search(self, text, kind=None, limit=SEARCH_LIMIT):
+        """Return up to `limit` SearchHits, best first.
+
+        Only the first CANDIDATE_LIMIT matching entries are ranked.
+        """
+        terms, prefix = parseQuery(text)
+        if not (terms or prefix):
+            return []
+        q = SearchEntry.query()
+        for t in terms:
+            q = q.filter(SearchEntry.terms == t)
+        if prefix:
+            q = q.filter(SearchEntry.prefixes == prefix[:MAX_PREFIX])
+        if kind:
+            q = q.filter(SearchEntry.kind == kind)
+
+        hits = []
+        for entry in runQuery(q, limit=CANDIDATE_LIMIT):
+            score = _score(entry.weights, entry.length, terms, prefix)
+            if score is not None:
+                hits.append(SearchHit(entry.key.id(), entry.kind,
+                                      entry.title, round(score, 4)))
+        hits.sort(key=lambda h: (-h.score, h.title))
+        return hits[:limit]
+
+
+class SearchApiIndex(object):
+    """SearchApiIndex -- the same interface over the App Engine Search API"""
+
+    def __init__(self, name=SEARCH_INDEX_NAME):
+        self.index = search.Index(name=name)
+
+    def _document(self, doc):
+        fields = [search.AtomField(name='kind', value=doc.kind),
+                  search.TextField(name='title', value=doc.title)]
+        terms = set()
+        for field, text in sorted(doc.fields.iteritems()):
+            fields.append(search.TextField(name=field, value=text))
+            terms.update(tokenize(text))
+        fields.append(search.TextField(
+            name='prefixes', value=' '.join(sorted(prefixesOf(terms)))))
+        return search.Document(doc_id=doc.docId, fields=fields)
+
+    def put(self, docs):
+        docs = [self._document(doc) for doc in docs]
+        step = search.MAXIMUM_DOCUMENTS_PER_PUT_REQUEST
+        for i in range(0, len(docs), step):
+            self.index.put(docs[i:i + step])
+
+    def delete(self, doc_ids):
+        doc_ids = list(doc_ids)
+        step = search.MAXIMUM_DOCUMENTS_PER_PUT_REQUEST
+        for i in range(0, len(doc_ids), step):
+            self.index.delete(doc_ids[i:i + step])
+
+    def search(self, text, kind=None, limit=SEARCH_LIMIT):
+        terms, prefix = parseQuery(text)
+        if not (terms or prefix):
+            return []
+        parts = list(terms)
+        if prefix:
+            parts.append('prefixes:%s' % prefix[:MAX_PREFIX])
+        if kind:
+            parts.append('kind:%s' % kind)
+        query = search.Query(
+            query_string=' '.join(parts),
+            options=search.QueryOptions(
+                limit=limit, returned_fields=['kind', 'title'],
+                sort_options=search.SortOptions(
+                    match_scorer=search.MatchScorer(),
+                    expressions=[search.SortExpression(
+                        expression='_score', default_value=0.0,
+                        direction=search.SortExpression.DESCENDING)])))
+        hits = []
+        for doc in self.index.search(query).results:
+            fields = dict((f.name, f.value) for f in doc.fields)
+            hits.append(SearchHit(doc.doc_id, fields.get('kind'),
+                                  fields.get('title'),
+                                  doc.sort_scores[0] if doc.sort_scores
+                                  else 0.0))
+        return hits
+
+
+def getSearchIndex():
+    """Return the configured search backend."""
+    if SEARCH_BACKEND == 'searchapi':
+        return SearchApiIndex()
+    return LocalSearchIndex()
+
+
+# - - - incremental updates - - - - - - - - - - - - - - - - -
+
+def queueReindex(keys, transactional=False):
+    """Queue re-indexing of Conference/Session keys after a write."""
+    taskqueue.add(url=SEARCH_TASK_URL,
+                  params={'keys': ','.join(liveKey(k).urlsafe()
+                                           for k in keys)},
+                  transactional=transactional)
+
+
+def reindex(websafe_keys, index=None):
+    """Index the current state of live websafe keys; drop missing or
+    deleting entities from the index.
+    """
+    index = index or getSearchIndex()
+    keys = [ndb.Key(urlsafe=k) for k in websafe_keys]
+    docs = []
+    gone = []
+    for key, entity in zip(keys, getMultiWithArchive(keys)):
+        doc = documentFor(entity)
+        if doc:
+            docs.append(doc)
+        else:
+            gone.append(key.urlsafe())
+    if docs:
+        index.put(docs)
+    if gone:
+        index.delete(gone)
+
+
+def queueBackfill(kind, cursor=None):
+    params = {'kind': kind}
+    if cursor:
+        params['cursor'] = cursor
+    taskqueue.add(url=SEARCH_BACKFILL_URL, params=params)
+
+
+def backfillStep(kind, cursor=None, index=None):
+    """Index one page of a kind; return the cursor to continue from, or
+    None when the kind is done.
+    """
+    if kind not in BACKFILL_MODELS:
+        raise ValueError('unknown search backfill kind: %r' % kind)
+    start = Cursor(urlsafe=cursor) if cursor else None
+    keys, next_cursor, more = BACKFILL_MODELS[kind].query().fetch_page(
+        BACKFILL_PAGE, start_cursor=start, keys_only=True)
+    if keys:
+        reindex([liveKey(k).urlsafe() for k in keys], index)
+    return next_cursor.urlsafe() if more and next_cursor else None
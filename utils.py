@@ -3,7 +3,6 @@ import os
 import time
 import uuid
 
-from google.appengine.api import urlfetch
 from models import Profile
 from models import Conference
 
@@ -13,6 +12,8 @@ def getUserId(user, id_type="email"):
 
     if id_type == "oauth":
         """A workaround implementation for getting userid."""
+        # rarely used; keep urlfetch out of instance startup
+        from google.appengine.api import urlfetch
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
         token_type = 'id_token'
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+warmup.py -- per-instance warmup run by /_ah/warmup before an instance
+    takes traffic: imports the API modules, builds the message classes
+    & converters endpoints otherwise builds on first use, makes sure
+    the hot memcache entries exist and loads the conference catalog
+
+"""
+
+import importlib
+import logging
+import time
+
+import endpoints
+from protorpc import messages
+from protorpc import protojson
+
+from google.appengine.api import memcache
+
+# modules the /_ah/spi path needs; imported here when main.py does not
+WARM_MODULES = ('models', 'conference', 'querylog', 'instrumentation')
+
+
+def _importModules():
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+
+
+def _primeMessages():
+    """Build ResourceContainer request classes and run every message
+    class of models.py once through the JSON converter.
+    """
+    import conference
+    import models
+    for value in vars(conference).values():
+        if isinstance(value, endpoints.ResourceContainer):
+            value.combined_message_class
+    for value in vars(models).values():
+        if (isinstance(value, type) and issubclass(value, messages.Message)
+                and value is not messages.Message):
+            try:
+                protojson.decode_message(value, protojson.encode_message(
+                    value()))
+            except messages.ValidationError:
+                # required fields left unset; the field tables are built
+                pass
+
+
+def _prefetchMemcache():
+    """Recompute hot cache entries that were evicted."""
+    from conference import ConferenceApi
+    from conference import MEMCACHE_ANNOUNCEMENTS_KEY
+    from conference import MEMCACHE_SPEAKER_KEY
+    from facets import getFacetCounts
+    cached = memcache.get_multi([MEMCACHE_ANNOUNCEMENTS_KEY,
+                                 MEMCACHE_SPEAKER_KEY])
+    if MEMCACHE_ANNOUNCEMENTS_KEY not in cached:
+        ConferenceApi._cacheAnnouncement()
+    # the featured speaker can only be rebuilt by the next session create
+    getFacetCounts()
+
+
+def _loadCatalog():
+    """Fetch the conference snapshot queryConferences filters in memory,
+    or queue its build."""
+    from catalog import currentSnapshot
+    currentSnapshot()
+
+
+WARMUP_STEPS = (
+    ('imports', _importModules),
+    ('messages', _primeMessages),
+    ('memcache', _prefetchMemcache),
+    ('catalog', _loadCatalog),
+)
+
+
+def warmInstance():
+    """Run every warmup step; return {step: ms}. A failing step is
+    logged and skipped, since warmup must never keep an instance out of
+    service.
+    """
+    timings = {}
+    for name, step in WARMUP_STEPS:
+        start = time.time()
+        try:
+            step()
+        except Exception:
+            logging.exception('warmup step %s failed', name)
+        timings[name] = round((time.time() - start) * 1000.0, 3)
+    logging.info('warmup: %s', ', '.join(
+        '%s=%.1fms' % (n, timings[n]) for n, _ in WARMUP_STEPS))
+    return timings